@@ -0,0 +1,89 @@
+"""Benchmark del arranque de un worker: tiempo desde el inicio del proceso hasta que la aplicación
+está lista para atender (importar gambling.main y ejecutar el inicio del lifespan).
+
+Uso:
+    python -m benchmarks.bench_arranque [--workers 10]
+
+Cada worker es un intérprete nuevo, como los de uvicorn --workers. Por defecto usa una base SQLite
+temporal que se migra una sola vez antes de medir; con DATABASE_URL se puede apuntar a MySQL
+(ya migrada). Informa por fase la mediana y el máximo, y las consultas SQL y conexiones que se
+hicieron durante la importación (deberían ser 0).
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/bench_arranque.db"
+
+
+# Se ejecuta en cada worker: mide la importación y el inicio del lifespan por separado
+async def _worker(inicio_proceso: float):
+    inicio = time.perf_counter()
+    from config.db import engine
+    from config.metricas import registro
+    from gambling.main import app
+    importado = time.perf_counter()
+    medicion = {
+        "engine_al_importar": engine.creado,
+        "consultas_al_importar": registro.valor("db_consultas_total"),
+    }
+
+    async with app.router.lifespan_context(app):
+        listo = time.perf_counter()
+        medicion |= {
+            "interprete": (inicio - inicio_proceso) * 1000,
+            "importacion": (importado - inicio) * 1000,
+            "lifespan": (listo - importado) * 1000,
+            "total": (listo - inicio_proceso) * 1000,
+            "consultas_lifespan": registro.valor("db_consultas_total") - medicion["consultas_al_importar"],
+        }
+    print(json.dumps(medicion))
+
+
+def lanzar_worker() -> dict:
+    # El proceso anota su propio inicio con el reloj del sistema (perf_counter no es comparable
+    # entre procesos) y lo convierte a perf_counter al arrancar
+    codigo = (
+        "import time; _inicio = time.perf_counter() - (time.time() - float(__import__('sys').argv[1])); "
+        "import asyncio; from benchmarks.bench_arranque import _worker; asyncio.run(_worker(_inicio))"
+    )
+    salida = subprocess.run(
+        [sys.executable, "-c", codigo, str(time.time())],
+        capture_output=True, text=True, check=True, env=os.environ,
+    )
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+async def migrar_base():
+    from config.db import engine
+    from models.migraciones import migrar
+    await migrar()
+    await engine.dispose()
+
+
+def main(args):
+    asyncio.run(migrar_base())
+
+    mediciones = [lanzar_worker() for _ in range(args.workers)]
+
+    print(f"{'fase':>12} {'mediana ms':>11} {'máximo ms':>10}")
+    for fase in ("interprete", "importacion", "lifespan", "total"):
+        valores = [m[fase] for m in mediciones]
+        print(f"{fase:>12} {statistics.median(valores):>11.1f} {max(valores):>10.1f}")
+
+    print(f"engine creado al importar: {sum(m['engine_al_importar'] for m in mediciones)}/{len(mediciones)} workers")
+    print(f"consultas SQL al importar: {max(m['consultas_al_importar'] for m in mediciones):g}, "
+          f"en el lifespan: {statistics.median(m['consultas_lifespan'] for m in mediciones):g}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tiempo de arranque de un worker de la API")
+    parser.add_argument("--workers", type=int, default=10, help="workers (procesos) a medir, uno tras otro")
+    main(parser.parse_args())
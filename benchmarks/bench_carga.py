@@ -0,0 +1,299 @@
+"""Prueba de carga de la API: levanta la aplicación en el mismo proceso contra una base local,
+siembra usuarios y salas y lanza una mezcla de peticiones con la concurrencia indicada.
+
+Uso:
+    python -m benchmarks.bench_carga [--usuarios 500] [--salas 20] [--concurrencia 16]
+                                     [--duracion 15 | --peticiones 5000]
+                                     [--mezcla apostar=40,sala=20,...] [--semilla 1]
+                                     [--salida carga.json]
+
+Por defecto usa una base SQLite temporal; con DATABASE_URL se puede apuntar a MySQL.
+El resultado (peticiones por segundo, latencias p50/p95/p99 y consultas por petición de cada
+endpoint) se escribe en JSON con claves ordenadas para poder comparar versiones con un diff.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/bench_carga.db"
+
+import httpx
+from sqlalchemy import insert, select
+from config.db import DATABASE_URL, SessionLocal
+from models.migraciones import migrar
+from models.global_models import Usuario, Juegos, OpcionesApuestaJuegos, Apuesta
+from prolog.evento_ruleta import generar_codigo_sala
+from services.saldos import registrar_saldo_inicial
+from gambling.main import app
+
+# Peso de cada operación en la mezcla por defecto (tráfico dominado por apuestas y consultas)
+MEZCLA = {
+    "apostar": 35,
+    "sala": 25,
+    "simular": 15,
+    "usuario": 15,
+    "crear_usuario": 8,
+    "cerrar": 2,
+}
+
+LOTE = 5_000
+
+
+def percentil(ordenados: list[float], p: float) -> float:
+    # Percentil por rango más cercano sobre una lista ya ordenada
+    if not ordenados:
+        return 0.0
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+# Lee de /metrics los contadores por ruta: {(metodo, ruta): [peticiones, consultas]}
+def leer_metricas(texto: str) -> dict[tuple[str, str], list[float]]:
+    resultado: dict[tuple[str, str], list[float]] = {}
+    for linea in texto.splitlines():
+        if linea.startswith("http_peticion_duracion_segundos_count{"):
+            indice = 0
+        elif linea.startswith("http_consultas_db_total{"):
+            indice = 1
+        else:
+            continue
+        etiquetas, valor = linea[linea.index("{") + 1:].rsplit("} ", 1)
+        pares = dict(par.split("=", 1) for par in etiquetas.split(","))
+        clave = (pares["metodo"].strip('"'), pares["ruta"].strip('"'))
+        resultado.setdefault(clave, [0, 0])[indice] += float(valor)
+    return resultado
+
+
+async def sembrar(n_usuarios: int, n_salas: int):
+    await migrar()
+    async with SessionLocal() as db:
+        juego = Juegos(nombre_juego="Ruleta")
+        db.add(juego)
+        await db.flush()
+        for nombre in ("rojo", "negro", "verde"):
+            db.add(OpcionesApuestaJuegos(nombre_opcion=nombre, id_Juego=juego.id))
+        await db.flush()
+
+        prefijo = f"carga_{os.getpid()}_{int(time.time())}"
+        for inicio in range(0, n_usuarios, LOTE):
+            await db.execute(insert(Usuario), [
+                # Saldo alto para que las apuestas no fallen por saldo a mitad de la prueba
+                {"nickname": f"{prefijo}_{i}", "saldo_actual": 10_000_000}
+                for i in range(inicio, min(inicio + LOTE, n_usuarios))
+            ])
+        await registrar_saldo_inicial(db, Usuario.nickname.like(f"{prefijo}\\_%", escape="\\"))
+        await db.execute(insert(Apuesta), [
+            {"codigo_sala": generar_codigo_sala(), "id_juego": juego.id} for _ in range(n_salas)
+        ])
+        await db.commit()
+
+        uuids = (await db.execute(
+            select(Usuario.uuid).filter(Usuario.nickname.like(f"{prefijo}\\_%", escape="\\"))
+        )).scalars().all()
+        salas = (await db.execute(
+            select(Apuesta.codigo_sala).filter(Apuesta.is_abierta == True)
+        )).scalars().all()
+        opciones = (await db.execute(
+            select(OpcionesApuestaJuegos.id).filter(OpcionesApuestaJuegos.id_Juego == juego.id)
+        )).scalars().all()
+
+    return juego.id, list(uuids), list(salas), list(opciones)
+
+
+class Carga:
+
+    def __init__(self, cliente: httpx.AsyncClient, rng: random.Random, id_juego: int, uuids, salas, opciones):
+        self.cliente = cliente
+        self.rng = rng
+        self.id_juego = id_juego
+        self.uuids = uuids
+        self.salas = salas
+        self.opciones = opciones
+        self.latencias: dict[str, list[float]] = {}
+        self.estados: dict[str, dict[str, int]] = {}
+        self.contador = 0
+
+    async def medir(self, nombre: str, metodo: str, url: str, **kwargs) -> httpx.Response:
+        inicio = time.perf_counter()
+        respuesta = await self.cliente.request(metodo, url, **kwargs)
+        self.latencias.setdefault(nombre, []).append(time.perf_counter() - inicio)
+        estados = self.estados.setdefault(nombre, {})
+        estados[str(respuesta.status_code)] = estados.get(str(respuesta.status_code), 0) + 1
+        return respuesta
+
+    def _apuesta(self) -> dict:
+        return {
+            "uuid_usuario": self.rng.choice(self.uuids),
+            "codigo_sala": self.rng.choice(self.salas),
+            "opcion_apuesta": self.rng.choice(self.opciones),
+            "monto_apuesta": self.rng.randint(201, 2_000),
+        }
+
+    async def apostar(self):
+        await self.medir("POST /sala/apostar", "POST", "/sala/apostar", json=self._apuesta())
+
+    async def simular(self):
+        await self.medir("POST /sala/simular", "POST", "/sala/simular", json=self._apuesta())
+
+    async def sala(self):
+        await self.medir("GET /sala/{codigo_sala}", "GET", f"/sala/{self.rng.choice(self.salas)}")
+
+    async def usuario(self):
+        await self.medir("GET /usuario/{uuid}", "GET", f"/usuario/{self.rng.choice(self.uuids)}")
+
+    async def crear_usuario(self):
+        self.contador += 1
+        respuesta = await self.medir("POST /usuario", "POST", "/usuario", json={"nickname": f"nuevo_{os.getpid()}_{self.contador}_{self.rng.random()}"})
+        if respuesta.status_code == 201:
+            self.uuids.append(respuesta.json()["uuid"])
+
+    async def cerrar(self):
+        # Cierra una sala y abre otra en su lugar para mantener el número de salas abiertas
+        if len(self.salas) < 2:
+            return
+        codigo_sala = self.salas.pop(self.rng.randrange(len(self.salas)))
+        await self.medir("PATCH /admin/sala", "PATCH", "/admin/sala", json={"codigo_sala": codigo_sala})
+        respuesta = await self.medir("POST /admin/sala", "POST", "/admin/sala", json={"id_juego": self.id_juego})
+        if respuesta.status_code == 200:
+            self.salas.append(respuesta.json()["codigo_sala"])
+
+
+async def ejecutar(args) -> dict:
+    mezcla = dict(MEZCLA)
+    if args.mezcla:
+        mezcla = {nombre: float(peso) for nombre, peso in (par.split("=") for par in args.mezcla.split(","))}
+    operaciones = [nombre for nombre in mezcla if mezcla[nombre] > 0]
+    pesos = [mezcla[nombre] for nombre in operaciones]
+
+    id_juego, uuids, salas, opciones = await sembrar(args.usuarios, args.salas)
+
+    # El lifespan carga el catálogo y las salas abiertas, igual que al arrancar el servidor
+    async with app.router.lifespan_context(app):
+        # Los errores no controlados se cuentan como respuestas 500 en lugar de cortar la prueba
+        transporte = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://carga", timeout=None) as cliente:
+            carga = Carga(cliente, random.Random(args.semilla), id_juego, uuids, salas, opciones)
+            metricas_antes = leer_metricas((await cliente.get("/metrics")).text)
+
+            restantes = args.peticiones
+            fin = time.perf_counter() + args.duracion
+
+            async def trabajador():
+                nonlocal restantes
+                while True:
+                    if args.peticiones:
+                        if restantes <= 0:
+                            return
+                        restantes -= 1
+                    elif time.perf_counter() >= fin:
+                        return
+                    operacion = carga.rng.choices(operaciones, pesos)[0]
+                    await getattr(carga, operacion)()
+
+            inicio = time.perf_counter()
+            await asyncio.gather(*(trabajador() for _ in range(args.concurrencia)))
+            duracion = time.perf_counter() - inicio
+
+            metricas_despues = leer_metricas((await cliente.get("/metrics")).text)
+
+    endpoints = {}
+    for nombre, latencias in sorted(carga.latencias.items()):
+        latencias.sort()
+        metodo, ruta = nombre.split(" ", 1)
+        antes = metricas_antes.get((metodo, ruta), [0, 0])
+        despues = metricas_despues.get((metodo, ruta), [0, 0])
+        peticiones_servidor = despues[0] - antes[0]
+        endpoints[nombre] = {
+            "peticiones": len(latencias),
+            "peticiones_por_segundo": round(len(latencias) / duracion, 2),
+            "latencia_ms": {
+                "media": round(sum(latencias) / len(latencias) * 1000, 3),
+                "p50": round(percentil(latencias, 50) * 1000, 3),
+                "p95": round(percentil(latencias, 95) * 1000, 3),
+                "p99": round(percentil(latencias, 99) * 1000, 3),
+                "max": round(latencias[-1] * 1000, 3),
+            },
+            "consultas_por_peticion": round((despues[1] - antes[1]) / peticiones_servidor, 3) if peticiones_servidor else None,
+            "estados": carga.estados[nombre],
+        }
+
+    todas = sorted(l for latencias in carga.latencias.values() for l in latencias)
+    return {
+        "version": _version(),
+        "fecha": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "entorno": {
+            "python": platform.python_version(),
+            "base_de_datos": DATABASE_URL.split("://", 1)[0],
+        },
+        "configuracion": {
+            "usuarios": args.usuarios,
+            "salas": args.salas,
+            "concurrencia": args.concurrencia,
+            "duracion": None if args.peticiones else args.duracion,
+            "peticiones": args.peticiones or None,
+            "mezcla": mezcla,
+            "semilla": args.semilla,
+        },
+        "total": {
+            "peticiones": len(todas),
+            "segundos": round(duracion, 3),
+            "peticiones_por_segundo": round(len(todas) / duracion, 2),
+            "latencia_ms": {
+                "p50": round(percentil(todas, 50) * 1000, 3),
+                "p95": round(percentil(todas, 95) * 1000, 3),
+                "p99": round(percentil(todas, 99) * 1000, 3),
+            },
+        },
+        "endpoints": endpoints,
+    }
+
+
+def _version() -> str:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconocida"
+
+
+def imprimir(resultado: dict):
+    print(f"{'endpoint':<28} {'peticiones':>10} {'rps':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'consultas':>9}")
+    for nombre, datos in resultado["endpoints"].items():
+        latencia = datos["latencia_ms"]
+        consultas = datos["consultas_por_peticion"]
+        print(
+            f"{nombre:<28} {datos['peticiones']:>10} {datos['peticiones_por_segundo']:>9.1f} "
+            f"{latencia['p50']:>8.2f} {latencia['p95']:>8.2f} {latencia['p99']:>8.2f} "
+            f"{'-' if consultas is None else f'{consultas:.2f}':>9}"
+        )
+    total = resultado["total"]
+    print(f"{'total':<28} {total['peticiones']:>10} {total['peticiones_por_segundo']:>9.1f} "
+          f"{total['latencia_ms']['p50']:>8.2f} {total['latencia_ms']['p95']:>8.2f} {total['latencia_ms']['p99']:>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba de carga de la API con una base local")
+    parser.add_argument("--usuarios", type=int, default=500, help="usuarios sembrados antes de la prueba")
+    parser.add_argument("--salas", type=int, default=20, help="salas abiertas sembradas antes de la prueba")
+    parser.add_argument("--concurrencia", type=int, default=16, help="peticiones simultáneas")
+    parser.add_argument("--duracion", type=float, default=15, help="segundos de prueba")
+    parser.add_argument("--peticiones", type=int, default=0, help="total de peticiones (reemplaza a --duracion)")
+    parser.add_argument("--mezcla", help="pesos por operación, p. ej. apostar=40,sala=20 (" + ", ".join(MEZCLA) + ")")
+    parser.add_argument("--semilla", type=int, default=1, help="semilla de la elección de operaciones y datos")
+    parser.add_argument("--salida", default="carga.json", help="archivo JSON con los resultados")
+    args = parser.parse_args()
+
+    resultado = asyncio.run(ejecutar(args))
+    imprimir(resultado)
+    with open(args.salida, "w", encoding="utf-8") as archivo:
+        json.dump(resultado, archivo, indent=2, sort_keys=True, ensure_ascii=False)
+    print(f"\nResultados en {args.salida}")
@@ -0,0 +1,128 @@
+"""Benchmark de la ingesta de apuestas: las mismas apuestas concurrentes contra POST /sala/apostar
+con una transacción por apuesta y con la ingesta agrupada (APUESTAS_AGRUPADAS).
+
+Uso:
+    python -m benchmarks.bench_ingesta [--apuestas 5000] [--concurrencia 64] [--usuarios 1000]
+
+Por defecto usa una base SQLite temporal; con DATABASE_URL se puede apuntar a MySQL. Informa
+apuestas y commits por segundo, apuestas por commit y latencias p50/p99 de cada modo.
+"""
+import argparse
+import asyncio
+import math
+import os
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/bench_ingesta.db"
+
+import httpx
+from sqlalchemy import event, insert, select
+from config.db import engine, SessionLocal
+from models.migraciones import migrar
+from models.global_models import Usuario, Juegos, OpcionesApuestaJuegos, Apuesta
+from prolog.evento_ruleta import generar_codigo_sala
+from services.saldos import registrar_saldo_inicial
+from services.ingesta import ingesta_apuestas
+from gambling.main import app
+
+commits = 0
+
+@event.listens_for(engine.sync_engine, "commit")
+def contar_commit(*args):
+    global commits
+    commits += 1
+
+
+def percentil(ordenados: list[float], p: float) -> float:
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)] if ordenados else 0.0
+
+
+async def sembrar(n_usuarios: int, n_salas: int):
+    await migrar()
+    async with SessionLocal() as db:
+        juego = Juegos(nombre_juego="Ruleta")
+        db.add(juego)
+        await db.flush()
+        db.add(OpcionesApuestaJuegos(nombre_opcion="rojo", id_Juego=juego.id))
+
+        prefijo = f"ingesta_{os.getpid()}_{int(time.time())}"
+        await db.execute(insert(Usuario), [
+            {"nickname": f"{prefijo}_{i}", "saldo_actual": 10_000_000} for i in range(n_usuarios)
+        ])
+        await registrar_saldo_inicial(db, Usuario.nickname.like(f"{prefijo}\\_%", escape="\\"))
+        codigos = [generar_codigo_sala() for _ in range(n_salas)]
+        await db.execute(insert(Apuesta), [{"codigo_sala": codigo, "id_juego": juego.id} for codigo in codigos])
+        await db.commit()
+
+        uuids = (await db.execute(
+            select(Usuario.uuid).filter(Usuario.nickname.like(f"{prefijo}\\_%", escape="\\"))
+        )).scalars().all()
+        opcion = (await db.execute(
+            select(OpcionesApuestaJuegos.id).filter(OpcionesApuestaJuegos.id_Juego == juego.id)
+        )).scalar()
+
+    return list(uuids), codigos, opcion
+
+
+# Lanza las apuestas (cada usuario una vez por sala) con la concurrencia indicada
+async def medir(cliente: httpx.AsyncClient, apuestas: list[dict], concurrencia: int) -> dict:
+    global commits
+    pendientes = iter(apuestas)
+    latencias = []
+    estados: dict[int, int] = {}
+
+    async def trabajador():
+        for apuesta in pendientes:
+            inicio = time.perf_counter()
+            respuesta = await cliente.post("/sala/apostar", json=apuesta)
+            latencias.append(time.perf_counter() - inicio)
+            estados[respuesta.status_code] = estados.get(respuesta.status_code, 0) + 1
+
+    commits = 0
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabajador() for _ in range(concurrencia)))
+    duracion = time.perf_counter() - inicio
+
+    latencias.sort()
+    return {
+        "segundos": duracion,
+        "commits": commits,
+        "estados": estados,
+        "p50": percentil(latencias, 50) * 1000,
+        "p99": percentil(latencias, 99) * 1000,
+    }
+
+
+async def main(args):
+    salas_por_modo = math.ceil(args.apuestas / args.usuarios)
+    uuids, codigos, opcion = await sembrar(args.usuarios, 2 * salas_por_modo)
+
+    async with app.router.lifespan_context(app):
+        transporte = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://ingesta", timeout=None) as cliente:
+            print(f"{'modo':>10} {'apuestas':>9} {'segundos':>9} {'apuestas/s':>11} {'commits':>8} {'commits/s':>10} {'por commit':>11} {'p50 ms':>8} {'p99 ms':>8}  estados")
+            for indice, (nombre, agrupada) in enumerate((("individual", False), ("agrupada", True))):
+                await ingesta_apuestas.detener()
+                ingesta_apuestas.iniciar(agrupada)
+
+                salas = codigos[indice * salas_por_modo:(indice + 1) * salas_por_modo]
+                apuestas = [
+                    {"uuid_usuario": uuids[k % args.usuarios], "codigo_sala": salas[k // args.usuarios], "opcion_apuesta": opcion, "monto_apuesta": 250}
+                    for k in range(args.apuestas)
+                ]
+                r = await medir(cliente, apuestas, args.concurrencia)
+                print(
+                    f"{nombre:>10} {args.apuestas:>9} {r['segundos']:>9.3f} {args.apuestas / r['segundos']:>11.0f} "
+                    f"{r['commits']:>8} {r['commits'] / r['segundos']:>10.0f} {args.apuestas / max(r['commits'], 1):>11.1f} "
+                    f"{r['p50']:>8.2f} {r['p99']:>8.2f}  {r['estados']}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingesta de apuestas individual contra agrupada")
+    parser.add_argument("--apuestas", type=int, default=5000, help="apuestas por modo")
+    parser.add_argument("--concurrencia", type=int, default=64, help="peticiones simultáneas")
+    parser.add_argument("--usuarios", type=int, default=1000, help="usuarios sembrados (cada uno apuesta una vez por sala)")
+    asyncio.run(main(parser.parse_args()))
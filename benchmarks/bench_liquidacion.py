@@ -0,0 +1,113 @@
+"""Benchmark de cierre de salas: cierra y liquida salas con 10, 1k y 100k apuestas.
+
+Uso:
+    python -m benchmarks.bench_liquidacion [tamaños...]
+
+Por defecto usa una base SQLite temporal; con DATABASE_URL se puede apuntar a MySQL.
+"""
+import asyncio
+import os
+import sys
+import secrets
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/bench_liquidacion.db"
+
+from sqlalchemy import event, insert, select
+from config.db import engine, SessionLocal
+from models.migraciones import migrar
+from models.global_models import Usuario, Juegos, OpcionesApuestaJuegos, Apuesta, ApuestaUsuario
+from services.liquidacion import cerrar_sala_y_encolar, reservar_trabajo, liquidar_trabajo
+from prolog.evento_ruleta import generar_codigo_sala
+
+TAMANOS = [10, 1_000, 100_000]
+LOTE = 5_000
+
+consultas = 0
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def contar_consulta(*args):
+    global consultas
+    consultas += 1
+
+
+async def preparar_juego():
+    async with SessionLocal() as db:
+        juego = (await db.execute(select(Juegos).filter(Juegos.nombre_juego == "Ruleta"))).scalars().first()
+        if not juego:
+            juego = Juegos(nombre_juego="Ruleta")
+            db.add(juego)
+            await db.flush()
+            for nombre in ("rojo", "negro", "verde"):
+                db.add(OpcionesApuestaJuegos(nombre_opcion=nombre, id_Juego=juego.id))
+            await db.commit()
+        opciones = (await db.execute(
+            select(OpcionesApuestaJuegos.id).filter(OpcionesApuestaJuegos.id_Juego == juego.id)
+        )).scalars().all()
+        return juego.id, opciones
+
+
+async def sembrar_sala(id_juego, opciones, n_apuestas, prefijo):
+    async with SessionLocal() as db:
+        for inicio in range(0, n_apuestas, LOTE):
+            fin = min(inicio + LOTE, n_apuestas)
+            await db.execute(insert(Usuario), [
+                {"nickname": f"{prefijo}_{i}", "saldo_actual": 2000} for i in range(inicio, fin)
+            ])
+        ids_usuario = (await db.execute(
+            select(Usuario.id).filter(Usuario.nickname.like(f"{prefijo}\\_%", escape="\\"))
+        )).scalars().all()
+
+        sala = Apuesta(codigo_sala=generar_codigo_sala(), id_juego=id_juego)
+        db.add(sala)
+        await db.flush()
+
+        for inicio in range(0, len(ids_usuario), LOTE):
+            await db.execute(insert(ApuestaUsuario), [
+                {
+                    "id_usuario": id_usuario,
+                    "id_apuesta": sala.id,
+                    "opcion_apuesta": opciones[i % len(opciones)],
+                    "monto_apostado": 201 + i % 500,
+                    "is_gano": False,
+                }
+                for i, id_usuario in enumerate(ids_usuario[inicio:inicio + LOTE], start=inicio)
+            ])
+        await db.commit()
+        return sala.codigo_sala
+
+
+async def main(tamanos):
+    global consultas
+    await migrar()
+    id_juego, opciones = await preparar_juego()
+
+    # Cierre (fase de la petición HTTP) y liquidación (fase del trabajador) por separado
+    print(f"{'apuestas':>10} {'cierre s':>10} {'consultas':>10} {'liquidación s':>14} {'consultas':>10}")
+    for n in tamanos:
+        codigo_sala = await sembrar_sala(id_juego, opciones, n, f"b{n}_{secrets.token_hex(4)}")
+
+        consultas = 0
+        inicio = time.perf_counter()
+        async with SessionLocal() as db:
+            await cerrar_sala_y_encolar(db, codigo_sala)
+        duracion_cierre = time.perf_counter() - inicio
+        consultas_cierre = consultas
+
+        consultas = 0
+        inicio = time.perf_counter()
+        async with SessionLocal() as db:
+            id_trabajo = await reservar_trabajo(db, "benchmark")
+        async with SessionLocal() as db:
+            await liquidar_trabajo(db, id_trabajo)
+        duracion = time.perf_counter() - inicio
+
+        print(f"{n:>10} {duracion_cierre:>10.4f} {consultas_cierre:>10} {duracion:>14.4f} {consultas:>10}")
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main([int(x) for x in sys.argv[1:]] or TAMANOS))
@@ -0,0 +1,73 @@
+"""Benchmark de creación de salas: K salas una por una (una transacción por sala, como
+POST /admin/sala) contra un lote (una transacción, como POST /admin/salas).
+
+Uso:
+    python -m benchmarks.bench_salas [cantidad]
+
+Por defecto crea 10k salas con cada método en una base SQLite temporal; con DATABASE_URL se
+puede apuntar a MySQL.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/bench_salas.db"
+
+from sqlalchemy import event, select
+from config.db import engine, SessionLocal
+from models.migraciones import migrar
+from models.global_models import Juegos
+from services.salas import crear_salas
+
+CANTIDAD = 10_000
+
+consultas = 0
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def contar_consulta(*args):
+    global consultas
+    consultas += 1
+
+
+async def preparar_juego():
+    async with SessionLocal() as db:
+        juego = (await db.execute(select(Juegos).filter(Juegos.nombre_juego == "Ruleta"))).scalars().first()
+        if not juego:
+            juego = Juegos(nombre_juego="Ruleta")
+            db.add(juego)
+            await db.commit()
+        return juego.id
+
+
+async def una_por_una(id_juego, cantidad):
+    for _ in range(cantidad):
+        async with SessionLocal() as db:
+            await crear_salas(db, id_juego, 1)
+
+
+async def en_lote(id_juego, cantidad):
+    async with SessionLocal() as db:
+        await crear_salas(db, id_juego, cantidad)
+
+
+async def main(cantidad):
+    global consultas
+    await migrar()
+    id_juego = await preparar_juego()
+
+    print(f"{'método':>12} {'salas':>8} {'segundos':>10} {'salas/s':>10} {'consultas':>10}")
+    for nombre, metodo in (("una por una", una_por_una), ("lote", en_lote)):
+        consultas = 0
+        inicio = time.perf_counter()
+        await metodo(id_juego, cantidad)
+        duracion = time.perf_counter() - inicio
+        print(f"{nombre:>12} {cantidad:>8} {duracion:>10.3f} {cantidad / duracion:>10.0f} {consultas:>10}")
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else CANTIDAD))
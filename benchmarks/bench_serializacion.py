@@ -0,0 +1,98 @@
+"""Microbenchmark de serialización de la respuesta de GET /usuario/{uuid} con N filas de
+historial: el camino anterior (objeto ORM filtrado por __dict__, jsonable_encoder y json.dumps)
+contra el actual (filas como tuplas, modelo de respuesta de schemas/ y orjson).
+
+Uso:
+    python -m benchmarks.bench_serializacion [filas] [repeticiones]
+
+Cada camino reproduce lo que hace FastAPI con el valor devuelto por la ruta: sin response_model
+pasa el contenido por jsonable_encoder; con response_model lo valida y serializa con pydantic.
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/bench_serializacion.db"
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import TypeAdapter
+from models.global_models import Usuario
+from schemas.usuario import UsuarioHistorialRespuesta
+
+FILAS = 10_000
+REPETICIONES = 5
+
+
+def filas_historial(cantidad: int) -> list[tuple]:
+    # (codigo_sala, monto_apostado, is_abierta, juego, opcion, is_gano, created_at), como las
+    # devuelve la consulta del historial
+    inicio = datetime(2026, 1, 1)
+    return [
+        (f"S{i:07d}", Decimal("250.00") + i % 100, i % 10 == 0, "Ruleta", ("rojo", "negro", "verde")[i % 3], i % 2 == 0, inicio + timedelta(seconds=i))
+        for i in range(cantidad)
+    ]
+
+
+def antes(usuario: Usuario, filas: list[tuple]) -> bytes:
+    usuario_dict = {
+        key: value for key, value in usuario.__dict__.items()
+        if key != 'id' and not key.startswith('_')
+    }
+    usuario_dict["historial_apuestas"] = [
+        {"codigo_sala": f[0], "monto_apostado": f[1], "is_sala_abierta": f[2], "juego": f[3], "opcion_apuesta": f[4], "is_gano": f[5], "fecha": f[6]}
+        for f in filas
+    ]
+    usuario_dict["siguiente_cursor"] = None
+    return JSONResponse(jsonable_encoder(usuario_dict)).body
+
+
+adaptador = TypeAdapter(UsuarioHistorialRespuesta)
+
+
+def despues(usuario: tuple, filas: list[tuple]) -> bytes:
+    uuid, nickname, saldo_actual, created_at, updated_at = usuario
+    contenido = {
+        "uuid": uuid,
+        "nickname": nickname,
+        "saldo_actual": saldo_actual,
+        "created_at": created_at,
+        "updated_at": updated_at,
+        "historial_apuestas": [
+            {"codigo_sala": f[0], "monto_apostado": f[1], "is_sala_abierta": f[2], "juego": f[3], "opcion_apuesta": f[4], "is_gano": f[5], "fecha": f[6]}
+            for f in filas
+        ],
+        "siguiente_cursor": None,
+    }
+    return ORJSONResponse(adaptador.dump_python(adaptador.validate_python(contenido), mode="json")).body
+
+
+def medir(funcion, *args) -> tuple[float, int]:
+    mejor = float("inf")
+    for _ in range(REPETICIONES):
+        inicio = time.perf_counter()
+        cuerpo = funcion(*args)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor, len(cuerpo)
+
+
+def main(cantidad: int):
+    ahora = datetime(2026, 1, 1)
+    filas = filas_historial(cantidad)
+    usuario = Usuario(id=1, uuid="00000000-0000-0000-0000-000000000000", nickname="jugador", saldo_actual=Decimal("2000.00"), created_at=ahora, updated_at=ahora)
+    fila_usuario = (usuario.uuid, usuario.nickname, usuario.saldo_actual, ahora, ahora)
+
+    print(f"{'camino':>8} {'filas':>8} {'ms':>9} {'µs/fila':>9} {'bytes':>10}")
+    for nombre, funcion, args in (("antes", antes, (usuario, filas)), ("después", despues, (fila_usuario, filas))):
+        segundos, tamano = medir(funcion, *args)
+        print(f"{nombre:>8} {cantidad:>8} {segundos * 1000:>9.2f} {segundos / cantidad * 1e6:>9.2f} {tamano:>10}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        REPETICIONES = int(sys.argv[2])
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else FILAS)
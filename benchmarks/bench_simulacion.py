@@ -0,0 +1,52 @@
+"""Benchmark del simulador Monte Carlo: giros por segundo con NumPy frente a un bucle en Python.
+
+Uso:
+    python -m benchmarks.bench_simulacion [giros_numpy] [giros_python]
+"""
+import sys
+import time
+from prolog.evento_ruleta import tirar_ruleta, ganancia
+from prolog.simulacion_ruleta import simular_sala
+
+# Sala de ejemplo: 1000 apuestas repartidas entre los tres colores
+APUESTAS = 1_000
+MONTOS = [201 + (i * 37) % 800 for i in range(APUESTAS)]
+OPCIONES = [("rojo", "negro", "verde")[i % 3] for i in range(APUESTAS)]
+
+
+# Referencia en Python puro: un giro por iteración y el pago de cada apuesta con `ganancia`
+def simular_python(giros: int) -> float:
+    total = sum(MONTOS)
+    totales_color = {}
+    for monto, opcion in zip(MONTOS, OPCIONES):
+        totales_color[opcion] = totales_color.get(opcion, 0) + monto
+
+    pagos_esperados = [0.0] * APUESTAS
+    for _ in range(giros):
+        color = tirar_ruleta()
+        for i, (monto, opcion) in enumerate(zip(MONTOS, OPCIONES)):
+            if opcion == color:
+                pagos_esperados[i] += ganancia(monto, totales_color[color], total) / giros
+    return sum(pagos_esperados)
+
+
+def medir(funcion, giros: int) -> float:
+    inicio = time.perf_counter()
+    funcion(giros)
+    return giros / (time.perf_counter() - inicio)
+
+
+def main(giros_numpy: int, giros_python: int):
+    velocidad_python = medir(simular_python, giros_python)
+    velocidad_numpy = medir(lambda giros: simular_sala(MONTOS, OPCIONES, giros, semilla=1), giros_numpy)
+
+    print(f"apuestas por sala: {APUESTAS}")
+    print(f"{'motor':>8} {'giros':>12} {'giros/s':>14}")
+    print(f"{'python':>8} {giros_python:>12} {velocidad_python:>14,.0f}")
+    print(f"{'numpy':>8} {giros_numpy:>12} {velocidad_numpy:>14,.0f}")
+    print(f"aceleración: {velocidad_numpy / velocidad_python:,.0f}x")
+
+
+if __name__ == "__main__":
+    argumentos = [int(x) for x in sys.argv[1:]]
+    main(*(argumentos + [10_000_000, 20_000][len(argumentos):]))
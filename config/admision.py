@@ -0,0 +1,218 @@
+import asyncio
+import itertools
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+from starlette.routing import Match
+from config.db import DB_POOL_SIZE, DB_MAX_OVERFLOW
+from config.metricas import registro
+
+
+# Peticiones simultáneas admitidas entre todas las rutas controladas (por defecto, unas cuantas
+# por conexión del pool: parte de cada petición no usa la base de datos). 0 = sin control.
+ADMISION_CAPACIDAD = int(os.getenv("ADMISION_CAPACIDAD", str(4 * (DB_POOL_SIZE + DB_MAX_OVERFLOW))))
+
+# Máximo de peticiones esperando turno; al llenarse, una petición más prioritaria desplaza a la
+# espera menos prioritaria y las demás se rechazan
+ADMISION_COLA = int(os.getenv("ADMISION_COLA", "100"))
+
+# Segundos sugeridos al cliente en Retry-After cuando se rechaza una petición
+ADMISION_REINTENTO = int(os.getenv("ADMISION_REINTENTO", "1"))
+
+
+@dataclass(frozen=True)
+class ClaseAdmision:
+    nombre: str
+    prioridad: int      # menor = se atiende antes
+    limite: int         # peticiones simultáneas de la clase
+    espera: float       # segundos máximos en la cola antes de rechazarla
+
+
+def _clases(capacidad: int) -> dict[str, ClaseAdmision]:
+    mitad = max(1, capacidad // 2)
+    return {clase.nombre: clase for clase in (
+        ClaseAdmision("apuestas", 0, capacidad, 2.0),
+        ClaseAdmision("liquidacion", 0, capacidad, 5.0),
+        ClaseAdmision("operaciones", 1, mitad, 2.0),
+        ClaseAdmision("consultas", 2, capacidad, 1.0),
+        ClaseAdmision("historial", 3, mitad, 0.5),
+    )}
+
+
+# Clase de cada ruta controlada (método, plantilla). Las rutas que no figuran (streams, métricas
+# y tareas de administración con sesiones propias) no pasan por el control de admisión.
+RUTAS_ADMISION = {
+    ("POST", "/sala/apostar"): "apuestas",
+    ("POST", "/sala/apostar/batch"): "apuestas",
+    ("PATCH", "/admin/sala"): "liquidacion",
+    ("POST", "/usuario"): "operaciones",
+    ("POST", "/admin/sala"): "operaciones",
+    ("POST", "/admin/salas"): "operaciones",
+    ("GET", "/sala/{codigo_sala}"): "consultas",
+    ("POST", "/sala/simular"): "consultas",
+    ("GET", "/ranking"): "consultas",
+    ("GET", "/usuarios"): "historial",
+    ("GET", "/usuario/{uuid}"): "historial",
+    ("GET", "/usuario/{uuid}/estadisticas"): "historial",
+    ("GET", "/admin/usuario/{uuid}/saldo"): "historial",
+    ("GET", "/admin/usuario/{uuid}/movimientos"): "historial",
+}
+
+
+@dataclass(order=True)
+class EsperaAdmision:
+    prioridad: int
+    orden: int
+    clase: ClaseAdmision = field(compare=False)
+    # Se resuelve con None al admitirla o con el motivo si se la desplaza
+    resultado: asyncio.Future = field(compare=False, default_factory=lambda: asyncio.get_running_loop().create_future())
+
+
+class ControlAdmision:
+    """Limita las peticiones simultáneas (en total y por clase) delante del pool de conexiones.
+
+    Las que no tienen lugar esperan en una cola acotada, ordenada por prioridad de la clase y
+    por llegada, hasta el plazo de su clase; al liberarse un lugar se admite la espera más
+    prioritaria cuya clase no haya llegado a su límite.
+    """
+
+    def __init__(self, capacidad: int = ADMISION_CAPACIDAD, max_cola: int = ADMISION_COLA):
+        self.capacidad = capacidad
+        self.max_cola = max_cola
+        self.clases = _clases(capacidad)
+        self.en_curso = dict.fromkeys(self.clases, 0)
+        self.en_cola = dict.fromkeys(self.clases, 0)
+        self._total = 0
+        self._cola: list[EsperaAdmision] = []
+        self._orden = itertools.count()
+
+    def _hay_lugar(self, clase: ClaseAdmision) -> bool:
+        return self._total < self.capacidad and self.en_curso[clase.nombre] < clase.limite
+
+    def _admitir(self, clase: ClaseAdmision):
+        self._total += 1
+        self.en_curso[clase.nombre] += 1
+
+    def _quitar(self, espera: EsperaAdmision):
+        self._cola.remove(espera)
+        self.en_cola[espera.clase.nombre] -= 1
+
+    # Espera un lugar para la petición. Devuelve None si fue admitida o el motivo del rechazo.
+    async def entrar(self, clase: ClaseAdmision) -> Optional[str]:
+        # Sin esperas de la misma clase delante (las de otras clases, si quedan, están frenadas
+        # por el límite de su clase)
+        if self._hay_lugar(clase) and not self.en_cola[clase.nombre]:
+            self._admitir(clase)
+            return None
+
+        if len(self._cola) >= self.max_cola:
+            peor = max(self._cola)
+            if peor.prioridad <= clase.prioridad:
+                return "cola_llena"
+            self._quitar(peor)
+            peor.resultado.set_result("desplazada")
+
+        espera = EsperaAdmision(clase.prioridad, next(self._orden), clase)
+        self._cola.append(espera)
+        self.en_cola[clase.nombre] += 1
+
+        inicio = time.perf_counter()
+        try:
+            return await asyncio.wait_for(espera.resultado, clase.espera)
+        except asyncio.TimeoutError:
+            # En Python 3.12+ wait_for puede vencer con el futuro ya resuelto: si salir() la admitió
+            # justo al vencer el plazo, se devuelve el lugar
+            if self._admitida(espera):
+                self.salir(clase)
+            return "plazo"
+        except asyncio.CancelledError:
+            # El cliente se fue justo después de ser admitido: se devuelve el lugar
+            if self._admitida(espera):
+                self.salir(clase)
+            raise
+        finally:
+            registro.observar("admision_espera_segundos", time.perf_counter() - inicio, clase.nombre)
+            if espera in self._cola:
+                self._quitar(espera)
+
+    @staticmethod
+    def _admitida(espera: EsperaAdmision) -> bool:
+        return espera.resultado.done() and not espera.resultado.cancelled() and espera.resultado.result() is None
+
+    def salir(self, clase: ClaseAdmision):
+        self._total -= 1
+        self.en_curso[clase.nombre] -= 1
+
+        for espera in sorted(self._cola):
+            if self._total >= self.capacidad:
+                break
+            if espera.resultado.done() or not self._hay_lugar(espera.clase):
+                continue
+            self._quitar(espera)
+            self._admitir(espera.clase)
+            espera.resultado.set_result(None)
+
+    def medidores(self) -> dict:
+        return {
+            "admision_en_curso": ("Peticiones admitidas en curso por clase", ("clase",), {(n,): v for n, v in self.en_curso.items()}),
+            "admision_en_cola": ("Peticiones esperando turno por clase", ("clase",), {(n,): v for n, v in self.en_cola.items()}),
+        }
+
+
+control_admision = ControlAdmision()
+
+
+class MiddlewareAdmision:
+    """Middleware ASGI del control de admisión: las peticiones de RUTAS_ADMISION esperan su turno
+    en control_admision, y si no lo obtienen a tiempo reciben un 503 inmediato con Retry-After
+    en lugar de acumularse esperando una conexión del pool."""
+
+    def __init__(self, app, rutas: list, control: ControlAdmision = control_admision):
+        self.app = app
+        self.rutas = rutas
+        self.control = control
+
+    def _clase(self, scope) -> Optional[ClaseAdmision]:
+        for ruta in self.rutas:
+            coincidencia, hijo = ruta.matches(scope)
+            if coincidencia == Match.FULL:
+                nombre = RUTAS_ADMISION.get((scope["method"], getattr(ruta, "path", None)))
+                if nombre:
+                    # La ruta queda en el scope para que las métricas etiqueten también los rechazos
+                    scope.update(hijo)
+                    return self.control.clases[nombre]
+                return None
+        return None
+
+    async def __call__(self, scope, receive, send):
+        clase = self._clase(scope) if scope["type"] == "http" and self.control.capacidad > 0 else None
+        if clase is None:
+            await self.app(scope, receive, send)
+            return
+
+        motivo = await self.control.entrar(clase)
+        if motivo:
+            registro.incrementar("admision_rechazadas_total", 1, clase.nombre, motivo)
+            await _rechazar(send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.control.salir(clase)
+
+
+async def _rechazar(send):
+    cuerpo = json.dumps({"detail": "Servidor saturado, intenta de nuevo en unos segundos"}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(cuerpo)).encode()),
+            (b"retry-after", str(ADMISION_REINTENTO).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": cuerpo})
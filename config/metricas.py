@@ -0,0 +1,186 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+# Umbral (milisegundos) a partir del cual una petición se registra en el log de peticiones
+# lentas junto con las sentencias SQL que ejecutó (0 = desactivado)
+METRICAS_LENTO_MS = float(os.getenv("METRICAS_LENTO_MS", "0"))
+
+# Máximo de sentencias SQL que se guardan por petición para el log de peticiones lentas
+METRICAS_MAX_SENTENCIAS = 50
+
+# Límites de los buckets (segundos) de los histogramas de latencia
+BUCKETS_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histograma:
+
+    def __init__(self, buckets=BUCKETS_LATENCIA):
+        self.buckets = buckets
+        self.conteos = [0] * (len(buckets) + 1)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor: float):
+        self.conteos[bisect_left(self.buckets, valor)] += 1
+        self.suma += valor
+        self.total += 1
+
+
+# Registro de métricas del proceso. Cada métrica es un diccionario indexado por la tupla de
+# valores de sus etiquetas; el lock protege las observaciones que llegan desde otros hilos
+class RegistroMetricas:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histogramas: dict[str, tuple[str, tuple, dict]] = {}
+        self._contadores: dict[str, tuple[str, tuple, dict]] = {}
+
+    def histograma(self, nombre: str, ayuda: str, etiquetas: tuple = ()):
+        self._histogramas[nombre] = (ayuda, etiquetas, {})
+
+    def contador(self, nombre: str, ayuda: str, etiquetas: tuple = ()):
+        self._contadores[nombre] = (ayuda, etiquetas, {})
+
+    def observar(self, nombre: str, valor: float, *valores_etiquetas):
+        series = self._histogramas[nombre][2]
+        with self._lock:
+            histograma = series.get(valores_etiquetas)
+            if histograma is None:
+                histograma = series[valores_etiquetas] = Histograma()
+            histograma.observar(valor)
+
+    def incrementar(self, nombre: str, valor: float = 1, *valores_etiquetas):
+        series = self._contadores[nombre][2]
+        with self._lock:
+            series[valores_etiquetas] = series.get(valores_etiquetas, 0) + valor
+
+    def valor(self, nombre: str, *valores_etiquetas) -> float:
+        return self._contadores[nombre][2].get(valores_etiquetas, 0)
+
+    # Exporta todas las métricas en el formato de texto de Prometheus. Cada medidor es
+    # (ayuda, valor) o, con etiquetas, (ayuda, etiquetas, {valores_etiquetas: valor})
+    def exportar(self, medidores: Optional[dict[str, tuple]] = None) -> str:
+        lineas = []
+        with self._lock:
+            for nombre, (ayuda, etiquetas, series) in self._contadores.items():
+                lineas.append(f"# HELP {nombre} {ayuda}")
+                lineas.append(f"# TYPE {nombre} counter")
+                for valores, valor in series.items():
+                    lineas.append(f"{nombre}{_etiquetas(etiquetas, valores)} {valor:g}")
+
+            for nombre, (ayuda, etiquetas, series) in self._histogramas.items():
+                lineas.append(f"# HELP {nombre} {ayuda}")
+                lineas.append(f"# TYPE {nombre} histogram")
+                for valores, histograma in series.items():
+                    acumulado = 0
+                    for limite, conteo in zip(histograma.buckets + ("+Inf",), histograma.conteos):
+                        acumulado += conteo
+                        le = limite if isinstance(limite, str) else f"{limite:g}"
+                        lineas.append(f"{nombre}_bucket{_etiquetas(etiquetas + ('le',), valores + (le,))} {acumulado}")
+                    lineas.append(f"{nombre}_sum{_etiquetas(etiquetas, valores)} {histograma.suma:g}")
+                    lineas.append(f"{nombre}_count{_etiquetas(etiquetas, valores)} {histograma.total}")
+
+        for nombre, medidor in (medidores or {}).items():
+            ayuda, etiquetas, series = medidor if len(medidor) == 3 else (medidor[0], (), {(): medidor[1]})
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} gauge")
+            for valores, valor in series.items():
+                lineas.append(f"{nombre}{_etiquetas(etiquetas, valores)} {valor:g}")
+
+        return "\n".join(lineas) + "\n"
+
+
+def _etiquetas(nombres: tuple, valores: tuple) -> str:
+    if not nombres:
+        return ""
+    pares = []
+    for nombre, valor in zip(nombres, valores):
+        valor = str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pares.append(f'{nombre}="{valor}"')
+    return "{" + ",".join(pares) + "}"
+
+
+registro = RegistroMetricas()
+
+registro.histograma("http_peticion_duracion_segundos", "Latencia de las peticiones HTTP por ruta y código de estado", ("metodo", "ruta", "estado"))
+registro.contador("http_consultas_db_total", "Consultas SQL ejecutadas por las peticiones de cada ruta", ("metodo", "ruta"))
+registro.contador("http_tiempo_db_segundos_total", "Tiempo en la base de datos de las peticiones de cada ruta", ("metodo", "ruta"))
+registro.contador("db_consultas_total", "Consultas SQL ejecutadas por el proceso")
+registro.histograma("db_consulta_duracion_segundos", "Duración de cada consulta SQL")
+registro.histograma("db_pool_espera_segundos", "Espera para obtener una conexión del pool")
+registro.contador("db_pool_timeouts_total", "Peticiones de conexión que agotaron DB_POOL_TIMEOUT")
+registro.contador("db_lecturas_total", "Sesiones de las rutas de lectura según la base a la que fueron (réplica o primario)", ("destino",))
+registro.contador("ingesta_lotes_total", "Transacciones de la ingesta agrupada de apuestas")
+registro.contador("ingesta_apuestas_total", "Apuestas confirmadas por la ingesta agrupada (dividir por ingesta_lotes_total para el tamaño medio del lote)")
+registro.contador("admision_rechazadas_total", "Peticiones rechazadas con 503 por el control de admisión, por clase y motivo (cola_llena, plazo o desplazada)", ("clase", "motivo"))
+registro.histograma("admision_espera_segundos", "Espera en la cola del control de admisión por clase", ("clase",))
+registro.contador("liquidacion_trabajos_fallidos_total", "Trabajos de liquidación dados por fallidos, por motivo (error en el último intento o turno_vencido)", ("motivo",))
+registro.contador("idempotencia_respuestas_total", "Peticiones con Idempotency-Key: nuevas, repetidas desde el almacén o que esperaron a la original", ("ruta", "resultado"))
+
+
+# Datos de la petición en curso. Las tareas y greenlets que lanza la petición heredan el
+# contexto, así que los eventos del engine pueden sumar sus consultas a la petición
+@dataclass
+class MetricasPeticion:
+    consultas: int = 0
+    tiempo_db: float = 0.0
+    espera_pool: float = 0.0
+    sentencias: list[str] = field(default_factory=list)
+
+
+peticion_actual: ContextVar[Optional[MetricasPeticion]] = ContextVar("peticion_actual", default=None)
+
+
+logger = logging.getLogger("gambling.metricas")
+
+
+class MiddlewareMetricas:
+    """Middleware ASGI que mide cada petición HTTP: latencia por ruta y estado, y las consultas
+    y el tiempo de base de datos que generó. La ruta se etiqueta con su plantilla
+    (`/usuario/{uuid}`) para no crear una serie por cada valor."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        peticion = MetricasPeticion()
+        token = peticion_actual.set(peticion)
+        inicio = time.perf_counter()
+        estado = 500
+
+        async def enviar(mensaje):
+            nonlocal estado
+            if mensaje["type"] == "http.response.start":
+                estado = mensaje["status"]
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            peticion_actual.reset(token)
+            duracion = time.perf_counter() - inicio
+            ruta = getattr(scope.get("route"), "path", "sin_ruta")
+            metodo = scope["method"]
+
+            registro.observar("http_peticion_duracion_segundos", duracion, metodo, ruta, estado)
+            registro.incrementar("http_consultas_db_total", peticion.consultas, metodo, ruta)
+            registro.incrementar("http_tiempo_db_segundos_total", peticion.tiempo_db, metodo, ruta)
+
+            if METRICAS_LENTO_MS > 0 and duracion * 1000 >= METRICAS_LENTO_MS:
+                logger.warning(
+                    "Petición lenta %s %s -> %s en %.1fms (%d consultas, %.1fms en la base de datos, %.1fms esperando el pool)\n  %s",
+                    metodo, scope["path"], estado, duracion * 1000, peticion.consultas,
+                    peticion.tiempo_db * 1000, peticion.espera_pool * 1000,
+                    "\n  ".join(peticion.sentencias) or "(sin consultas)",
+                )
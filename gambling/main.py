@@ -1,9 +1,66 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, ORJSONResponse
+from config.db import engine, engine_replica, SessionLocal, estado_pool, iniciar_engines, cerrar_engines
+from config.metricas import registro, MiddlewareMetricas
+from config.admision import control_admision, MiddlewareAdmision
+from models.migraciones import comprobar_esquema
+from services.catalogo import catalogo
+from services.pozos import tracker_salas
+from services.trabajadores import trabajadores_liquidacion
+from services.agenda import agenda_salas
+from services.saldos import snapshots_saldo
+from services.archivo import archivo_salas
+from services.ingesta import ingesta_apuestas
+from services.difusion import difusor_salas
 from routes.usuario import router_usuario
 from routes.admin import router_admin
+from routes.estadisticas import router_estadisticas
 from starlette.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Los motores se crean aquí y no al importar (importar la app no abre conexiones ni carga el
+    # driver). El esquema lo crea `python -m models.migraciones`: al iniciar solo se comprueba
+    # su versión, sin DDL
+    iniciar_engines()
+    await comprobar_esquema()
+
+    # Cargar en memoria el catálogo de juegos y los agregados de las salas abiertas
+    async with SessionLocal() as db:
+        await catalogo.recargar(db)
+        await tracker_salas.cargar(db)
+
+    # Ingesta agrupada de apuestas (solo con APUESTAS_AGRUPADAS=1)
+    ingesta_apuestas.iniciar()
+
+    # Trabajadores de liquidación de salas cerradas (cola en la tabla Trabajo_Liquidacion)
+    trabajadores_liquidacion.iniciar()
+
+    # Cierre automático de salas programadas (la agenda se recupera desde la base de datos)
+    agenda_salas.iniciar()
+
+    # Snapshots periódicos del libro de saldos
+    snapshots_saldo.iniciar()
+
+    # Archivo periódico de las salas liquidadas antiguas
+    archivo_salas.iniciar()
+
+    # Refresco de las salas con suscriptores a sus streams
+    difusor_salas.iniciar()
+
+    yield
+    await difusor_salas.detener()
+    await archivo_salas.detener()
+    await snapshots_saldo.detener()
+    await agenda_salas.detener()
+    await trabajadores_liquidacion.detener()
+    await ingesta_apuestas.detener()
+    await cerrar_engines()
+
+# orjson para serializar las respuestas JSON (las rutas con response_model se serializan con pydantic)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Configurar CORS
 app.add_middleware(
@@ -14,5 +71,23 @@ app.add_middleware(
     allow_headers=["*"],  # Permitir todos los encabezados
 )
 
+# Control de admisión delante del pool de conexiones (límites por clase de ruta, cola con plazo
+# y prioridad de las apuestas y la liquidación sobre las consultas de historial)
+app.add_middleware(MiddlewareAdmision, rutas=app.router.routes)
+
+# Métricas por ruta y por consulta (se expone en /metrics); envuelve al control de admisión
+# para medir también los rechazos
+app.add_middleware(MiddlewareMetricas)
+
 app.include_router(router_usuario)
 app.include_router(router_admin)
+app.include_router(router_estadisticas)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metricas():
+    # Formato de texto de Prometheus
+    medidores = estado_pool(engine) | control_admision.medidores()
+    if engine_replica is not engine:
+        medidores |= estado_pool(engine_replica, "db_replica_pool", "del pool de la réplica")
+    return PlainTextResponse(registro.exportar(medidores), media_type="text/plain; version=0.0.4")
@@ -1,13 +1,22 @@
-from sqlalchemy import Column, Integer, String, DECIMAL, TIMESTAMP, ForeignKey, UniqueConstraint, DateTime, Boolean
+from uuid import uuid4
+from sqlalchemy import Column, Integer, String, DECIMAL, TIMESTAMP, ForeignKey, UniqueConstraint, Index, DateTime, Boolean
 from sqlalchemy.sql import func
-from config.db import Base, engine
+from config.db import Base
 from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.sqlite import DATETIME as SQLITE_DATETIME
+
+# TIMESTAMP con precisión de segundos también en SQLite, para que las fechas enviadas como
+# parámetro coincidan con las generadas por CURRENT_TIMESTAMP (necesario para los cursores)
+TIMESTAMP_SEGUNDOS = TIMESTAMP().with_variant(
+    SQLITE_DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite"
+)
 
 class Usuario(Base):
     __tablename__ = 'Usuario'
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    uuid = Column(String(36), nullable=False, unique=True, server_default=func.uuid())  # Genera el valor en el DDL
+    uuid = Column(String(36), nullable=False, unique=True, server_default=func.uuid(), default=lambda: str(uuid4()))  # Genera el valor en el DDL (y en Python para motores sin uuid())
     nickname = Column(String(50), nullable=False, unique=True)
     saldo_actual = Column(DECIMAL(10, 2), nullable=False, server_default="2000.00")  # Valor predeterminado en la base de datos
     created_at = Column(TIMESTAMP, nullable=False, server_default=func.current_timestamp())  # Timestamp gestionado por la base de datos
@@ -40,12 +49,18 @@ class OpcionesApuestaJuegos(Base):
 
 class Apuesta(Base):
     __tablename__ = 'Apuesta'
+    __table_args__ = (
+        # Salas abiertas (carga del tracker y de la agenda) y cerradas por antigüedad (archivo)
+        Index('ix_apuesta_abierta_actualizada', 'is_abierta', 'updated_at'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     codigo_sala = Column(String(8), nullable=False, unique=True)
     is_abierta = Column(Boolean, default=True)
     resultado = Column(Integer, ForeignKey('Opciones_Apuesta_Juegos.id', ondelete="RESTRICT", onupdate="CASCADE"), nullable=True)
     id_juego = Column(Integer, ForeignKey('Juegos.id', ondelete="CASCADE", onupdate="CASCADE"), nullable=False)
+    cierra_en = Column(DateTime, nullable=True, index=True)  # Cierre automático (UTC); NULL = solo cierre manual
+    intervalo_segundos = Column(Integer, nullable=True)  # Duración de cada ronda; al cerrar se abre la siguiente
     created_at = Column(TIMESTAMP, server_default=func.current_timestamp(), nullable=True)
     updated_at = Column(TIMESTAMP, server_default=func.current_timestamp(), onupdate=func.current_timestamp(), nullable=True)
 
@@ -55,6 +70,14 @@ class Apuesta(Base):
     
 class ApuestaUsuario(Base):
     __tablename__ = 'Apuesta_Usuario'
+    __table_args__ = (
+        # Un usuario solo puede apostar una vez por sala
+        UniqueConstraint('id_usuario', 'id_apuesta', name='uq_apuesta_usuario_sala'),
+        # Totales por opción de una sala (pozo en memoria y liquidación)
+        Index('ix_apuesta_usuario_sala_opcion', 'id_apuesta', 'opcion_apuesta'),
+        # Historial de un usuario por fecha
+        Index('ix_apuesta_usuario_usuario_fecha', 'id_usuario', 'created_at'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     id_usuario = Column(Integer, ForeignKey('Usuario.id', ondelete="CASCADE", onupdate="CASCADE"), nullable=False)
@@ -63,7 +86,7 @@ class ApuestaUsuario(Base):
     monto_apostado = Column(DECIMAL(10, 2), nullable=False)
     is_gano = Column(Boolean, nullable=False)
     monto_ganado = Column(DECIMAL(10,2), nullable=True)
-    created_at = Column(TIMESTAMP, server_default=func.current_timestamp(), nullable=True)
+    created_at = Column(TIMESTAMP_SEGUNDOS, server_default=func.current_timestamp(), nullable=True)
     updated_at = Column(TIMESTAMP, server_default=func.current_timestamp(), onupdate=func.current_timestamp(), nullable=True)
 
     # Relaciones
@@ -71,5 +94,101 @@ class ApuestaUsuario(Base):
     apuesta = relationship("Apuesta", back_populates="apuestas_usuario")
     opcion_apuesta_rel = relationship("OpcionesApuestaJuegos", back_populates="apuestas_usuario")
 
-# Crear el esquema en la base de datos
-Base.metadata.create_all(engine)
\ No newline at end of file
+# Tablas de archivo: salas liquidadas hace más de ARCHIVO_EDAD segundos y sus apuestas, con los
+# mismos ids, fuera de las tablas que recorren las consultas de salas abiertas
+class ApuestaArchivo(Base):
+    __tablename__ = 'Apuesta_Archivo'
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    codigo_sala = Column(String(8), nullable=False, unique=True)
+    is_abierta = Column(Boolean, default=False)
+    resultado = Column(Integer, ForeignKey('Opciones_Apuesta_Juegos.id', ondelete="RESTRICT", onupdate="CASCADE"), nullable=True)
+    id_juego = Column(Integer, ForeignKey('Juegos.id', ondelete="CASCADE", onupdate="CASCADE"), nullable=False)
+    cierra_en = Column(DateTime, nullable=True)
+    intervalo_segundos = Column(Integer, nullable=True)
+    created_at = Column(TIMESTAMP, nullable=True)
+    updated_at = Column(TIMESTAMP, nullable=True)
+
+class ApuestaUsuarioArchivo(Base):
+    __tablename__ = 'Apuesta_Usuario_Archivo'
+    __table_args__ = (
+        Index('ix_apuesta_usuario_archivo_usuario_fecha', 'id_usuario', 'created_at'),
+        Index('ix_apuesta_usuario_archivo_sala', 'id_apuesta'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    id_usuario = Column(Integer, ForeignKey('Usuario.id', ondelete="CASCADE", onupdate="CASCADE"), nullable=False)
+    id_apuesta = Column(Integer, ForeignKey('Apuesta_Archivo.id', ondelete="CASCADE", onupdate="CASCADE"), nullable=False)
+    opcion_apuesta = Column(Integer, ForeignKey('Opciones_Apuesta_Juegos.id', ondelete="RESTRICT", onupdate="CASCADE"), nullable=False)
+    monto_apostado = Column(DECIMAL(10, 2), nullable=False)
+    is_gano = Column(Boolean, nullable=False)
+    monto_ganado = Column(DECIMAL(10,2), nullable=True)
+    created_at = Column(TIMESTAMP_SEGUNDOS, nullable=True)
+    updated_at = Column(TIMESTAMP, nullable=True)
+
+class TrabajoLiquidacion(Base):
+    __tablename__ = 'Trabajo_Liquidacion'
+
+    # Cola de liquidaciones: una fila por sala cerrada, tomada por los trabajadores de liquidación
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    id_apuesta = Column(Integer, ForeignKey('Apuesta.id', ondelete="CASCADE", onupdate="CASCADE"), nullable=False, unique=True)
+    estado = Column(String(20), nullable=False, default="pendiente", index=True)  # pendiente, en_proceso, completado, fallido
+    intentos = Column(Integer, nullable=False, default=0)
+    trabajador = Column(String(100), nullable=True)
+    bloqueado_hasta = Column(DateTime, nullable=True)  # Vencimiento del turno del trabajador (UTC); vencido, otro puede reintentar
+    error = Column(String(500), nullable=True)
+    completado_en = Column(DateTime, nullable=True)
+    created_at = Column(TIMESTAMP, server_default=func.current_timestamp(), nullable=True)
+    updated_at = Column(TIMESTAMP, server_default=func.current_timestamp(), onupdate=func.current_timestamp(), nullable=True)
+
+    apuesta = relationship("Apuesta")
+
+class MovimientoSaldo(Base):
+    __tablename__ = 'Movimiento_Saldo'
+    __table_args__ = (
+        # Movimientos de un usuario en orden, para repasar la cola posterior a su último snapshot
+        Index('ix_movimiento_saldo_usuario', 'id_usuario', 'id'),
+    )
+
+    # Libro de saldos (solo inserciones): cada cambio de Usuario.saldo_actual deja aquí su motivo
+    # en la misma transacción. La suma de los movimientos de un usuario es su saldo.
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    id_usuario = Column(Integer, ForeignKey('Usuario.id', ondelete="CASCADE", onupdate="CASCADE"), nullable=False)
+    id_apuesta = Column(Integer, nullable=True)  # Sala de la apuesta o del premio (sin FK: la sala puede pasar a Apuesta_Archivo)
+    tipo = Column(String(20), nullable=False)  # saldo_inicial, apuesta, premio, reembolso
+    monto = Column(DECIMAL(12, 2), nullable=False)  # Negativo para los débitos
+    created_at = Column(TIMESTAMP, server_default=func.current_timestamp(), nullable=True)
+
+class SnapshotSaldo(Base):
+    __tablename__ = 'Snapshot_Saldo'
+    __table_args__ = (
+        UniqueConstraint('id_usuario', 'id_movimiento', name='uq_snapshot_saldo_usuario_movimiento'),
+    )
+
+    # Saldo de un usuario según el libro hasta el movimiento id_movimiento (inclusive)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    id_usuario = Column(Integer, ForeignKey('Usuario.id', ondelete="CASCADE", onupdate="CASCADE"), nullable=False)
+    id_movimiento = Column(Integer, nullable=False)
+    saldo = Column(DECIMAL(12, 2), nullable=False)
+    created_at = Column(TIMESTAMP, server_default=func.current_timestamp(), nullable=True)
+
+class EstadisticaUsuario(Base):
+    __tablename__ = 'Estadistica_Usuario'
+    __table_args__ = (
+        # Rankings de un periodo: los N primeros se leen en orden del índice
+        Index('ix_estadistica_periodo_ganancia', 'periodo', 'ganancia_neta'),
+        Index('ix_estadistica_periodo_apostado', 'periodo', 'total_apostado'),
+        Index('ix_estadistica_periodo_tasa', 'periodo', 'tasa_victorias'),
+    )
+
+    # Agregados por usuario y periodo ("total", "dia:AAAA-MM-DD" o "semana:AAAA-Wnn"), mantenidos
+    # de forma incremental al apostar y al liquidar
+    id_usuario = Column(Integer, ForeignKey('Usuario.id', ondelete="CASCADE", onupdate="CASCADE"), primary_key=True)
+    periodo = Column(String(16), primary_key=True)
+    apuestas = Column(Integer, nullable=False, default=0)
+    liquidadas = Column(Integer, nullable=False, default=0)
+    ganadas = Column(Integer, nullable=False, default=0)
+    total_apostado = Column(DECIMAL(14, 2), nullable=False, default=0)
+    total_ganado = Column(DECIMAL(14, 2), nullable=False, default=0)  # Premios cobrados
+    ganancia_neta = Column(DECIMAL(14, 2), nullable=False, default=0)  # Premios menos lo apostado en apuestas liquidadas
+    tasa_victorias = Column(DECIMAL(5, 4), nullable=False, default=0)  # ganadas / liquidadas
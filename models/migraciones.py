@@ -0,0 +1,354 @@
+"""Migraciones versionadas del esquema.
+
+La aplicación no crea ni modifica tablas al importar ni al iniciar: solo comprueba en su
+lifespan que la base esté en VERSION_ESQUEMA. El esquema se crea y se actualiza con este
+comando, una vez por despliegue y antes de levantar los workers:
+
+    python -m models.migraciones            # aplica las migraciones pendientes
+    python -m models.migraciones --estado   # versión de la base y migraciones pendientes
+
+Cada migración aplicada queda registrada en la tabla Version_Esquema. La versión 1 es el esquema
+inicial, congelado; cada cambio posterior de los modelos es una migración propia que también lleva
+al día las bases creadas con create_all antes de versionar el esquema.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import re
+from typing import Callable
+from sqlalchemy import (
+    Column, Integer, String, DECIMAL, TIMESTAMP, Boolean, ForeignKey, UniqueConstraint, MetaData, Table,
+    inspect, insert, select, update, delete, text,
+)
+from sqlalchemy.sql import func, table, column
+from config.db import Base, engine
+import models.global_models  # noqa: F401  (registra las tablas en Base.metadata)
+from models.global_models import (
+    Apuesta, ApuestaArchivo, ApuestaUsuarioArchivo, TrabajoLiquidacion, MovimientoSaldo, SnapshotSaldo, EstadisticaUsuario,
+)
+from services.saldos import MOVIMIENTO_REEMBOLSO
+
+
+# Tabla de control, fuera de Base.metadata para que ninguna migración la cree o la borre
+version_esquema = Table(
+    "Version_Esquema", MetaData(),
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("descripcion", String(200), nullable=False),
+    Column("aplicada_en", TIMESTAMP, server_default=func.current_timestamp(), nullable=True),
+)
+
+
+logger = logging.getLogger("gambling.migraciones")
+
+
+# Pasos de DDL para las migraciones que cambian tablas existentes. Cada uno comprueba antes si el
+# cambio ya está hecho (la base pudo crearse con create_all de una versión posterior del código,
+# y en MySQL el DDL no es transaccional: una migración interrumpida se puede volver a ejecutar).
+def _q(conn, nombre: str) -> str:
+    return conn.dialect.identifier_preparer.quote(nombre)
+
+
+def _indices(conn, tabla: str) -> set[str]:
+    inspector = inspect(conn)
+    return {i["name"] for i in inspector.get_indexes(tabla)} | {u["name"] for u in inspector.get_unique_constraints(tabla)}
+
+
+def _crear_indice(conn, tabla: str, nombre: str, columnas: tuple[str, ...], unico: bool = False):
+    if nombre in _indices(conn, tabla):
+        return
+    lista = ", ".join(_q(conn, c) for c in columnas)
+    if unico and conn.dialect.name != "sqlite":
+        conn.execute(text(f"ALTER TABLE {_q(conn, tabla)} ADD CONSTRAINT {_q(conn, nombre)} UNIQUE ({lista})"))
+    else:
+        # SQLite no admite ADD CONSTRAINT: un índice único aplica la misma regla
+        conn.execute(text(f"CREATE {'UNIQUE ' if unico else ''}INDEX {_q(conn, nombre)} ON {_q(conn, tabla)} ({lista})"))
+
+
+# Solo columnas que admiten NULL: las filas existentes quedan en NULL
+def _agregar_columna(conn, tabla: str, columna: Column):
+    if columna.name in {c["name"] for c in inspect(conn).get_columns(tabla)}:
+        return
+    tipo = columna.type.compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {_q(conn, tabla)} ADD COLUMN {_q(conn, columna.name)} {tipo} NULL"))
+
+
+# SQLite no puede quitar una FK sin recrear la tabla, pero tampoco las aplica (sin PRAGMA foreign_keys)
+def _quitar_fk(conn, tabla: str, columna: str):
+    if conn.dialect.name == "sqlite" or not inspect(conn).has_table(tabla):
+        return
+    for fk in inspect(conn).get_foreign_keys(tabla):
+        if fk["constrained_columns"] == [columna]:
+            conn.execute(text(f"ALTER TABLE {_q(conn, tabla)} DROP FOREIGN KEY {_q(conn, fk['name'])}"))
+
+
+apuesta = table("Apuesta", column("id"), column("resultado"))
+apuesta_usuario = table(
+    "Apuesta_Usuario",
+    column("id"), column("id_usuario"), column("id_apuesta"), column("opcion_apuesta"), column("monto_apostado"), column("monto_ganado"),
+)
+usuario = table("Usuario", column("id"), column("saldo_actual"))
+movimiento_saldo = table("Movimiento_Saldo", column("id_usuario"), column("id_apuesta"), column("tipo"), column("monto"))
+
+
+# Esquema inicial, congelado: las tablas de la primera versión de la aplicación, sin los cambios
+# posteriores de los modelos (esos son las migraciones siguientes). No se edita al cambiar los modelos.
+esquema_inicial = MetaData()
+
+Table(
+    "Usuario", esquema_inicial,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("uuid", String(36), nullable=False, unique=True, server_default=func.uuid()),
+    Column("nickname", String(50), nullable=False, unique=True),
+    Column("saldo_actual", DECIMAL(10, 2), nullable=False, server_default="2000.00"),
+    Column("created_at", TIMESTAMP, nullable=False, server_default=func.current_timestamp()),
+    Column("updated_at", TIMESTAMP, nullable=False, server_default=func.current_timestamp()),
+)
+Table(
+    "Juegos", esquema_inicial,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("nombre_juego", String(100), nullable=False, unique=True),
+    Column("created_at", TIMESTAMP, server_default=func.current_timestamp(), nullable=True),
+    Column("updated_at", TIMESTAMP, server_default=func.current_timestamp(), nullable=True),
+)
+Table(
+    "Opciones_Apuesta_Juegos", esquema_inicial,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("nombre_opcion", String(100), nullable=False),
+    Column("id_Juego", Integer, ForeignKey("Juegos.id", ondelete="CASCADE", onupdate="CASCADE"), nullable=False),
+    Column("created_at", TIMESTAMP, server_default=func.current_timestamp(), nullable=True),
+    Column("updated_at", TIMESTAMP, server_default=func.current_timestamp(), nullable=True),
+)
+Table(
+    "Apuesta", esquema_inicial,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("codigo_sala", String(8), nullable=False, unique=True),
+    Column("is_abierta", Boolean),
+    Column("resultado", Integer, ForeignKey("Opciones_Apuesta_Juegos.id", ondelete="RESTRICT", onupdate="CASCADE"), nullable=True),
+    Column("id_juego", Integer, ForeignKey("Juegos.id", ondelete="CASCADE", onupdate="CASCADE"), nullable=False),
+    Column("created_at", TIMESTAMP, server_default=func.current_timestamp(), nullable=True),
+    Column("updated_at", TIMESTAMP, server_default=func.current_timestamp(), nullable=True),
+)
+Table(
+    "Apuesta_Usuario", esquema_inicial,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("id_usuario", Integer, ForeignKey("Usuario.id", ondelete="CASCADE", onupdate="CASCADE"), nullable=False),
+    Column("id_apuesta", Integer, ForeignKey("Apuesta.id", ondelete="CASCADE", onupdate="CASCADE"), nullable=False),
+    Column("opcion_apuesta", Integer, ForeignKey("Opciones_Apuesta_Juegos.id", ondelete="RESTRICT", onupdate="CASCADE"), nullable=False),
+    Column("monto_apostado", DECIMAL(10, 2), nullable=False),
+    Column("is_gano", Boolean, nullable=False),
+    Column("monto_ganado", DECIMAL(10, 2), nullable=True),
+    Column("created_at", TIMESTAMP, server_default=func.current_timestamp(), nullable=True),
+    Column("updated_at", TIMESTAMP, server_default=func.current_timestamp(), nullable=True),
+)
+
+
+def _esquema_inicial(conn):
+    esquema_inicial.create_all(conn)
+
+
+# Las tablas nuevas se crean desde su modelo actual; si una cambia después, su migración también
+# comprueba si el cambio ya está hecho
+def _crear_tablas(conn, *modelos):
+    for modelo in modelos:
+        modelo.__table__.create(conn, checkfirst=True)
+
+
+# Una apuesta por usuario y sala (uq_apuesta_usuario_sala). Antes de la restricción podía haber
+# duplicados: de cada usuario y sala se conserva la primera apuesta y las demás se eliminan
+# - a la misma opción: se suman a la primera (el resultado y el pozo de la sala no cambian)
+# - a otra opción de una sala sin liquidar: se devuelve lo apostado al saldo del usuario
+# - a otra opción de una sala liquidada: el premio ya se pagó, solo se elimina el registro
+def _una_apuesta_por_sala(conn):
+    if "uq_apuesta_usuario_sala" in _indices(conn, "Apuesta_Usuario"):
+        return
+
+    repetidas = (
+        select(apuesta_usuario.c.id_usuario, apuesta_usuario.c.id_apuesta)
+        .group_by(apuesta_usuario.c.id_usuario, apuesta_usuario.c.id_apuesta)
+        .having(func.count() > 1)
+        .subquery()
+    )
+    filas = conn.execute(
+        select(apuesta_usuario, apuesta.c.resultado)
+        .join(apuesta, apuesta.c.id == apuesta_usuario.c.id_apuesta)
+        .join(repetidas, (repetidas.c.id_usuario == apuesta_usuario.c.id_usuario) & (repetidas.c.id_apuesta == apuesta_usuario.c.id_apuesta))
+        .order_by(apuesta_usuario.c.id)
+    ).all()
+    con_libro = inspect(conn).has_table("Movimiento_Saldo")
+
+    primeras = {}
+    for fila in filas:
+        primera = primeras.setdefault((fila.id_usuario, fila.id_apuesta), fila)
+        if primera is fila:
+            continue
+
+        if fila.opcion_apuesta == primera.opcion_apuesta:
+            valores = {"monto_apostado": apuesta_usuario.c.monto_apostado + fila.monto_apostado}
+            if fila.monto_ganado is not None:
+                valores["monto_ganado"] = func.coalesce(apuesta_usuario.c.monto_ganado, 0) + fila.monto_ganado
+            conn.execute(update(apuesta_usuario).where(apuesta_usuario.c.id == primera.id).values(**valores))
+        elif fila.resultado is None:
+            conn.execute(update(usuario).where(usuario.c.id == fila.id_usuario).values(saldo_actual=usuario.c.saldo_actual + fila.monto_apostado))
+            if con_libro:
+                conn.execute(insert(movimiento_saldo).values(id_usuario=fila.id_usuario, id_apuesta=fila.id_apuesta, tipo=MOVIMIENTO_REEMBOLSO, monto=fila.monto_apostado))
+        else:
+            logger.warning("Apuesta duplicada %d de una sala liquidada eliminada (usuario %d, sala %d)", fila.id, fila.id_usuario, fila.id_apuesta)
+
+        conn.execute(delete(apuesta_usuario).where(apuesta_usuario.c.id == fila.id))
+
+    if filas:
+        logger.info("Apuestas duplicadas resueltas: %d (conviene reconstruir las estadísticas)", len(filas) - len(primeras))
+    _crear_indice(conn, "Apuesta_Usuario", "uq_apuesta_usuario_sala", ("id_usuario", "id_apuesta"), unico=True)
+
+
+def _trabajos_de_liquidacion(conn):
+    _crear_tablas(conn, TrabajoLiquidacion)
+
+
+# Cierre automático y rondas continuas de las salas
+def _cierre_automatico(conn):
+    _agregar_columna(conn, "Apuesta", Apuesta.__table__.c.cierra_en)
+    _agregar_columna(conn, "Apuesta", Apuesta.__table__.c.intervalo_segundos)
+    _crear_indice(conn, "Apuesta", "ix_Apuesta_cierra_en", ("cierra_en",))
+
+
+def _libro_de_saldos(conn):
+    _crear_tablas(conn, MovimientoSaldo, SnapshotSaldo)
+    _crear_indice(conn, "Movimiento_Saldo", "ix_movimiento_saldo_usuario", ("id_usuario", "id"))
+
+
+# Tablas de archivo e índices de las tablas vivas. Movimiento_Saldo.id_apuesta deja de tener FK:
+# al archivar una sala, el ON DELETE SET NULL borraría la sala de sus movimientos
+def _archivo_de_salas(conn):
+    _crear_tablas(conn, ApuestaArchivo, ApuestaUsuarioArchivo)
+    _crear_indice(conn, "Apuesta", "ix_apuesta_abierta_actualizada", ("is_abierta", "updated_at"))
+    _crear_indice(conn, "Apuesta_Usuario", "ix_apuesta_usuario_sala_opcion", ("id_apuesta", "opcion_apuesta"))
+    _crear_indice(conn, "Apuesta_Usuario", "ix_apuesta_usuario_usuario_fecha", ("id_usuario", "created_at"))
+    _quitar_fk(conn, "Movimiento_Saldo", "id_apuesta")
+
+
+def _estadisticas(conn):
+    _crear_tablas(conn, EstadisticaUsuario)
+
+
+# (versión, descripción, función que recibe la conexión síncrona), en orden
+MIGRACIONES: list[tuple[int, str, Callable]] = [
+    (1, "Esquema inicial", _esquema_inicial),
+    (2, "Una apuesta por usuario y sala", _una_apuesta_por_sala),
+    (3, "Trabajos de liquidación", _trabajos_de_liquidacion),
+    (4, "Cierre automático de salas", _cierre_automatico),
+    (5, "Libro de saldos", _libro_de_saldos),
+    (6, "Archivo de salas", _archivo_de_salas),
+    (7, "Estadísticas por usuario", _estadisticas),
+]
+
+VERSION_ESQUEMA = MIGRACIONES[-1][0]
+
+
+async def version_actual(conn) -> int:
+    # 0 si la base todavía no tiene la tabla de control (sin migrar)
+    if not await conn.run_sync(lambda sync_conn: inspect(sync_conn).has_table(version_esquema.name)):
+        return 0
+    return (await conn.execute(select(func.max(version_esquema.c.version)))).scalar() or 0
+
+
+# Aplica las migraciones pendientes, cada una en su transacción junto con el registro de su
+# versión, y devuelve las versiones aplicadas
+async def migrar() -> list[int]:
+    async with engine.begin() as conn:
+        await conn.run_sync(version_esquema.create, checkfirst=True)
+        actual = await version_actual(conn)
+
+    aplicadas = []
+    for version, descripcion, funcion in MIGRACIONES:
+        if version <= actual:
+            continue
+        async with engine.begin() as conn:
+            await conn.run_sync(funcion)
+            await conn.execute(insert(version_esquema).values(version=version, descripcion=descripcion))
+        logger.info("Migración %d aplicada: %s", version, descripcion)
+        aplicadas.append(version)
+    return aplicadas
+
+
+_UNIQUE_SQLITE = re.compile(r'CONSTRAINT\s+"?(\w+)"?\s+UNIQUE', re.IGNORECASE)
+
+
+# Columnas e índices de la base como pares (tabla, nombre) en minúsculas, con dos consultas en vez
+# de varias por tabla. En MySQL las restricciones UNIQUE aparecen como índices; en SQLite las
+# declaradas en el CREATE TABLE solo tienen nombre en su SQL
+async def _estructura(conn) -> tuple[set, set]:
+    if conn.dialect.name == "sqlite":
+        columnas = await conn.execute(text(
+            "SELECT m.name, p.name FROM sqlite_master m JOIN pragma_table_info(m.name) p WHERE m.type = 'table'"
+        ))
+        objetos = (await conn.execute(text("SELECT type, tbl_name, name, sql FROM sqlite_master"))).all()
+        indices = {(t, n) for tipo, t, n, _ in objetos if tipo == "index"}
+        indices |= {(t, n) for tipo, t, _, sql in objetos if tipo == "table" for n in _UNIQUE_SQLITE.findall(sql or "")}
+    else:
+        columnas = await conn.execute(text(
+            "SELECT TABLE_NAME, COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE()"
+        ))
+        indices = await conn.execute(text(
+            "SELECT DISTINCT TABLE_NAME, INDEX_NAME FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE()"
+        ))
+    return {(t.lower(), c.lower()) for t, c in columnas}, {(t.lower(), i.lower()) for t, i in indices}
+
+
+# Columnas, índices y restricciones UNIQUE con nombre de los modelos que no están en la base
+async def faltantes(conn) -> list[str]:
+    columnas, indices = await _estructura(conn)
+    resultado = []
+    for tabla in Base.metadata.sorted_tables:
+        nombre = tabla.name.lower()
+        resultado += [f"{tabla.name}.{c.name}" for c in tabla.columns if (nombre, c.name.lower()) not in columnas]
+        esperados = [i.name for i in tabla.indexes] + [
+            r.name for r in tabla.constraints if isinstance(r, UniqueConstraint) and r.name
+        ]
+        resultado += [f"{tabla.name}.{i}" for i in esperados if (nombre, i.lower()) not in indices]
+    return resultado
+
+
+# Comprobación del lifespan: solo lectura, sin DDL. No basta con la versión: una base marcada como
+# migrada puede no tener la estructura (p. ej. un cambio aplicado a mano a medias)
+async def comprobar_esquema():
+    async with engine.connect() as conn:
+        actual = await version_actual(conn)
+        pendiente = await faltantes(conn) if actual >= VERSION_ESQUEMA else []
+    if actual < VERSION_ESQUEMA:
+        raise RuntimeError(
+            f"La base de datos está en la versión {actual} del esquema y la aplicación necesita la "
+            f"{VERSION_ESQUEMA}: ejecuta `python -m models.migraciones` antes de iniciarla"
+        )
+    if pendiente:
+        raise RuntimeError(
+            f"La base de datos está en la versión {actual} del esquema pero le faltan columnas o índices "
+            f"de los modelos: {', '.join(pendiente)}"
+        )
+
+
+async def _ejecutar(estado: bool):
+    try:
+        if estado:
+            async with engine.connect() as conn:
+                actual = await version_actual(conn)
+                resultado = {
+                    "version": actual,
+                    "version_aplicacion": VERSION_ESQUEMA,
+                    "pendientes": [version for version, _, _ in MIGRACIONES if version > actual],
+                    "faltantes": await faltantes(conn),
+                }
+        else:
+            resultado = {"aplicadas": await migrar(), "version": VERSION_ESQUEMA}
+        print(json.dumps(resultado, indent=2))
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Migraciones del esquema de la base de datos")
+    parser.add_argument("--estado", action="store_true", help="muestra la versión sin aplicar nada")
+    args = parser.parse_args()
+    asyncio.run(_ejecutar(args.estado))
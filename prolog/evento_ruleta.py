@@ -1,4 +1,5 @@
 import random
+import secrets
 import string
 
 # Función para tirar la ruleta y obtener un color basado en las probabilidades
@@ -20,9 +21,12 @@ def determinar_color(numero):
 # Definir la función lambda para calcular la ganancia
 ganancia = lambda A_i, A_total_color, A_total_ruleta: (A_i / A_total_color) * A_total_ruleta
 
-# Definir los codigos de salas de apuesta
+# Definir los codigos de salas de apuesta: 8 caracteres (el largo de la columna) de un generador
+# seguro, 62^8 combinaciones para que las colisiones sean raras y los códigos no se puedan adivinar
+LONGITUD_CODIGO_SALA = 8
+
 def generar_codigo_sala():
-    return ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(6))
+    return ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(LONGITUD_CODIGO_SALA))
 
 # Definir la función lambda para calcular simular el multiplicador de ganancia
 multiplicador_ganancia = lambda A_i, A_total_color, A_total_ruleta: round((A_total_ruleta + A_i) / (A_total_color + A_i), 2) if (A_total_color + A_i) != 0 else 0
@@ -0,0 +1,111 @@
+import numpy as np
+from prolog.evento_ruleta import ganancia
+
+# Resultados posibles de la ruleta, en el orden de los índices usados por la simulación
+COLORES = ("verde", "rojo", "negro")
+
+# Giros por lote: acota la memoria usada sin importar cuántos giros se pidan
+GIROS_POR_LOTE = 1_000_000
+
+PERCENTILES = (1, 5, 50, 95, 99)
+
+
+# Versión vectorizada de determinar_color: 1 -> verde (0), par -> rojo (1), impar -> negro (2)
+def determinar_colores(numeros: np.ndarray) -> np.ndarray:
+    return np.where(numeros == 1, 0, np.where(numeros % 2 == 0, 1, 2))
+
+
+# Tira la ruleta `giros` veces en lotes y devuelve cuántas veces salió cada color
+def contar_resultados(giros: int, semilla=None) -> np.ndarray:
+    rng = np.random.default_rng(semilla)
+    conteos = np.zeros(len(COLORES), dtype=np.int64)
+
+    restantes = giros
+    while restantes > 0:
+        lote = min(restantes, GIROS_POR_LOTE)
+        # Mismo rango que tirar_ruleta: random.randint(1, 37)
+        colores = determinar_colores(rng.integers(1, 38, size=lote))
+        conteos += np.bincount(colores, minlength=len(COLORES))
+        restantes -= lote
+
+    return conteos
+
+
+# Índice de color de cada opción apostada (-1 si el nombre no corresponde a un color)
+def indices_color(opciones: list[str]) -> np.ndarray:
+    return np.array([COLORES.index(o.lower()) if o.lower() in COLORES else -1 for o in opciones], dtype=np.int64)
+
+
+# Matriz (resultado x apuesta) con el pago de cada apuesta según el color ganador,
+# aplicando la fórmula `ganancia` a todas las apuestas a la vez
+def pagos_por_resultado(montos: np.ndarray, colores: np.ndarray) -> np.ndarray:
+    total = montos.sum()
+    validas = colores >= 0
+    totales_color = np.bincount(colores[validas], weights=montos[validas], minlength=len(COLORES))
+
+    pagos = np.zeros((len(COLORES), len(montos)))
+    for color in range(len(COLORES)):
+        ganadoras = colores == color
+        if totales_color[color] > 0:
+            pagos[color, ganadoras] = ganancia(montos[ganadoras], totales_color[color], total)
+
+    return pagos
+
+
+# Percentiles de variables que toman un valor por resultado (columnas de `valores`), con las
+# probabilidades empíricas de cada resultado
+def percentiles_discretos(valores: np.ndarray, probabilidades: np.ndarray, percentiles=PERCENTILES) -> dict:
+    orden = np.argsort(valores, axis=0)
+    ordenados = np.take_along_axis(valores, orden, axis=0)
+    acumulada = np.cumsum(probabilidades[orden], axis=0)
+
+    resultado = {}
+    for p in percentiles:
+        posicion = np.argmax(acumulada >= p / 100 - 1e-12, axis=0)
+        resultado[f"p{p}"] = np.take_along_axis(ordenados, posicion[None, :], axis=0)[0]
+    return resultado
+
+
+# Simula `giros` tiradas para el pozo actual de una sala y resume la distribución de los pagos
+# por apuesta y para la sala (exposición de la casa = total apostado - total pagado)
+def simular_sala(montos, opciones: list[str], giros: int, semilla=None) -> dict:
+    montos = np.asarray(montos, dtype=np.float64)
+    colores = indices_color(opciones)
+
+    conteos = contar_resultados(giros, semilla)
+    probabilidades = conteos / giros
+
+    pagos = pagos_por_resultado(montos, colores)
+    esperado = probabilidades @ pagos
+    varianza = probabilidades @ pagos ** 2 - esperado ** 2
+    percentiles_apuesta = percentiles_discretos(pagos, probabilidades)
+
+    total = montos.sum()
+    pago_sala = pagos.sum(axis=1)
+    casa = total - pago_sala
+    esperado_sala = probabilidades @ pago_sala
+    percentiles_sala = percentiles_discretos(pago_sala[:, None], probabilidades)
+    percentiles_casa = percentiles_discretos(casa[:, None], probabilidades)
+
+    return {
+        "giros": giros,
+        "frecuencias": {color: float(p) for color, p in zip(COLORES, probabilidades)},
+        "sala": {
+            "total_apostado": float(total),
+            "pago_esperado": float(esperado_sala),
+            "varianza_pago": float(probabilidades @ pago_sala ** 2 - esperado_sala ** 2),
+            "percentiles_pago": {k: float(v[0]) for k, v in percentiles_sala.items()},
+            "ganancia_casa_esperada": float(probabilidades @ casa),
+            "percentiles_ganancia_casa": {k: float(v[0]) for k, v in percentiles_casa.items()},
+        },
+        "apuestas": [
+            {
+                "monto_apostado": float(montos[i]),
+                "pago_esperado": float(esperado[i]),
+                "ganancia_neta_esperada": float(esperado[i] - montos[i]),
+                "varianza_pago": float(varianza[i]),
+                "percentiles_pago": {k: float(v[i]) for k, v in percentiles_apuesta.items()},
+            }
+            for i in range(len(montos))
+        ],
+    }
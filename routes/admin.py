@@ -1,13 +1,26 @@
-from decimal import Decimal
-from fastapi import APIRouter, Depends, status, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy.exc import IntegrityError, DataError
+from fastapi import APIRouter, Depends, Query, Response, status, HTTPException
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import select
 from sqlalchemy.sql import func
-from typing import Annotated
-from config.db import engine, SessionLocal
-from models.global_models import Apuesta, OpcionesApuestaJuegos, ApuestaUsuario, Usuario
-from schemas.admin import CrearSalaBaseModel, CerrarSalaBaseModel
-from prolog.evento_ruleta import tirar_ruleta, ganancia, generar_codigo_sala
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError, DataError
+from typing import Annotated, Optional
+from datetime import timedelta
+from config.db import get_db, escrituras_recientes
+from models.global_models import Apuesta, ApuestaUsuario, ApuestaArchivo, Usuario, MovimientoSaldo
+from schemas.admin import CrearSalaBaseModel, CrearSalasBaseModel, CerrarSalaBaseModel
+from prolog.evento_ruleta import generar_codigo_sala
+from prolog.simulacion_ruleta import simular_sala
+from services.liquidacion import ahora_utc, cerrar_sala_y_encolar, estado_liquidacion
+from services.trabajadores import trabajadores_liquidacion
+from services.agenda import agenda_salas, AGENDA_ANTICIPACION
+from services.catalogo import catalogo
+from services.salas import crear_salas
+from services.saldos import verificar_saldo, tomar_snapshots, conciliar
+from services.archivo import archivar_salas, ARCHIVO_EDAD
+from services.estadisticas import reconstruir_estadisticas
+from services.idempotencia import almacen_idempotencia, ClaveIdempotencia
+from services.paginacion import codificar_cursor, decodificar_cursor, LIMITE_POR_DEFECTO, LIMITE_MAXIMO
 
 
 router_admin = APIRouter(
@@ -15,96 +28,225 @@ router_admin = APIRouter(
     tags=["admin"],
 )
 
-# Dependencia para obtener la sesión de base de datos
-def get_db():
-    db = SessionLocal()
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+
+# Valida el cierre automático pedido y devuelve (cierra_en, intervalo_segundos)
+def programacion_sala(duracion_segundos: Optional[int], continua: bool):
+    if continua and not duracion_segundos:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Una sala continua necesita duracion_segundos")
+
+    # La ronda siguiente se abre AGENDA_ANTICIPACION segundos antes del cierre: la ronda debe durar más
+    if continua and duracion_segundos <= AGENDA_ANTICIPACION:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"La duración de una sala continua debe superar {AGENDA_ANTICIPACION:g} segundos"
+        )
+
+    cierra_en = ahora_utc() + timedelta(seconds=duracion_segundos) if duracion_segundos else None
+    intervalo_segundos = duracion_segundos if continua else None
+    return cierra_en, intervalo_segundos
+
+async def registrar_salas(db: AsyncSession, id_juego: int, cantidad: int, duracion_segundos: Optional[int], continua: bool):
+    cierra_en, intervalo_segundos = programacion_sala(duracion_segundos, continua)
+
+    if not await catalogo.nombre_juego(db, id_juego):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Juego no encontrado")
+
     try:
-        yield db
-    finally:
-        db.close()
+        codigos = await crear_salas(db, id_juego, cantidad, cierra_en, intervalo_segundos)
 
-db_dependency = Annotated[Session, Depends(get_db)]
+    except IntegrityError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="No se pudieron generar códigos de sala únicos, intenta de nuevo"
+        )
+
+    escrituras_recientes.marcar(*codigos)
+
+    # Cierre automático opcional, a cargo de la agenda de salas
+    if cierra_en:
+        for codigo_sala in codigos:
+            agenda_salas.programar(codigo_sala, cierra_en, intervalo_segundos)
+
+    return codigos, cierra_en
 
 @router_admin.post("/sala")
 async def crear_sala(sala: CrearSalaBaseModel,db: db_dependency):
     try:
-        
-        codigo_sala = generar_codigo_sala()
-
-        db_registro = Apuesta(codigo_sala=codigo_sala, id_juego=sala.id_juego)
-        db.add(db_registro)
-        db.commit()
-        return {"status": "OK", "codigo_sala": codigo_sala}
-    
+        codigos, cierra_en = await registrar_salas(db, sala.id_juego, 1, sala.duracion_segundos, sala.continua)
+        return {"status": "OK", "codigo_sala": codigos[0], "cierra_en": cierra_en}
+
+    except HTTPException:
+        raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error inesperado: {str(e)}"
         )
-        
-@router_admin.patch("/sala")
-async def cerrar_sala(sala: CerrarSalaBaseModel, db: db_dependency):
-    
-    # Verificar si la sala existe
-    sala_db = db.query(Apuesta).filter(Apuesta.codigo_sala == sala.codigo_sala).first()
-    
+
+@router_admin.post("/salas", status_code=status.HTTP_201_CREATED)
+async def crear_salas_lote(salas: CrearSalasBaseModel, db: db_dependency):
+    # Crea varias salas del mismo juego en una sola transacción
+    codigos, cierra_en = await registrar_salas(db, salas.id_juego, salas.cantidad, salas.duracion_segundos, salas.continua)
+    return {"status": "OK", "cantidad": len(codigos), "codigos_sala": codigos, "cierra_en": cierra_en}
+
+@router_admin.patch("/sala", status_code=status.HTTP_202_ACCEPTED)
+async def cerrar_sala(sala: CerrarSalaBaseModel, db: db_dependency, response: Response, idempotency_key: ClaveIdempotencia = None):
+    # Un reintento con la misma Idempotency-Key recibe el trabajo encolado por la primera petición
+    return await almacen_idempotencia.ejecutar(
+        "cerrar_sala", idempotency_key, sala.model_dump(), response,
+        lambda: cerrar_sala_y_liquidar(sala, db), status.HTTP_202_ACCEPTED,
+    )
+
+async def cerrar_sala_y_liquidar(sala: CerrarSalaBaseModel, db: AsyncSession):
+    # Cierra la sala a nuevas apuestas y encola la liquidación; el pago lo hacen los
+    # trabajadores de liquidación (el progreso se consulta en /admin/sala/{codigo}/liquidacion)
+    trabajo = await cerrar_sala_y_encolar(db, sala.codigo_sala)
+    escrituras_recientes.marcar(sala.codigo_sala)
+    trabajadores_liquidacion.despertar()
+
+    return {
+        "mensaje": "Sala cerrada, la liquidación está en curso",
+        "codigo_sala": sala.codigo_sala,
+        "id_trabajo": trabajo.id,
+        "estado": trabajo.estado,
+    }
+
+@router_admin.get("/sala/{codigo_sala}/liquidacion")
+async def consultar_liquidacion(codigo_sala: str, db: db_dependency):
+    return await estado_liquidacion(db, codigo_sala)
+
+@router_admin.get("/sala/{codigo_sala}/riesgo")
+async def riesgo_sala(
+    codigo_sala: str,
+    db: db_dependency,
+    giros: int = Query(1_000_000, ge=1_000, le=50_000_000),
+    semilla: Optional[int] = None,
+):
+    # Simulación Monte Carlo del pozo actual de la sala: pagos esperados, varianza y percentiles
+    sala_db = (await db.execute(select(Apuesta.id).filter(Apuesta.codigo_sala == codigo_sala))).first()
+
     if not sala_db:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Sala no encontrada")
-    
-    # Verificar si la sala ya está cerrada
-    if not sala_db.is_abierta:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="La sala ya está cerrada")
-    
-    resultado_ruleta = tirar_ruleta()
-    
-    # Buscar el primer registro que coincida
-    id_opcion_resultado = db.query(OpcionesApuestaJuegos).filter(
-        OpcionesApuestaJuegos.nombre_opcion.ilike(resultado_ruleta),
-        OpcionesApuestaJuegos.id_Juego == sala_db.id_juego
-    ).first()
-
-    # Validar si se encontró el registro
-    if not id_opcion_resultado:
-        raise HTTPException(status_code=404, detail="No se encontró ninguna opción de apuesta con los criterios especificados.")
-    
-    # Cerrar la sala
-    sala_db.is_abierta = False
-    sala_db.resultado = id_opcion_resultado.id
-    
-    jugadores_ganadores = db.query(ApuestaUsuario).filter(
-        ApuestaUsuario.id_apuesta == sala_db.id,
-        ApuestaUsuario.opcion_apuesta == id_opcion_resultado.id
-    ).all()
-    
-    # Realizar la consulta para obtener la suma de los puntos apostados por los ganadores
-    suma_valores_ganadores = db.query(func.sum(ApuestaUsuario.monto_apostado)).filter(
-        ApuestaUsuario.id_apuesta == sala_db.id,
-        ApuestaUsuario.opcion_apuesta == id_opcion_resultado.id
-    ).scalar()
-    
-    # Realizar la consulta para obtener la suma de los puntos apostados por todos los jugadores
-    suma_valores_totales = db.query(func.sum(ApuestaUsuario.monto_apostado)).filter(
-        ApuestaUsuario.id_apuesta == sala_db.id
-    ).scalar()
-    
-    # Itera y actualiza el valor de las columnas
-    for ganador in jugadores_ganadores:
-        
-        monto_ganado = ganancia(ganador.monto_apostado, suma_valores_ganadores, suma_valores_totales)
-        
-        ganador.is_gano = True
-        ganador.monto_ganado = monto_ganado
-        
-        usuario = db.query(Usuario).filter(Usuario.id == ganador.id_usuario).first()
-        
-        usuario.saldo_actual += Decimal(monto_ganado)
-    
-    db.commit()
-    
-    # TODO: Y REPARTICION DE GANANCIAS
-    return {"mensaje": f"Sala cerrada y el resultado ganador de la apuesta fue: {id_opcion_resultado.nombre_opcion}"}
+
+    apuestas = (await db.execute(
+        select(Usuario.uuid, Usuario.nickname, ApuestaUsuario.monto_apostado, ApuestaUsuario.opcion_apuesta)
+        .join(Usuario, Usuario.id == ApuestaUsuario.id_usuario)
+        .filter(ApuestaUsuario.id_apuesta == sala_db.id)
+    )).all()
+
+    if not apuestas:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="No hay los datos suficientes para generar una simulación."
+        )
+
+    nombres_opcion = []
+    for apuesta in apuestas:
+        opcion = await catalogo.opcion(db, apuesta.opcion_apuesta)
+        nombres_opcion.append(opcion.nombre_opcion if opcion else "")
+
+    # La simulación es CPU intensiva: se ejecuta fuera del event loop
+    resultado = await run_in_threadpool(
+        simular_sala,
+        [float(a.monto_apostado) for a in apuestas],
+        nombres_opcion,
+        giros,
+        semilla,
+    )
+
+    # Cada usuario tiene una sola apuesta por sala: el detalle por apuesta es el detalle por usuario
+    for detalle, apuesta, nombre_opcion in zip(resultado["apuestas"], apuestas, nombres_opcion):
+        detalle["uuid_usuario"] = apuesta.uuid
+        detalle["nickname"] = apuesta.nickname
+        detalle["opcion_apuesta"] = nombre_opcion
+    resultado["usuarios"] = resultado.pop("apuestas")
+    resultado["codigo_sala"] = codigo_sala
+
+    return resultado
+
+@router_admin.get("/usuario/{uuid}/saldo")
+async def verificar_saldo_usuario(uuid: str, db: db_dependency):
+    # Recalcula el saldo desde el libro (último snapshot más los movimientos posteriores)
+    usuario = (await db.execute(select(Usuario.id, Usuario.saldo_actual).filter(Usuario.uuid == uuid))).first()
+
+    if not usuario:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Usuario con UUID {uuid} no encontrado.")
+
+    return {"uuid": uuid, **await verificar_saldo(db, usuario.id, usuario.saldo_actual)}
+
+@router_admin.get("/usuario/{uuid}/movimientos")
+async def movimientos_usuario(
+    uuid: str,
+    db: db_dependency,
+    limite: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+):
+    # Libro de saldos del usuario, del movimiento más reciente al más antiguo (cursor por id)
+    usuario = (await db.execute(select(Usuario.id).filter(Usuario.uuid == uuid))).first()
+
+    if not usuario:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Usuario con UUID {uuid} no encontrado.")
+
+    consulta = (
+        select(
+            MovimientoSaldo.id,
+            MovimientoSaldo.tipo,
+            MovimientoSaldo.monto,
+            MovimientoSaldo.created_at,
+            func.coalesce(Apuesta.codigo_sala, ApuestaArchivo.codigo_sala).label("codigo_sala"),
+        )
+        .outerjoin(Apuesta, Apuesta.id == MovimientoSaldo.id_apuesta)
+        .outerjoin(ApuestaArchivo, ApuestaArchivo.id == MovimientoSaldo.id_apuesta)
+        .filter(MovimientoSaldo.id_usuario == usuario.id)
+        .order_by(MovimientoSaldo.id.desc())
+        .limit(limite + 1)
+    )
+    if cursor:
+        id_cursor, = decodificar_cursor(cursor, (int,))
+        consulta = consulta.filter(MovimientoSaldo.id < id_cursor)
+
+    filas = (await db.execute(consulta)).all()
+    pagina = filas[:limite]
+
+    return {
+        "movimientos": [
+            {"id": f.id, "tipo": f.tipo, "monto": f.monto, "codigo_sala": f.codigo_sala, "fecha": f.created_at}
+            for f in pagina
+        ],
+        "siguiente_cursor": codificar_cursor(pagina[-1].id) if len(filas) > limite else None,
+    }
+
+@router_admin.post("/saldos/snapshot")
+async def snapshot_saldos():
+    # Snapshot del libro para los usuarios con movimientos desde su snapshot anterior
+    try:
+        return await tomar_snapshots()
+    except IntegrityError:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Ya hay un snapshot en curso")
+
+@router_admin.get("/saldos/conciliacion")
+async def conciliar_saldos():
+    # Compara el saldo de todos los usuarios con el libro en una sola pasada
+    return await conciliar()
+
+@router_admin.post("/archivo")
+async def archivar(edad_segundos: float = Query(ARCHIVO_EDAD, ge=0)):
+    # Mueve a las tablas de archivo las salas liquidadas hace más de edad_segundos
+    return await archivar_salas(edad_segundos)
+
+@router_admin.post("/estadisticas/reconstruir")
+async def reconstruir_estadisticas_usuarios():
+    # Recalcula las estadísticas y rankings desde el historial de apuestas (vivas y archivadas)
+    return await reconstruir_estadisticas()
+
+@router_admin.post("/catalogo/recargar")
+async def recargar_catalogo(db: db_dependency):
+    # Recarga la caché de juegos y opciones de apuesta (p. ej. tras agregar un juego)
+    await catalogo.recargar(db)
+    return {"status": "OK", **catalogo.resumen()}
 
 @router_admin.get("/test")
 def prueba(db: db_dependency):
-    return generar_codigo_sala()
\ No newline at end of file
+    return generar_codigo_sala()
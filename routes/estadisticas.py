@@ -0,0 +1,110 @@
+from datetime import date
+from fastapi import APIRouter, Depends, Query, status, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Annotated, Optional
+from config.db import get_db_lectura
+from models.global_models import Usuario, EstadisticaUsuario
+from services.estadisticas import periodo_dia, periodo_semana
+from services.liquidacion import ahora_utc
+
+
+router_estadisticas = APIRouter(tags=["estadisticas"])
+
+# Rutas de solo lectura: réplica, salvo escrituras recientes del usuario
+db_dependency = Annotated[AsyncSession, Depends(get_db_lectura())]
+
+# Columna por la que se ordena cada ranking (todas indexadas junto con el periodo)
+CRITERIOS_RANKING = {
+    "ganancia": EstadisticaUsuario.ganancia_neta,
+    "apostado": EstadisticaUsuario.total_apostado,
+    "tasa": EstadisticaUsuario.tasa_victorias,
+}
+
+RANKING_MAXIMO = 100
+
+
+def estadistica_publica(fila) -> dict:
+    return {
+        "apuestas": fila.apuestas,
+        "liquidadas": fila.liquidadas,
+        "ganadas": fila.ganadas,
+        "tasa_victorias": float(fila.tasa_victorias),
+        "total_apostado": float(fila.total_apostado),
+        "total_ganado": float(fila.total_ganado),
+        "ganancia_neta": float(fila.ganancia_neta),
+    }
+
+
+# Clave del periodo pedido ("total", o el día / la semana que contiene `fecha`, hoy por defecto)
+def clave_periodo(periodo: str, fecha: Optional[date]) -> str:
+    if periodo == "total":
+        return "total"
+    fecha = fecha or ahora_utc().date()
+    return periodo_dia(fecha) if periodo == "dia" else periodo_semana(fecha)
+
+
+@router_estadisticas.get("/ranking")
+async def ranking(
+    db: db_dependency,
+    criterio: str = Query("ganancia", pattern="^(ganancia|apostado|tasa)$"),
+    periodo: str = Query("total", pattern="^(total|dia|semana)$"),
+    fecha: Optional[date] = None,
+    limite: int = Query(10, ge=1, le=RANKING_MAXIMO),
+    minimo_apuestas: int = Query(10, ge=1),
+):
+    # Los N primeros del periodo en el orden del índice (periodo, criterio): el costo depende
+    # de N, no de la cantidad de apuestas. El desempate también es descendente: InnoDB agrega la
+    # clave primaria (id_usuario) al final del índice, y con ambas columnas en el mismo sentido
+    # el índice se lee hacia atrás sin ordenar (con sentidos mezclados MySQL hace un filesort)
+    clave = clave_periodo(periodo, fecha)
+    columna = CRITERIOS_RANKING[criterio]
+
+    consulta = (
+        select(Usuario.uuid, Usuario.nickname, EstadisticaUsuario)
+        .join(Usuario, Usuario.id == EstadisticaUsuario.id_usuario)
+        .filter(EstadisticaUsuario.periodo == clave)
+        .order_by(columna.desc(), EstadisticaUsuario.id_usuario.desc())
+        .limit(limite)
+    )
+
+    # La tasa de victorias solo es comparable con un mínimo de apuestas liquidadas
+    if criterio == "tasa":
+        consulta = consulta.filter(EstadisticaUsuario.liquidadas >= minimo_apuestas)
+
+    filas = (await db.execute(consulta)).all()
+
+    return {
+        "criterio": criterio,
+        "periodo": clave,
+        "ranking": [
+            {"posicion": posicion, "uuid": fila.uuid, "nickname": fila.nickname, **estadistica_publica(fila.EstadisticaUsuario)}
+            for posicion, fila in enumerate(filas, start=1)
+        ],
+    }
+
+
+@router_estadisticas.get("/usuario/{uuid}/estadisticas")
+async def estadisticas_usuario(uuid: str, db: Annotated[AsyncSession, Depends(get_db_lectura("uuid"))], fecha: Optional[date] = None):
+    # Estadísticas del usuario: total, del día y de la semana (los de `fecha`, hoy por defecto)
+    usuario = (await db.execute(select(Usuario.id).filter(Usuario.uuid == uuid))).first()
+
+    if not usuario:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Usuario con UUID {uuid} no encontrado.")
+
+    claves = {periodo: clave_periodo(periodo, fecha) for periodo in ("total", "dia", "semana")}
+    filas = {
+        fila.periodo: fila for fila in (await db.execute(
+            select(EstadisticaUsuario)
+            .filter(EstadisticaUsuario.id_usuario == usuario.id, EstadisticaUsuario.periodo.in_(claves.values()))
+        )).scalars()
+    }
+
+    vacia = dict.fromkeys(("apuestas", "liquidadas", "ganadas"), 0) | dict.fromkeys(("tasa_victorias", "total_apostado", "total_ganado", "ganancia_neta"), 0.0)
+    return {
+        "uuid": uuid,
+        **{
+            periodo: {"periodo": clave, **(estadistica_publica(filas[clave]) if clave in filas else vacia)}
+            for periodo, clave in claves.items()
+        },
+    }
@@ -1,30 +1,122 @@
 import uuid
+import orjson
+from datetime import datetime
 from decimal import Decimal
-from fastapi import APIRouter, Depends, status, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Query, Response, status, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, insert, update, union_all, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
-from sqlalchemy.sql import func
-from typing import Annotated
-from config.db import engine, SessionLocal
-from models.global_models import Usuario, OpcionesApuestaJuegos, Apuesta, Juegos, ApuestaUsuario
-from schemas.usuario import UsuarioBaseModel, ApuestaUsuarioBaseModel, SimulacionApuestaUsuarioBaseModel
+from typing import Annotated, Optional
+from config.db import get_db, get_db_lectura, SessionReplica, escrituras_recientes
+from models.global_models import Usuario, Apuesta, ApuestaUsuario, ApuestaArchivo, ApuestaUsuarioArchivo, MovimientoSaldo
+from schemas.usuario import (
+    UsuarioBaseModel, ApuestaUsuarioBaseModel, ApuestasLoteBaseModel, SimulacionApuestaUsuarioBaseModel,
+    PaginaUsuariosRespuesta, UsuarioHistorialRespuesta, SalaRespuesta,
+)
+from prolog.evento_ruleta import multiplicador_ganancia
+from services.catalogo import catalogo
+from services.pozos import tracker_salas
+from services.difusion import difusor_salas, formatear_evento, instantanea_sala, DIFUSION_REFRESCO
+from services.apuestas import registrar_lote
+from services.ingesta import ingesta_apuestas
+from services.saldos import registrar_saldo_inicial, MOVIMIENTO_APUESTA
+from services.estadisticas import registrar_apuestas
+from services.liquidacion import ahora_utc
+from services.idempotencia import almacen_idempotencia, ClaveIdempotencia
+from services.paginacion import codificar_cursor, decodificar_cursor, LIMITE_POR_DEFECTO, LIMITE_MAXIMO
 
 router_usuario = APIRouter()
 
-# Dependencia para obtener la sesión de base de datos
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+
+# Campos públicos de un usuario (sin el id interno)
+COLUMNAS_USUARIO = (Usuario.uuid, Usuario.nickname, Usuario.saldo_actual, Usuario.created_at, Usuario.updated_at)
+
+# Filas por lote leídas del cursor del servidor en la exportación NDJSON
+USUARIOS_LOTE_EXPORTACION = 1000
+
+
+# Diccionario de la respuesta desde una fila de COLUMNAS_USUARIO (sin pasar por el ORM)
+def usuario_publico(fila) -> dict:
+    return {
+        "uuid": fila.uuid,
+        "nickname": fila.nickname,
+        "saldo_actual": float(fila.saldo_actual),
+        "created_at": fila.created_at,
+        "updated_at": fila.updated_at,
+    }
+
+
+@router_usuario.get("/usuarios", response_model=PaginaUsuariosRespuesta)
+async def get_usuarios(
+    db: Annotated[AsyncSession, Depends(get_db_lectura())],
+    limite: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+    prefijo: Optional[str] = Query(None, min_length=1, max_length=50),
+    formato: str = Query("json", pattern="^(json|ndjson)$"),
+):
+    # Orden por nickname (único): el filtro por prefijo y el cursor recorren el mismo índice
+    consulta = select(*COLUMNAS_USUARIO).order_by(Usuario.nickname)
+    if prefijo:
+        consulta = consulta.filter(Usuario.nickname.startswith(prefijo, autoescape=True))
+    if cursor:
+        nickname_cursor, = decodificar_cursor(cursor, (str,))
+        consulta = consulta.filter(Usuario.nickname > nickname_cursor)
+
+    if formato == "ndjson":
+        # Exportación completa: se libera la sesión de la petición y el stream usa la suya
+        await db.close()
+        return StreamingResponse(exportar_usuarios(consulta), media_type="application/x-ndjson")
+
+    filas = (await db.execute(consulta.limit(limite + 1))).all()
+    pagina = filas[:limite]
+
+    siguiente_cursor = None
+    if len(filas) > limite:
+        siguiente_cursor = codificar_cursor(pagina[-1].nickname)
+
+    return {
+        "usuarios": [usuario_publico(fila) for fila in pagina],
+        "siguiente_cursor": siguiente_cursor,
+    }
+
+
+# Una línea JSON por usuario, leyendo del cursor del servidor por lotes (memoria constante)
+async def exportar_usuarios(consulta):
+    async with SessionReplica() as db:
+        resultado = await db.stream(consulta.execution_options(yield_per=USUARIOS_LOTE_EXPORTACION))
+        async for lote in resultado.partitions():
+            yield b"".join(orjson.dumps(usuario_publico(fila)) + b"\n" for fila in lote)
+
+# Una página del historial de un usuario en un par de tablas (vivas o de archivo), con la
+# paginación por cursor (keyset) sobre (created_at, id)
+def pagina_historial(tabla_apuestas, tabla_salas, id_usuario: int, posicion: Optional[list], limite: int):
+    consulta = (
+        select(
+            tabla_apuestas.id,
+            tabla_apuestas.created_at,
+            tabla_apuestas.monto_apostado,
+            tabla_apuestas.is_gano,
+            tabla_apuestas.opcion_apuesta,
+            tabla_salas.codigo_sala,
+            tabla_salas.is_abierta,
+            tabla_salas.id_juego,
+        )
+        .join(tabla_salas, tabla_salas.id == tabla_apuestas.id_apuesta)
+        .filter(tabla_apuestas.id_usuario == id_usuario)
+        .order_by(tabla_apuestas.created_at.desc(), tabla_apuestas.id.desc())
+        .limit(limite + 1)
+    )
 
-db_dependency = Annotated[Session, Depends(get_db)]
+    if posicion:
+        fecha_cursor, id_cursor = posicion
+        consulta = consulta.filter(or_(
+            tabla_apuestas.created_at < fecha_cursor,
+            and_(tabla_apuestas.created_at == fecha_cursor, tabla_apuestas.id < id_cursor),
+        ))
 
-@router_usuario.get("/usuarios")
-async def get_usuarios(db:db_dependency):
-    registros = db.query(Usuario).all()
-    return registros
+    return consulta
 
 @router_usuario.post("/usuario", status_code=status.HTTP_201_CREATED)
 async def create_usuarios(usuario: UsuarioBaseModel, db:db_dependency):
@@ -32,23 +124,33 @@ async def create_usuarios(usuario: UsuarioBaseModel, db:db_dependency):
     db_registro = Usuario(nickname=usuario.nickname)
     try:
         db.add(db_registro)
-        db.commit()
-        db.refresh(db_registro)  # Actualiza el objeto con los datos de la base de datos
+        await db.flush()
+
+        # Primer movimiento del libro de saldos: el saldo con el que empieza el usuario
+        await registrar_saldo_inicial(db, Usuario.id == db_registro.id)
+        await db.commit()
+        await db.refresh(db_registro)  # Actualiza el objeto con los datos de la base de datos
+        escrituras_recientes.marcar(db_registro.uuid)
 
         # Retornar el registro recién creado
         return {"status": "OK", "uuid": db_registro.uuid}
     except IntegrityError:
-        db.rollback()  # Revertir la transacción en caso de error
+        await db.rollback()  # Revertir la transacción en caso de error
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"El nickname '{usuario.nickname}' ya está en uso."
         )
         
-@router_usuario.get('/usuario/{uuid}', status_code=status.HTTP_200_OK)
-async def consultar_usuario_por_uuid(uuid: str, db: db_dependency):
+@router_usuario.get('/usuario/{uuid}', status_code=status.HTTP_200_OK, response_model=UsuarioHistorialRespuesta)
+async def consultar_usuario_por_uuid(
+    uuid: str,
+    db: Annotated[AsyncSession, Depends(get_db_lectura("uuid"))],
+    limite: int = Query(LIMITE_POR_DEFECTO, ge=1, le=LIMITE_MAXIMO),
+    cursor: Optional[str] = None,
+):
     try:
         # Consultamos el usuario en la base de datos
-        usuario = db.query(Usuario).filter(Usuario.uuid == uuid).first()
+        usuario = (await db.execute(select(Usuario.id, *COLUMNAS_USUARIO).filter(Usuario.uuid == uuid))).first()
 
         if not usuario:
             raise HTTPException(
@@ -56,34 +158,46 @@ async def consultar_usuario_por_uuid(uuid: str, db: db_dependency):
                 detail=f"Usuario con UUID {uuid} no encontrado."
             )
 
-        # Consultamos el historial de apuestas del usuario
+        # Consultamos una página del historial de apuestas (más recientes primero) en una sola
+        # consulta que une las tablas vivas y las de archivo (los ids se conservan al archivar)
+        posicion = decodificar_cursor(cursor, (datetime, int)) if cursor else None
+        vivas = pagina_historial(ApuestaUsuario, Apuesta, usuario.id, posicion, limite)
+        archivadas = pagina_historial(ApuestaUsuarioArchivo, ApuestaArchivo, usuario.id, posicion, limite)
+
+        historial = union_all(select(vivas.subquery()), select(archivadas.subquery())).subquery()
+        filas = (await db.execute(
+            select(historial)
+            .order_by(historial.c.created_at.desc(), historial.c.id.desc())
+            .limit(limite + 1)
+        )).all()
+        pagina = filas[:limite]
+
+        # Nombres de juego y opción desde el catálogo en memoria
         historial_apuestas = []
-        apuestas_usuario = db.query(ApuestaUsuario).filter(ApuestaUsuario.id_usuario == usuario.id).all()
-
-        for apuesta_usuario in apuestas_usuario:
-            info_apuesta = db.query(Apuesta).filter(Apuesta.id == apuesta_usuario.id_apuesta).first()
-            info_juego = db.query(Juegos).filter(Juegos.id == info_apuesta.id_juego).first()
-            apuesta = {
-                "codigo_sala": apuesta_usuario.apuesta.codigo_sala,
-                "monto_apostado": apuesta_usuario.monto_apostado,
-                "is_sala_abierta": info_apuesta.is_abierta,
-                "juego": info_juego.nombre_juego,
-                "opcion_apuesta": apuesta_usuario.opcion_apuesta_rel.nombre_opcion,
-                "is_gano": apuesta_usuario.is_gano,
-                "fecha": apuesta_usuario.created_at
-            }
-            historial_apuestas.append(apuesta)
-
-        # Convertimos el registro de usuario en un diccionario y excluimos el campo 'id'
-        usuario_dict = {
-            key: value for key, value in usuario.__dict__.items() 
-            if key != 'id' and not key.startswith('_')
+        for fila in pagina:
+            opcion = await catalogo.opcion(db, fila.opcion_apuesta)
+            historial_apuestas.append({
+                "codigo_sala": fila.codigo_sala,
+                "monto_apostado": fila.monto_apostado,
+                "is_sala_abierta": fila.is_abierta,
+                "juego": await catalogo.nombre_juego(db, fila.id_juego),
+                "opcion_apuesta": opcion.nombre_opcion if opcion else None,
+                "is_gano": fila.is_gano,
+                "fecha": fila.created_at
+            })
+
+        siguiente_cursor = None
+        if len(filas) > limite:
+            siguiente_cursor = codificar_cursor(pagina[-1].created_at, pagina[-1].id)
+
+        # Respuesta armada desde la fila (sin el id interno), validada por UsuarioHistorialRespuesta
+        return {
+            **usuario_publico(usuario),
+            "historial_apuestas": historial_apuestas,
+            "siguiente_cursor": siguiente_cursor,
         }
-
-        # Agregamos el historial de apuestas al diccionario del usuario
-        usuario_dict["historial_apuestas"] = historial_apuestas
-
-        return usuario_dict
+    except HTTPException:
+        raise
     except Exception as e:
         # Capturamos cualquier error inesperado
         raise HTTPException(
@@ -92,107 +206,109 @@ async def consultar_usuario_por_uuid(uuid: str, db: db_dependency):
         )
 
         
-@router_usuario.get('/sala/{codigo_sala}', status_code=status.HTTP_200_OK)
-async def consultar_sala_por_codigo(codigo_sala: str, db: Session = Depends(get_db)):
+@router_usuario.get('/sala/{codigo_sala}', status_code=status.HTTP_200_OK, response_model=SalaRespuesta)
+async def consultar_sala_por_codigo(codigo_sala: str, db: Annotated[AsyncSession, Depends(get_db_lectura("codigo_sala"))]):
 
     try:
-        # Consultar la sala por código
-        registro = db.query(Apuesta).filter(Apuesta.codigo_sala == codigo_sala).first()
+        # Consultar los agregados de la sala en memoria (se reconstruyen desde la base de datos si faltan)
+        pozo = await tracker_salas.obtener(db, codigo_sala)
 
-        if not registro:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"La sala {codigo_sala} no se ha encontrado."
-            )
-            
-        if not registro.is_abierta:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="La sala ya está cerrada"
-            )
+        if not pozo:
+            registro = (await db.execute(select(Apuesta.id).filter(Apuesta.codigo_sala == codigo_sala))).first()
+            if not registro:
+                registro = (await db.execute(select(ApuestaArchivo.id).filter(ApuestaArchivo.codigo_sala == codigo_sala))).first()
 
-        # Obtener el juego asociado
-        juego = db.query(Juegos).filter(Juegos.id == registro.id_juego).first()
+            if not registro:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail=f"La sala {codigo_sala} no se ha encontrado."
+                )
 
-        if not juego:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
-                detail="El juego asociado a la sala no se ha encontrado."
+                detail="La sala ya está cerrada"
             )
 
-        # Obtener las opciones de apuesta
-        opciones_apuesta = db.query(OpcionesApuestaJuegos).filter(
-            OpcionesApuestaJuegos.id_Juego == juego.id
-        ).all()
-
-        opciones_dict = [
-            {"id": opcion.id, "nombre_opcion": opcion.nombre_opcion}
-            for opcion in opciones_apuesta
-        ]
-
-        # Obtener cantidad de jugadores distintos y total apostado
-        apuestas_info = db.query(
-            func.count(ApuestaUsuario.id_usuario.distinct()).label("cantidad_jugadores"),
-            func.sum(ApuestaUsuario.monto_apostado).label("total_apostado")
-        ).filter(ApuestaUsuario.id_apuesta == registro.id).first()
-
-        cantidad_jugadores = apuestas_info.cantidad_jugadores or 0
-        total_apostado = float(apuestas_info.total_apostado or 0.0)
-
-        sala_dict = {
-            key: value for key, value in registro.__dict__.items()
-            if key != 'id' and not key.startswith('_') and key != 'id_juego' and key != 'resultado'
-        }
-
-        sala_dict["nombre_juego"] = juego.nombre_juego
-        sala_dict["opciones_apuesta"] = opciones_dict
-        sala_dict["cantidad_jugadores"] = cantidad_jugadores
-        sala_dict["total_apostado"] = total_apostado
-
-        return sala_dict
+        return pozo.como_dict()
     
+    except HTTPException:
+        raise
+
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error al consultar la sala: {str(e)}"
         )
     
+@router_usuario.get('/sala/{codigo_sala}/eventos', status_code=status.HTTP_200_OK)
+async def eventos_sala(codigo_sala: str, db: db_dependency):
+    # Stream (Server-Sent Events) con las instantáneas del pozo y el resultado final de la sala
+    pozo = await tracker_salas.obtener(db, codigo_sala)
+
+    if not pozo:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Sala no encontrada o ya se ha cerrado"
+        )
+
+    # Liberar la conexión antes de empezar el stream: no se vuelve a usar la base de datos
+    await db.close()
+
+    suscripcion = difusor_salas.suscribir(codigo_sala)
+    inicial = formatear_evento("sala", instantanea_sala(pozo))
+
+    async def generar_eventos():
+        try:
+            yield inicial
+            while True:
+                mensaje = await suscripcion.siguiente(timeout=DIFUSION_REFRESCO)
+                if mensaje:
+                    yield mensaje
+                elif suscripcion.finalizada:
+                    # El mensaje final ya se envió (se publica aunque el generador esté en un yield)
+                    break
+                else:
+                    # Comentario SSE como keep-alive cuando no hay novedades
+                    yield b": ping\n\n"
+        finally:
+            difusor_salas.desuscribir(suscripcion)
+
+    return StreamingResponse(
+        generar_eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router_usuario.post('/sala/simular', status_code=status.HTTP_200_OK)
-async def simular_apuesta(apuesta_usuario: SimulacionApuestaUsuarioBaseModel, db: db_dependency):
+async def simular_apuesta(apuesta_usuario: SimulacionApuestaUsuarioBaseModel, db: Annotated[AsyncSession, Depends(get_db_lectura("uuid_usuario", "codigo_sala"))]):
     try:
         # VALIDACIONES -----
         
         # 1. Verificar si el usuario existe
-        usuario = db.query(Usuario).filter(Usuario.uuid == apuesta_usuario.uuid_usuario).first()
+        usuario = (await db.execute(select(Usuario).filter(Usuario.uuid == apuesta_usuario.uuid_usuario))).scalars().first()
         if not usuario:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Usuario no encontrado"
             )
 
-        # 2. Verificar si la sala existe
-        apuesta = db.query(Apuesta).filter(Apuesta.codigo_sala == apuesta_usuario.codigo_sala, Apuesta.is_abierta == True).first()
-        if not apuesta:
+        # 2. Verificar si la sala existe (agregados en memoria)
+        pozo = await tracker_salas.obtener(db, apuesta_usuario.codigo_sala)
+        if not pozo:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Sala no encontrada o ya se ha cerrado"
             )
             
         # 3. Verificar si el usuario ya tiene una apuesta en esa sala
-        apuesta_existente = db.query(ApuestaUsuario).join(Apuesta).filter(
-            ApuestaUsuario.id_usuario == usuario.id,
-            Apuesta.codigo_sala == apuesta_usuario.codigo_sala
-        ).first()
-        
-        if apuesta_existente:
+        if usuario.id in pozo.jugadores:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Ya has realizado una apuesta en esta sala"
             )
 
-        # 4. Verificar si la opción de apuesta es válida
-        opcion_apuesta = db.query(OpcionesApuestaJuegos).filter(OpcionesApuestaJuegos.id == apuesta_usuario.opcion_apuesta).first()
-        if not opcion_apuesta:
+        # 4. Verificar si la opción de apuesta es válida para el juego de la sala
+        if not any(opcion["id"] == apuesta_usuario.opcion_apuesta for opcion in pozo.opciones_apuesta):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Opción de apuesta no válida"
@@ -214,16 +330,9 @@ async def simular_apuesta(apuesta_usuario: SimulacionApuestaUsuarioBaseModel, db
         
         # SIMULACION -------
     
-        # Realizar la consulta para obtener la suma de los puntos apostados por los ganadores
-        suma_valores_ganadores = db.query(func.sum(ApuestaUsuario.monto_apostado)).filter(
-            ApuestaUsuario.id_apuesta == apuesta.id,
-            ApuestaUsuario.opcion_apuesta == opcion_apuesta.id
-        ).scalar()
-    
-        # Realizar la consulta para obtener la suma de los puntos apostados por todos los jugadores
-        suma_valores_totales = db.query(func.sum(ApuestaUsuario.monto_apostado)).filter(
-            ApuestaUsuario.id_apuesta == apuesta.id
-        ).scalar()
+        # Suma de los puntos apostados a la opción elegida y por todos los jugadores
+        suma_valores_ganadores = pozo.por_opcion.get(apuesta_usuario.opcion_apuesta)
+        suma_valores_totales = pozo.total_apostado
             
         if not suma_valores_totales or not suma_valores_ganadores :
             raise HTTPException(
@@ -233,17 +342,18 @@ async def simular_apuesta(apuesta_usuario: SimulacionApuestaUsuarioBaseModel, db
         
         multiplicador = multiplicador_ganancia(apuesta_usuario.monto_apuesta, float(suma_valores_ganadores), float(suma_valores_totales))
 
-        print(multiplicador)
-
         return {"multiplicador": multiplicador}
     
     except SQLAlchemyError as e:
-        db.rollback()  # Hacer rollback en caso de error en la base de datos
+        await db.rollback()  # Hacer rollback en caso de error en la base de datos
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error al procesar la apuesta: {str(e)}"
         )
         
+    except HTTPException:
+        raise
+
     except Exception as e:
         # Capturamos cualquier error inesperado
         raise HTTPException(
@@ -252,41 +362,66 @@ async def simular_apuesta(apuesta_usuario: SimulacionApuestaUsuarioBaseModel, db
         )
 
 @router_usuario.post('/sala/apostar', status_code=status.HTTP_201_CREATED)
-async def entrar_en_apuesta(apuesta_usuario: ApuestaUsuarioBaseModel, db: db_dependency):
+async def entrar_en_apuesta(apuesta_usuario: ApuestaUsuarioBaseModel, db: db_dependency, response: Response, idempotency_key: ClaveIdempotencia = None):
+    # Con Idempotency-Key, un reintento recibe la respuesta de la primera petición sin repetir
+    # validaciones ni escrituras
+    return await almacen_idempotencia.ejecutar(
+        "apostar", idempotency_key, apuesta_usuario.model_dump(), response,
+        lambda: procesar_apuesta_agrupada(apuesta_usuario) if ingesta_apuestas.activa else procesar_apuesta(apuesta_usuario, db),
+        status.HTTP_201_CREATED,
+    )
+
+# Con APUESTAS_AGRUPADAS la apuesta se confirma en la misma transacción que las de otras
+# peticiones concurrentes; las validaciones y los mensajes son los de registrar_lote
+async def procesar_apuesta_agrupada(apuesta_usuario: ApuestaUsuarioBaseModel):
+    try:
+        resultado = await ingesta_apuestas.registrar(apuesta_usuario)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error al procesar la apuesta: {str(e)}"
+        )
+
+    if not resultado["aceptada"]:
+        raise HTTPException(status_code=resultado["codigo"], detail=resultado["detalle"])
+
+    escrituras_recientes.marcar(apuesta_usuario.uuid_usuario, apuesta_usuario.codigo_sala)
+    return {"message": resultado["detalle"]}
+
+async def procesar_apuesta(apuesta_usuario: ApuestaUsuarioBaseModel, db: AsyncSession):
     try:
         # VALIDACIONES -----
         
         # 1. Verificar si el usuario existe
-        usuario = db.query(Usuario).filter(Usuario.uuid == apuesta_usuario.uuid_usuario).first()
+        usuario = (await db.execute(select(Usuario).filter(Usuario.uuid == apuesta_usuario.uuid_usuario))).scalars().first()
         if not usuario:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Usuario no encontrado"
             )
 
-        # 2. Verificar si la sala existe
-        apuesta = db.query(Apuesta).filter(Apuesta.codigo_sala == apuesta_usuario.codigo_sala, Apuesta.is_abierta == True).first()
+        # 2. Verificar si la sala existe (bloqueo compartido: la liquidación espera a esta apuesta)
+        apuesta = (await db.execute(select(Apuesta).filter(Apuesta.codigo_sala == apuesta_usuario.codigo_sala, Apuesta.is_abierta == True).with_for_update(read=True))).scalars().first()
         if not apuesta:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Sala no encontrada o ya se ha cerrado"
             )
             
-        # 3. Verificar si el usuario ya tiene una apuesta en esa sala
-        apuesta_existente = db.query(ApuestaUsuario).join(Apuesta).filter(
-            ApuestaUsuario.id_usuario == usuario.id,
-            Apuesta.codigo_sala == apuesta_usuario.codigo_sala
-        ).first()
-        
-        if apuesta_existente:
+        # 3. Verificar si el usuario ya apostó en esta sala (consulta por la clave única; la
+        # restricción sigue siendo la garantía frente a apuestas concurrentes)
+        apuesta_previa = (await db.execute(
+            select(ApuestaUsuario.id).filter(ApuestaUsuario.id_usuario == usuario.id, ApuestaUsuario.id_apuesta == apuesta.id)
+        )).first()
+        if apuesta_previa:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Ya has realizado una apuesta en esta sala"
             )
 
-        # 4. Verificar si la opción de apuesta es válida
-        opcion_apuesta = db.query(OpcionesApuestaJuegos).filter(OpcionesApuestaJuegos.id == apuesta_usuario.opcion_apuesta).first()
-        if not opcion_apuesta:
+        # 4. Verificar si la opción de apuesta es válida y pertenece al juego de la sala
+        opcion_apuesta = await catalogo.opcion(db, apuesta_usuario.opcion_apuesta)
+        if not opcion_apuesta or opcion_apuesta.id_juego != apuesta.id_juego:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Opción de apuesta no válida"
@@ -299,7 +434,7 @@ async def entrar_en_apuesta(apuesta_usuario: ApuestaUsuarioBaseModel, db: db_dep
                 detail="El monto de la apuesta debe ser mayor a 200"
             )
             
-        # 6. Verificar si el monto apostado NO es mayor al saldo actual
+        # 6. Verificar si el monto apostado NO es mayor al saldo actual (chequeo rápido; el definitivo es el UPDATE condicional)
         if apuesta_usuario.monto_apuesta > usuario.saldo_actual:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -307,33 +442,97 @@ async def entrar_en_apuesta(apuesta_usuario: ApuestaUsuarioBaseModel, db: db_dep
             )
             
         # REGISTRO Y CONFIRMACIÓN DE LA APUESTA ---
-        nueva_apuesta_usuario = ApuestaUsuario(
+        # La restricción única (id_usuario, id_apuesta) garantiza una apuesta por sala aunque
+        # lleguen peticiones concurrentes desde distintos workers o nodos
+        try:
+            await db.execute(insert(ApuestaUsuario).values(
+                id_usuario=usuario.id,
+                id_apuesta=apuesta.id,
+                opcion_apuesta=apuesta_usuario.opcion_apuesta,
+                monto_apostado=apuesta_usuario.monto_apuesta,
+                is_gano=False
+            ))
+        except IntegrityError:
+            await db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Ya has realizado una apuesta en esta sala"
+            )
+
+        # Restar el monto apostado solo si el saldo alcanza, en una sola sentencia atómica
+        monto = Decimal(str(apuesta_usuario.monto_apuesta))
+        debito = await db.execute(
+            update(Usuario)
+            .where(Usuario.id == usuario.id, Usuario.saldo_actual >= monto)
+            .values(saldo_actual=Usuario.saldo_actual - monto)
+            .execution_options(synchronize_session=False)
+        )
+
+        if debito.rowcount != 1:
+            await db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="El monto de la apuesta es superior al disponible"
+            )
+
+        # Movimiento del libro de saldos, en la misma transacción que el débito
+        await db.execute(insert(MovimientoSaldo).values(
             id_usuario=usuario.id,
             id_apuesta=apuesta.id,
-            opcion_apuesta=apuesta_usuario.opcion_apuesta,
-            monto_apostado=apuesta_usuario.monto_apuesta,
-            is_gano=False 
-        )
-        
-        # Restar el monto apostado del saldo actual del usuario
-        usuario.saldo_actual -= Decimal(apuesta_usuario.monto_apuesta)
-        
-        # Agregar el registro de la apuesta y actualizar el saldo
-        db.add(nueva_apuesta_usuario)
-        db.commit()
+            tipo=MOVIMIENTO_APUESTA,
+            monto=-monto,
+        ))
+        await registrar_apuestas(db, [(usuario.id, monto)], ahora_utc())
+
+        await db.commit()
+        escrituras_recientes.marcar(apuesta_usuario.uuid_usuario, apuesta.codigo_sala)
+
+        # Actualizar los agregados en memoria de la sala
+        tracker_salas.registrar_apuesta(apuesta.codigo_sala, usuario.id, apuesta_usuario.opcion_apuesta, apuesta_usuario.monto_apuesta)
+        difusor_salas.notificar_apuesta(apuesta.codigo_sala)
 
         return {"message": "Apuesta registrada correctamente"}
     
     except SQLAlchemyError as e:
-        db.rollback()  # Hacer rollback en caso de error en la base de datos
+        await db.rollback()  # Hacer rollback en caso de error en la base de datos
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error al procesar la apuesta: {str(e)}"
         )
         
+    except HTTPException:
+        raise
+
     except Exception as e:
         # Capturamos cualquier error inesperado
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error al consultar la sala: {str(e)}"
         )
+
+@router_usuario.post('/sala/apostar/batch', status_code=status.HTTP_200_OK)
+async def entrar_en_apuestas_lote(lote: ApuestasLoteBaseModel, db: db_dependency, response: Response, idempotency_key: ClaveIdempotencia = None):
+    return await almacen_idempotencia.ejecutar(
+        "apostar/batch", idempotency_key, lote.model_dump(), response,
+        lambda: procesar_apuestas_lote(lote, db),
+    )
+
+async def procesar_apuestas_lote(lote: ApuestasLoteBaseModel, db: AsyncSession):
+    try:
+        # Validación y registro de todo el lote en una sola transacción
+        resultados = await registrar_lote(db, lote.apuestas)
+        escrituras_recientes.marcar(*{clave for apuesta in lote.apuestas for clave in (apuesta.uuid_usuario, apuesta.codigo_sala)})
+        aceptadas = sum(1 for resultado in resultados if resultado["aceptada"])
+
+        return {
+            "aceptadas": aceptadas,
+            "rechazadas": len(resultados) - aceptadas,
+            "resultados": resultados
+        }
+
+    except SQLAlchemyError as e:
+        await db.rollback()  # Hacer rollback en caso de error en la base de datos
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error al procesar el lote de apuestas: {str(e)}"
+        )
@@ -1,7 +1,13 @@
-from pydantic import BaseModel
+from typing import Optional
+from pydantic import BaseModel, Field
 
 class CrearSalaBaseModel(BaseModel):
     id_juego: int
+    duracion_segundos: Optional[int] = Field(None, gt=0, le=86_400)  # Cierre automático tras estos segundos
+    continua: bool = False  # Al cerrar, abrir otra ronda con la misma duración
+
+class CrearSalasBaseModel(CrearSalaBaseModel):
+    cantidad: int = Field(gt=0, le=10_000)
     
 class CerrarSalaBaseModel(BaseModel):
-    codigo_sala: str
\ No newline at end of file
+    codigo_sala: str
@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from datetime import datetime
+from typing import Optional
+from pydantic import BaseModel, Field
 
 class UsuarioBaseModel(BaseModel):
     nickname: str
@@ -9,8 +11,52 @@ class ApuestaUsuarioBaseModel(BaseModel):
     opcion_apuesta: int
     monto_apuesta: float
 
+class ApuestasLoteBaseModel(BaseModel):
+    apuestas: list[ApuestaUsuarioBaseModel] = Field(min_length=1, max_length=500)
+
 class SimulacionApuestaUsuarioBaseModel(BaseModel):
     uuid_usuario: str
     codigo_sala: str
     opcion_apuesta: int
-    monto_apuesta: float
\ No newline at end of file
+    monto_apuesta: float
+
+# RESPUESTAS -----
+
+class UsuarioRespuesta(BaseModel):
+    uuid: str
+    nickname: str
+    saldo_actual: float
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+
+class PaginaUsuariosRespuesta(BaseModel):
+    usuarios: list[UsuarioRespuesta]
+    siguiente_cursor: Optional[str]
+
+class ApuestaHistorialRespuesta(BaseModel):
+    codigo_sala: str
+    monto_apostado: float
+    is_sala_abierta: bool
+    juego: Optional[str]
+    opcion_apuesta: Optional[str]
+    is_gano: Optional[bool]
+    fecha: Optional[datetime]
+
+class UsuarioHistorialRespuesta(UsuarioRespuesta):
+    historial_apuestas: list[ApuestaHistorialRespuesta]
+    siguiente_cursor: Optional[str]
+
+class OpcionApuestaRespuesta(BaseModel):
+    id: int
+    nombre_opcion: str
+
+class SalaRespuesta(BaseModel):
+    codigo_sala: str
+    is_abierta: bool
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+    cierra_en: Optional[datetime]
+    nombre_juego: Optional[str]
+    opciones_apuesta: list[OpcionApuestaRespuesta]
+    cantidad_jugadores: int
+    total_apostado: float
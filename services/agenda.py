@@ -0,0 +1,136 @@
+import asyncio
+import heapq
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import select
+from config.db import SessionLocal, escrituras_recientes
+from models.global_models import Apuesta
+from services.liquidacion import ahora_utc, abrir_rondas_siguientes, cerrar_salas_vencidas
+from services.trabajadores import trabajadores_liquidacion
+
+
+# Segundos antes del cierre de una sala continua en que se abre la sala de la ronda siguiente,
+# para que los jugadores puedan entrar antes de que termine la ronda en curso
+AGENDA_ANTICIPACION = float(os.getenv("AGENDA_ANTICIPACION", "5"))
+
+# Segundos entre recargas de la agenda desde la base de datos (salas programadas por otros
+# procesos o creadas mientras la agenda estaba detenida)
+AGENDA_RECARGA = float(os.getenv("AGENDA_RECARGA", "30"))
+
+# Salas que se abren o cierran por transacción
+AGENDA_LOTE = int(os.getenv("AGENDA_LOTE", "200"))
+
+logger = logging.getLogger("gambling.agenda")
+
+
+# Agenda de cierres automáticos: un heap con los próximos vencimientos (cierres y aperturas de
+# la ronda siguiente) para dormir hasta el más cercano en lugar de consultar cada sala. Al
+# vencer uno, las salas vencidas se cierran en bloque con una consulta; las entradas de salas
+# cerradas a mano simplemente vencen sin efecto.
+class AgendaSalas:
+
+    def __init__(self):
+        self._vencimientos: list[tuple[datetime, str]] = []
+        self._cambio = asyncio.Event()
+        self._tarea: Optional[asyncio.Task] = None
+        self._detenido = False
+
+    def iniciar(self):
+        self._detenido = False
+        self._tarea = asyncio.create_task(self._ejecutar())
+
+    async def detener(self):
+        self._detenido = True
+        if self._tarea:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+
+    # Agrega los vencimientos de una sala; despierta a la agenda si es el más cercano
+    def programar(self, codigo_sala: str, cierra_en: datetime, intervalo_segundos: Optional[int] = None):
+        anterior = self._vencimientos[0][0] if self._vencimientos else None
+
+        heapq.heappush(self._vencimientos, (cierra_en, codigo_sala))
+        if intervalo_segundos:
+            heapq.heappush(self._vencimientos, (cierra_en - timedelta(seconds=AGENDA_ANTICIPACION), codigo_sala))
+
+        if anterior is None or self._vencimientos[0][0] < anterior:
+            self._cambio.set()
+
+    # Reconstruye la agenda con las salas abiertas que tienen cierre automático
+    async def recargar(self):
+        async with SessionLocal() as db:
+            salas = (await db.execute(
+                select(Apuesta.codigo_sala, Apuesta.cierra_en, Apuesta.intervalo_segundos)
+                .filter(Apuesta.is_abierta == True, Apuesta.cierra_en != None)
+            )).all()
+
+        vencimientos = {(sala.cierra_en, sala.codigo_sala) for sala in salas}
+        vencimientos |= {
+            (sala.cierra_en - timedelta(seconds=AGENDA_ANTICIPACION), sala.codigo_sala)
+            for sala in salas if sala.intervalo_segundos
+        }
+
+        # Se conservan las entradas agregadas durante la consulta (salas recién creadas)
+        self._vencimientos = list(vencimientos | set(self._vencimientos))
+        heapq.heapify(self._vencimientos)
+
+    async def _ejecutar(self):
+        ultima_recarga = float("-inf")
+        while not self._detenido:
+            if time.monotonic() - ultima_recarga >= AGENDA_RECARGA:
+                try:
+                    await self.recargar()
+                except Exception:
+                    logger.exception("Error al recargar la agenda de salas")
+                ultima_recarga = time.monotonic()
+
+            ahora = ahora_utc()
+            if self._vencimientos and self._vencimientos[0][0] <= ahora:
+                # Si la base de datos falla, las salas siguen abiertas y vuelven con la próxima recarga
+                try:
+                    await self.procesar_vencidas(ahora)
+                except Exception:
+                    logger.exception("Error al procesar los vencimientos de la agenda")
+                continue
+
+            espera = AGENDA_RECARGA - (time.monotonic() - ultima_recarga)
+            if self._vencimientos:
+                espera = min(espera, (self._vencimientos[0][0] - ahora).total_seconds())
+
+            try:
+                await asyncio.wait_for(self._cambio.wait(), max(espera, 0))
+            except asyncio.TimeoutError:
+                pass
+            self._cambio.clear()
+
+    # Abre las rondas siguientes y cierra las salas vencidas hasta `ahora`, en lotes
+    async def procesar_vencidas(self, ahora: datetime):
+        while self._vencimientos and self._vencimientos[0][0] <= ahora:
+            heapq.heappop(self._vencimientos)
+
+        hasta = ahora + timedelta(seconds=AGENDA_ANTICIPACION)
+        while True:
+            async with SessionLocal() as db:
+                siguientes = await abrir_rondas_siguientes(db, hasta, AGENDA_LOTE)
+            for sala in siguientes:
+                self.programar(sala.codigo_sala, sala.cierra_en, sala.intervalo_segundos)
+            escrituras_recientes.marcar(*(sala.codigo_sala for sala in siguientes))
+            if len(siguientes) < AGENDA_LOTE:
+                break
+
+        while True:
+            async with SessionLocal() as db:
+                codigos = await cerrar_salas_vencidas(db, ahora, AGENDA_LOTE)
+            escrituras_recientes.marcar(*codigos)
+            if codigos:
+                logger.info("Agenda: %d salas cerradas", len(codigos))
+                trabajadores_liquidacion.despertar()
+            if len(codigos) < AGENDA_LOTE:
+                break
+
+
+agenda_salas = AgendaSalas()
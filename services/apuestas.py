@@ -0,0 +1,160 @@
+from decimal import Decimal
+from fastapi import status
+from sqlalchemy import select, insert, update, case
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.global_models import Usuario, Apuesta, ApuestaUsuario, MovimientoSaldo
+from schemas.usuario import ApuestaUsuarioBaseModel
+from services.catalogo import catalogo
+from services.pozos import tracker_salas
+from services.difusion import difusor_salas
+from services.saldos import MOVIMIENTO_APUESTA
+from services.estadisticas import registrar_apuestas
+from services.liquidacion import ahora_utc
+
+
+def _rechazo(indice: int, codigo: int, detalle: str) -> dict:
+    return {"indice": indice, "aceptada": False, "codigo": codigo, "detalle": detalle}
+
+
+# INSERT de apuestas que omite las que ya existen para el mismo usuario y sala (uq_apuesta_usuario_sala)
+def _insertar_sin_repetidas(db: AsyncSession):
+    tabla = ApuestaUsuario.__table__
+    if db.bind.dialect.name == "mysql":
+        return mysql.insert(tabla).on_duplicate_key_update(id=tabla.c.id)
+    return sqlite.insert(tabla).on_conflict_do_nothing(index_elements=["id_usuario", "id_apuesta"])
+
+
+# Registra un lote de apuestas en una sola transacción. Las validaciones se resuelven con una
+# consulta por entidad para todo el lote y las apuestas aceptadas se insertan y se debitan en
+# bloque. Devuelve un resultado por apuesta (en el mismo orden): una apuesta inválida no
+# invalida el resto del lote.
+async def registrar_lote(db: AsyncSession, apuestas: list[ApuestaUsuarioBaseModel]) -> list[dict]:
+
+    # 1. Usuarios del lote, bloqueados para que el saldo leído siga vigente hasta el commit
+    usuarios = {
+        fila.uuid: fila for fila in (await db.execute(
+            select(Usuario.id, Usuario.uuid, Usuario.saldo_actual)
+            .filter(Usuario.uuid.in_({a.uuid_usuario for a in apuestas}))
+            .with_for_update()
+        )).all()
+    }
+
+    # 2. Salas abiertas del lote (bloqueo compartido, igual que una apuesta individual)
+    salas = {
+        fila.codigo_sala: fila for fila in (await db.execute(
+            select(Apuesta.id, Apuesta.codigo_sala, Apuesta.id_juego)
+            .filter(Apuesta.codigo_sala.in_({a.codigo_sala for a in apuestas}), Apuesta.is_abierta == True)
+            .with_for_update(read=True)
+        )).all()
+    }
+
+    # 3. Apuestas previas de esos usuarios en esas salas
+    previas = select(ApuestaUsuario.id_usuario, ApuestaUsuario.id_apuesta).filter(
+        ApuestaUsuario.id_usuario.in_([u.id for u in usuarios.values()]),
+        ApuestaUsuario.id_apuesta.in_([s.id for s in salas.values()])
+    )
+    existentes = set()
+    if usuarios and salas:
+        existentes = set((await db.execute(previas)).all())
+
+    # 4. Opciones de apuesta referenciadas (desde el catálogo en memoria)
+    opciones = {}
+    for id_opcion in {a.opcion_apuesta for a in apuestas}:
+        opciones[id_opcion] = await catalogo.opcion(db, id_opcion)
+
+    # VALIDACIONES ----- (mismo orden y mensajes que una apuesta individual: usuario, sala,
+    # apuesta previa en la sala, opción, monto mínimo y saldo)
+    resultados = []
+    nuevas_apuestas = []
+    saldos = {u.id: Decimal(u.saldo_actual) for u in usuarios.values()}
+
+    for indice, apuesta_usuario in enumerate(apuestas):
+        usuario = usuarios.get(apuesta_usuario.uuid_usuario)
+        if not usuario:
+            resultados.append(_rechazo(indice, status.HTTP_404_NOT_FOUND, "Usuario no encontrado"))
+            continue
+
+        sala = salas.get(apuesta_usuario.codigo_sala)
+        if not sala:
+            resultados.append(_rechazo(indice, status.HTTP_404_NOT_FOUND, "Sala no encontrada o ya se ha cerrado"))
+            continue
+
+        if (usuario.id, sala.id) in existentes:
+            resultados.append(_rechazo(indice, status.HTTP_400_BAD_REQUEST, "Ya has realizado una apuesta en esta sala"))
+            continue
+
+        opcion = opciones[apuesta_usuario.opcion_apuesta]
+        if not opcion or opcion.id_juego != sala.id_juego:
+            resultados.append(_rechazo(indice, status.HTTP_400_BAD_REQUEST, "Opción de apuesta no válida"))
+            continue
+
+        if apuesta_usuario.monto_apuesta <= 200:
+            resultados.append(_rechazo(indice, status.HTTP_400_BAD_REQUEST, "El monto de la apuesta debe ser mayor a 200"))
+            continue
+
+        monto = Decimal(str(apuesta_usuario.monto_apuesta))
+        if monto > saldos[usuario.id]:
+            resultados.append(_rechazo(indice, status.HTTP_400_BAD_REQUEST, "El monto de la apuesta es superior al disponible"))
+            continue
+
+        # Apuesta aceptada: reservar saldo y marcarla para que no se repita dentro del lote
+        saldos[usuario.id] -= monto
+        existentes.add((usuario.id, sala.id))
+        nuevas_apuestas.append({
+            "indice": indice,
+            "id_usuario": usuario.id,
+            "id_apuesta": sala.id,
+            "opcion_apuesta": apuesta_usuario.opcion_apuesta,
+            "monto_apostado": monto,
+            "is_gano": False,
+        })
+        resultados.append({"indice": indice, "aceptada": True, "codigo": status.HTTP_201_CREATED, "detalle": "Apuesta registrada correctamente"})
+
+    # REGISTRO EN BLOQUE -----
+    if nuevas_apuestas:
+        # Una apuesta individual concurrente del mismo usuario y sala puede confirmarse entre la
+        # validación y el INSERT (inserta antes de tocar Usuario, así que el bloqueo del paso 1 no
+        # la detiene). El INSERT omite esas filas y la relectura dice cuáles entraron: con
+        # REPEATABLE READ (el nivel por defecto de MySQL) la lectura usa la vista del paso 3, que
+        # no incluye lo confirmado después por otros, más lo insertado por esta transacción.
+        await db.execute(_insertar_sin_repetidas(db), [
+            {k: v for k, v in nueva.items() if k != "indice"} for nueva in nuevas_apuestas
+        ])
+        insertadas = set((await db.execute(previas)).all())
+
+        repetidas = [n for n in nuevas_apuestas if (n["id_usuario"], n["id_apuesta"]) not in insertadas]
+        for nueva in repetidas:
+            resultados[nueva["indice"]] = _rechazo(nueva["indice"], status.HTTP_400_BAD_REQUEST, "Ya has realizado una apuesta en esta sala")
+        nuevas_apuestas = [n for n in nuevas_apuestas if (n["id_usuario"], n["id_apuesta"]) in insertadas]
+
+    if nuevas_apuestas:
+        debitos: dict[int, Decimal] = {}
+        for nueva in nuevas_apuestas:
+            debitos[nueva["id_usuario"]] = debitos.get(nueva["id_usuario"], Decimal(0)) + nueva["monto_apostado"]
+
+        # Un único UPDATE descuenta a cada usuario la suma de sus apuestas aceptadas
+        await db.execute(
+            update(Usuario)
+            .where(Usuario.id.in_(debitos.keys()))
+            .values(saldo_actual=Usuario.saldo_actual - case(debitos, value=Usuario.id))
+            .execution_options(synchronize_session=False)
+        )
+
+        # Un movimiento del libro de saldos por apuesta aceptada
+        await db.execute(insert(MovimientoSaldo), [
+            {"id_usuario": nueva["id_usuario"], "id_apuesta": nueva["id_apuesta"], "tipo": MOVIMIENTO_APUESTA, "monto": -nueva["monto_apostado"]}
+            for nueva in nuevas_apuestas
+        ])
+        await registrar_apuestas(db, [(nueva["id_usuario"], nueva["monto_apostado"]) for nueva in nuevas_apuestas], ahora_utc())
+
+    await db.commit()
+
+    # Actualizar los agregados en memoria y notificar a los suscriptores de cada sala
+    codigos_por_id = {s.id: s.codigo_sala for s in salas.values()}
+    for nueva in nuevas_apuestas:
+        codigo_sala = codigos_por_id[nueva["id_apuesta"]]
+        tracker_salas.registrar_apuesta(codigo_sala, nueva["id_usuario"], nueva["opcion_apuesta"], nueva["monto_apostado"])
+        difusor_salas.notificar_apuesta(codigo_sala)
+
+    return resultados
@@ -0,0 +1,124 @@
+"""Archivo de salas: mueve las salas liquidadas hace más de ARCHIVO_EDAD segundos, con sus
+apuestas, de Apuesta y Apuesta_Usuario a Apuesta_Archivo y Apuesta_Usuario_Archivo.
+
+Corre periódicamente dentro de la API (ARCHIVO_INTERVALO) o bajo demanda:
+
+    python -m services.archivo
+"""
+import asyncio
+import json
+import logging
+import os
+from datetime import timedelta
+from typing import Optional
+from sqlalchemy import select, insert, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import func
+from config.db import SessionLocal, engine
+from models.global_models import Apuesta, ApuestaUsuario, ApuestaArchivo, ApuestaUsuarioArchivo, TrabajoLiquidacion
+
+
+# Segundos desde el cierre a partir de los cuales una sala liquidada se archiva
+ARCHIVO_EDAD = float(os.getenv("ARCHIVO_EDAD", str(7 * 24 * 3600)))
+
+# Segundos entre pasadas del archivo dentro de la API (0 = solo bajo demanda)
+ARCHIVO_INTERVALO = float(os.getenv("ARCHIVO_INTERVALO", "3600"))
+
+# Salas movidas por transacción, para acotar la duración de los bloqueos
+ARCHIVO_LOTE = int(os.getenv("ARCHIVO_LOTE", "100"))
+
+COLUMNAS_SALA = ("id", "codigo_sala", "is_abierta", "resultado", "id_juego", "cierra_en", "intervalo_segundos", "created_at", "updated_at")
+COLUMNAS_APUESTA = ("id", "id_usuario", "id_apuesta", "opcion_apuesta", "monto_apostado", "is_gano", "monto_ganado", "created_at", "updated_at")
+
+logger = logging.getLogger("gambling.archivo")
+
+
+# Mueve un lote de salas liquidadas antes de `corte` y sus apuestas a las tablas de archivo en
+# una transacción. Devuelve cuántas salas movió.
+async def archivar_lote(db: AsyncSession, corte, limite: int) -> int:
+    ids = (await db.execute(
+        select(Apuesta.id)
+        .filter(Apuesta.is_abierta == False, Apuesta.resultado != None, Apuesta.updated_at < corte)
+        .order_by(Apuesta.id)
+        .limit(limite)
+        .with_for_update(skip_locked=True)
+    )).scalars().all()
+
+    if not ids:
+        await db.rollback()
+        return 0
+
+    await db.execute(insert(ApuestaArchivo).from_select(
+        COLUMNAS_SALA,
+        select(*(getattr(Apuesta, c) for c in COLUMNAS_SALA)).filter(Apuesta.id.in_(ids))
+    ))
+    await db.execute(insert(ApuestaUsuarioArchivo).from_select(
+        COLUMNAS_APUESTA,
+        select(*(getattr(ApuestaUsuario, c) for c in COLUMNAS_APUESTA)).filter(ApuestaUsuario.id_apuesta.in_(ids))
+    ))
+
+    # Los trabajos de liquidación ya terminaron: su estado se deduce del resultado archivado
+    await db.execute(delete(TrabajoLiquidacion).where(TrabajoLiquidacion.id_apuesta.in_(ids)))
+    await db.execute(delete(ApuestaUsuario).where(ApuestaUsuario.id_apuesta.in_(ids)))
+    await db.execute(delete(Apuesta).where(Apuesta.id.in_(ids)))
+    await db.commit()
+    return len(ids)
+
+
+# Archiva en lotes todas las salas que superan la edad indicada
+async def archivar_salas(edad: float = ARCHIVO_EDAD) -> dict:
+    async with SessionLocal() as db:
+        # La hora del motor, para comparar con updated_at en la misma zona horaria
+        corte = (await db.execute(select(func.current_timestamp()))).scalar() - timedelta(seconds=edad)
+
+    salas = 0
+    lotes = 0
+    while True:
+        async with SessionLocal() as db:
+            movidas = await archivar_lote(db, corte, ARCHIVO_LOTE)
+        salas += movidas
+        lotes += 1 if movidas else 0
+        if movidas < ARCHIVO_LOTE:
+            break
+
+    return {"salas": salas, "lotes": lotes, "corte": corte}
+
+
+class ArchivoSalas:
+
+    def __init__(self):
+        self._tarea: Optional[asyncio.Task] = None
+
+    def iniciar(self):
+        if ARCHIVO_INTERVALO > 0:
+            self._tarea = asyncio.create_task(self._ejecutar())
+
+    async def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+
+    async def _ejecutar(self):
+        while True:
+            await asyncio.sleep(ARCHIVO_INTERVALO)
+            try:
+                resumen = await archivar_salas()
+                if resumen["salas"]:
+                    logger.info("Archivo: %d salas en %d lotes", resumen["salas"], resumen["lotes"])
+            except Exception:
+                logger.exception("Error al archivar salas")
+
+
+archivo_salas = ArchivoSalas()
+
+
+async def _ejecutar():
+    try:
+        print(json.dumps(await archivar_salas(), default=str, indent=2))
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(_ejecutar())
@@ -0,0 +1,102 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.global_models import Juegos, OpcionesApuestaJuegos
+
+
+# Segundos de vigencia del catálogo antes de recargarlo (0 = solo al iniciar o por el endpoint de admin)
+CATALOGO_TTL = float(os.getenv("CATALOGO_TTL", "300"))
+
+# Tiempo mínimo entre recargas provocadas por una búsqueda fallida (evita que ids inválidos
+# generen una consulta por petición)
+CATALOGO_RECARGA_MINIMA = 1.0
+
+
+@dataclass(frozen=True)
+class OpcionCatalogo:
+    id: int
+    id_juego: int
+    nombre_opcion: str
+
+
+# Caché en memoria de Juegos y Opciones_Apuesta_Juegos, que casi nunca cambian
+class CatalogoJuegos:
+
+    def __init__(self):
+        self._juegos: dict[int, str] = {}
+        self._opciones_por_juego: dict[int, list[OpcionCatalogo]] = {}
+        self._opcion_por_id: dict[int, OpcionCatalogo] = {}
+        self._opcion_por_nombre: dict[tuple[int, str], OpcionCatalogo] = {}
+        self._cargado_en: Optional[float] = None
+        self._bloqueo = asyncio.Lock()
+
+    async def recargar(self, db: AsyncSession):
+        juegos = (await db.execute(select(Juegos.id, Juegos.nombre_juego))).all()
+        opciones = (await db.execute(
+            select(OpcionesApuestaJuegos.id, OpcionesApuestaJuegos.id_Juego, OpcionesApuestaJuegos.nombre_opcion)
+            .order_by(OpcionesApuestaJuegos.id)
+        )).all()
+
+        opciones_por_juego: dict[int, list[OpcionCatalogo]] = {}
+        opcion_por_id = {}
+        opcion_por_nombre = {}
+        for fila in opciones:
+            opcion = OpcionCatalogo(id=fila.id, id_juego=fila.id_Juego, nombre_opcion=fila.nombre_opcion)
+            opciones_por_juego.setdefault(opcion.id_juego, []).append(opcion)
+            opcion_por_id[opcion.id] = opcion
+            # Equivalente al ilike usado antes para buscar el resultado por nombre
+            opcion_por_nombre.setdefault((opcion.id_juego, opcion.nombre_opcion.lower()), opcion)
+
+        # Reemplazo completo: las lecturas concurrentes ven el catálogo anterior o el nuevo
+        self._juegos = {fila.id: fila.nombre_juego for fila in juegos}
+        self._opciones_por_juego = opciones_por_juego
+        self._opcion_por_id = opcion_por_id
+        self._opcion_por_nombre = opcion_por_nombre
+        self._cargado_en = time.monotonic()
+
+    def _edad(self) -> float:
+        return float("inf") if self._cargado_en is None else time.monotonic() - self._cargado_en
+
+    # Carga el catálogo si nunca se cargó o si venció su TTL (una sola recarga a la vez)
+    async def asegurar(self, db: AsyncSession, forzar_si_mayor_a: Optional[float] = None):
+        limite = forzar_si_mayor_a
+        if limite is None:
+            limite = CATALOGO_TTL if CATALOGO_TTL > 0 else float("inf")
+
+        if self._edad() < limite:
+            return
+
+        async with self._bloqueo:
+            if self._edad() >= limite:
+                await self.recargar(db)
+
+    async def _buscar(self, db: AsyncSession, tabla: Callable[[], dict], clave):
+        await self.asegurar(db)
+        valor = tabla().get(clave)
+        if valor is None:
+            # Puede ser un registro nuevo: recargar (como mucho una vez por segundo) y reintentar
+            await self.asegurar(db, forzar_si_mayor_a=CATALOGO_RECARGA_MINIMA)
+            valor = tabla().get(clave)
+        return valor
+
+    async def opcion(self, db: AsyncSession, id_opcion: int) -> Optional[OpcionCatalogo]:
+        return await self._buscar(db, lambda: self._opcion_por_id, id_opcion)
+
+    async def opcion_por_nombre(self, db: AsyncSession, id_juego: int, nombre_opcion: str) -> Optional[OpcionCatalogo]:
+        return await self._buscar(db, lambda: self._opcion_por_nombre, (id_juego, nombre_opcion.lower()))
+
+    async def nombre_juego(self, db: AsyncSession, id_juego: int) -> Optional[str]:
+        return await self._buscar(db, lambda: self._juegos, id_juego)
+
+    async def opciones_juego(self, db: AsyncSession, id_juego: int) -> list[OpcionCatalogo]:
+        return await self._buscar(db, lambda: self._opciones_por_juego, id_juego) or []
+
+    def resumen(self) -> dict:
+        return {"juegos": len(self._juegos), "opciones": len(self._opcion_por_id)}
+
+
+catalogo = CatalogoJuegos()
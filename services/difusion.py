@@ -0,0 +1,194 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Optional
+from sqlalchemy import select, union_all
+from config.db import SessionLocal
+from models.global_models import Apuesta, ApuestaArchivo
+from prolog.evento_ruleta import multiplicador_ganancia
+from services.catalogo import catalogo
+from services.pozos import tracker_salas, PozoSala
+
+
+# Ventana (segundos) en la que se agrupan las apuestas de una sala antes de emitir una instantánea
+DIFUSION_INTERVALO = float(os.getenv("DIFUSION_INTERVALO", "0.25"))
+
+# Segundos entre refrescos de las salas con suscriptores, que también es el keep-alive de los
+# streams. Las apuestas, cierres y liquidaciones de otros procesos solo llegan con el refresco.
+DIFUSION_REFRESCO = float(os.getenv("DIFUSION_REFRESCO", "15"))
+
+logger = logging.getLogger("gambling.difusion")
+
+
+# Canal de un suscriptor: solo guarda el último mensaje, así un cliente lento
+# recibe la instantánea más reciente en vez de acumular una cola
+class Suscripcion:
+
+    def __init__(self, codigo_sala: str):
+        self.codigo_sala = codigo_sala
+        self.finalizada = False
+        self._ultimo: Optional[bytes] = None
+        self._evento = asyncio.Event()
+
+    def publicar(self, mensaje: bytes, final: bool = False):
+        # Después del mensaje final no se acepta otro (el final no puede pisarse)
+        if self.finalizada:
+            return
+        self._ultimo = mensaje
+        self.finalizada = final
+        self._evento.set()
+
+    # Espera el siguiente mensaje; devuelve None si vence el tiempo sin novedades. Finalizada, no
+    # espera: devuelve el mensaje final si aún no se leyó, y después None
+    async def siguiente(self, timeout: float) -> Optional[bytes]:
+        if not self.finalizada:
+            try:
+                await asyncio.wait_for(self._evento.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        self._evento.clear()
+        mensaje, self._ultimo = self._ultimo, None
+        return mensaje
+
+
+def formatear_evento(evento: str, datos: dict) -> bytes:
+    return f"event: {evento}\ndata: {json.dumps(datos)}\n\n".encode()
+
+
+def instantanea_sala(pozo: PozoSala) -> dict:
+    total = float(pozo.total_apostado)
+    opciones = []
+    for opcion in pozo.opciones_apuesta:
+        total_opcion = float(pozo.por_opcion.get(opcion["id"], 0))
+        opciones.append({
+            "id": opcion["id"],
+            "nombre_opcion": opcion["nombre_opcion"],
+            "total_apostado": total_opcion,
+            "multiplicador": multiplicador_ganancia(0, total_opcion, total),
+        })
+
+    return {
+        "codigo_sala": pozo.codigo_sala,
+        "total_apostado": total,
+        "cantidad_jugadores": pozo.cantidad_jugadores,
+        "opciones_apuesta": opciones,
+    }
+
+
+# Difunde a los suscriptores de cada sala las instantáneas del pozo. Las apuestas se agrupan
+# durante DIFUSION_INTERVALO y cada instantánea se serializa una sola vez para todos los
+# suscriptores, sin consultas a la base de datos (los datos salen del tracker de salas). Cada
+# DIFUSION_REFRESCO segundos refresca además las salas con suscriptores, para lo que ocurre en
+# otros procesos.
+class DifusorSalas:
+
+    def __init__(self):
+        self._suscriptores: dict[str, set[Suscripcion]] = {}
+        self._ultimas: dict[str, bytes] = {}
+        self._pendientes: set[str] = set()
+        self._programado = False
+        self._tarea: Optional[asyncio.Task] = None
+
+    def iniciar(self):
+        self._tarea = asyncio.create_task(self._ejecutar())
+
+    async def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+
+    def suscribir(self, codigo_sala: str) -> Suscripcion:
+        suscripcion = Suscripcion(codigo_sala)
+        self._suscriptores.setdefault(codigo_sala, set()).add(suscripcion)
+        return suscripcion
+
+    def desuscribir(self, suscripcion: Suscripcion):
+        suscriptores = self._suscriptores.get(suscripcion.codigo_sala)
+        if suscriptores is not None:
+            suscriptores.discard(suscripcion)
+            if not suscriptores:
+                del self._suscriptores[suscripcion.codigo_sala]
+                self._ultimas.pop(suscripcion.codigo_sala, None)
+
+    def cantidad_suscriptores(self) -> int:
+        return sum(len(s) for s in self._suscriptores.values())
+
+    # Marca la sala como modificada; la instantánea sale al cerrar la ventana de agrupación
+    def notificar_apuesta(self, codigo_sala: str):
+        if codigo_sala not in self._suscriptores:
+            return
+
+        self._pendientes.add(codigo_sala)
+        if not self._programado:
+            self._programado = True
+            asyncio.get_running_loop().call_later(DIFUSION_INTERVALO, self._emitir_pendientes)
+
+    def _emitir_pendientes(self):
+        self._programado = False
+        pendientes, self._pendientes = self._pendientes, set()
+
+        for codigo_sala in pendientes:
+            pozo = tracker_salas.en_memoria(codigo_sala)
+            if pozo:
+                self._difundir_instantanea(pozo)
+
+    # Refresca las salas con suscriptores desde el tracker, que solo vuelve a la base de datos al
+    # vencer SALAS_CACHE_TTL: difunde la instantánea si cambió y el resultado de las salas que ya
+    # no están abiertas. Una sala cerrada y todavía sin liquidar espera al refresco siguiente.
+    async def refrescar(self):
+        cerradas = []
+        async with SessionLocal() as db:
+            for codigo_sala in list(self._suscriptores):
+                pozo = await tracker_salas.obtener(db, codigo_sala)
+                if pozo:
+                    self._difundir_instantanea(pozo)
+                else:
+                    cerradas.append(codigo_sala)
+
+            if not cerradas:
+                return
+
+            resultados = (await db.execute(union_all(
+                select(Apuesta.codigo_sala, Apuesta.resultado)
+                .filter(Apuesta.codigo_sala.in_(cerradas), Apuesta.resultado != None),
+                select(ApuestaArchivo.codigo_sala, ApuestaArchivo.resultado)
+                .filter(ApuestaArchivo.codigo_sala.in_(cerradas), ApuestaArchivo.resultado != None),
+            ))).all()
+            for codigo_sala, id_resultado in resultados:
+                opcion = await catalogo.opcion(db, id_resultado)
+                self.publicar_resultado(codigo_sala, opcion.id, opcion.nombre_opcion)
+
+    async def _ejecutar(self):
+        while True:
+            await asyncio.sleep(DIFUSION_REFRESCO)
+            if not self._suscriptores:
+                continue
+            try:
+                await self.refrescar()
+            except Exception:
+                logger.exception("Error al refrescar las salas con suscriptores")
+
+    def _difundir_instantanea(self, pozo: PozoSala):
+        mensaje = formatear_evento("sala", instantanea_sala(pozo))
+        if mensaje != self._ultimas.get(pozo.codigo_sala):
+            self._ultimas[pozo.codigo_sala] = mensaje
+            self._difundir(pozo.codigo_sala, mensaje)
+
+    # Evento final con el resultado de la sala; cierra los streams de sus suscriptores
+    def publicar_resultado(self, codigo_sala: str, id_opcion: int, nombre_opcion: str):
+        self._pendientes.discard(codigo_sala)
+        mensaje = formatear_evento("resultado", {
+            "codigo_sala": codigo_sala,
+            "id_opcion": id_opcion,
+            "nombre_opcion": nombre_opcion,
+        })
+        self._difundir(codigo_sala, mensaje, final=True)
+
+    def _difundir(self, codigo_sala: str, mensaje: bytes, final: bool = False):
+        for suscripcion in self._suscriptores.get(codigo_sala, ()):
+            suscripcion.publicar(mensaje, final)
+
+
+difusor_salas = DifusorSalas()
@@ -0,0 +1,194 @@
+"""Estadísticas por usuario y rankings.
+
+Estadistica_Usuario guarda, por usuario y periodo (total, día y semana ISO), agregados que se
+actualizan en la misma transacción al apostar y al liquidar. Lo apostado cuenta en el periodo
+de la apuesta y el resultado en el periodo de la liquidación (fechas en UTC).
+
+Para recalcularlos desde el historial (tablas vivas y de archivo) en una sola pasada:
+
+    python -m services.estadisticas
+"""
+import asyncio
+import json
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from sqlalchemy import select, delete, insert, case, literal, union_all, cast, Integer
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import func
+from config.db import SessionLocal, engine
+from models.global_models import Apuesta, ApuestaUsuario, ApuestaArchivo, ApuestaUsuarioArchivo, EstadisticaUsuario
+
+
+# Columnas acumuladas (tasa_victorias se deriva de ganadas y liquidadas)
+CONTADORES = ("apuestas", "liquidadas", "ganadas", "total_apostado", "total_ganado", "ganancia_neta")
+
+# Filas por lote del cursor y de los INSERT de la reconstrucción
+ESTADISTICAS_LOTE = 5000
+
+
+def periodo_dia(fecha: date) -> str:
+    return f"dia:{fecha:%Y-%m-%d}"
+
+
+def periodo_semana(fecha: date) -> str:
+    anio, semana, _ = fecha.isocalendar()
+    return f"semana:{anio}-W{semana:02d}"
+
+
+# Periodos a los que suma un evento ocurrido en `fecha`
+def periodos(fecha: datetime) -> tuple[str, str, str]:
+    return ("total", periodo_dia(fecha), periodo_semana(fecha))
+
+
+# INSERT (de valores o de un SELECT) que suma a los contadores si la fila (id_usuario, periodo)
+# ya existe. La tasa va primera porque MySQL evalúa las asignaciones en orden y debe ver los
+# contadores anteriores.
+def _insertar_o_sumar(db: AsyncSession, columnas=None, seleccion=None):
+    tabla = EstadisticaUsuario.__table__
+    es_mysql = db.bind.dialect.name == "mysql"
+
+    sentencia = (mysql if es_mysql else sqlite).insert(tabla)
+    if seleccion is not None:
+        sentencia = sentencia.from_select(columnas, seleccion)
+    nuevos = sentencia.inserted if es_mysql else sentencia.excluded
+
+    tasa = func.coalesce(
+        (tabla.c.ganadas + nuevos.ganadas) * 1.0 / func.nullif(tabla.c.liquidadas + nuevos.liquidadas, 0), 0
+    )
+    asignaciones = [("tasa_victorias", tasa)] + [(c, tabla.c[c] + nuevos[c]) for c in CONTADORES]
+
+    if es_mysql:
+        return sentencia.on_duplicate_key_update(asignaciones)
+    return sentencia.on_conflict_do_update(index_elements=["id_usuario", "periodo"], set_=dict(asignaciones))
+
+
+# Suma apuestas nuevas a las estadísticas. `apuestas` es una lista de (id_usuario, monto).
+# No confirma la transacción.
+async def registrar_apuestas(db: AsyncSession, apuestas: list[tuple[int, Decimal]], fecha: datetime):
+    acumulado: dict[tuple[int, str], list] = {}
+    for id_usuario, monto in apuestas:
+        for periodo in periodos(fecha):
+            fila = acumulado.setdefault((id_usuario, periodo), [0, Decimal(0)])
+            fila[0] += 1
+            fila[1] += Decimal(str(monto))
+
+    await db.execute(_insertar_o_sumar(db), [
+        {
+            "id_usuario": id_usuario, "periodo": periodo, "apuestas": cantidad, "liquidadas": 0, "ganadas": 0,
+            "total_apostado": monto, "total_ganado": 0, "ganancia_neta": 0, "tasa_victorias": 0,
+        }
+        for (id_usuario, periodo), (cantidad, monto) in acumulado.items()
+    ])
+
+
+# Suma el resultado de todas las apuestas de una sala liquidada, con un INSERT ... SELECT por
+# periodo (cada usuario tiene una sola apuesta por sala). No confirma la transacción.
+async def registrar_liquidacion(db: AsyncSession, id_apuesta: int, fecha: datetime):
+    ganado = func.coalesce(ApuestaUsuario.monto_ganado, 0)
+    gano = case((ApuestaUsuario.is_gano == True, 1), else_=0)
+
+    for periodo in periodos(fecha):
+        await db.execute(_insertar_o_sumar(
+            db,
+            ["id_usuario", "periodo", "apuestas", "liquidadas", "ganadas", "total_apostado", "total_ganado", "ganancia_neta", "tasa_victorias"],
+            select(
+                ApuestaUsuario.id_usuario,
+                literal(periodo),
+                literal(0),
+                literal(1),
+                gano,
+                literal(0),
+                ganado,
+                ganado - ApuestaUsuario.monto_apostado,
+                gano,
+            ).filter(ApuestaUsuario.id_apuesta == id_apuesta)
+        ))
+
+
+# Segundos desde epoch de una columna TIMESTAMP, que no dependen de la zona horaria de la sesión
+# (MySQL devuelve los TIMESTAMP en la zona de la sesión; SQLite los guarda en UTC)
+def _epoch(db: AsyncSession, columna):
+    if db.bind.dialect.name == "mysql":
+        return func.unix_timestamp(columna)
+    return cast(func.strftime("%s", columna), Integer)
+
+
+def _fecha_utc(segundos) -> datetime:
+    return datetime.fromtimestamp(int(segundos), timezone.utc).replace(tzinfo=None)
+
+
+# Recalcula todas las estadísticas recorriendo una vez el historial de apuestas (vivas y
+# archivadas) por lotes del cursor del servidor. La memoria crece con usuarios × periodos, no
+# con la cantidad de apuestas. Conviene correrla sin tráfico: las apuestas que lleguen durante
+# la reconstrucción pueden quedar fuera. Los periodos salen de las fechas en UTC, igual que al
+# apostar y al liquidar (ahora_utc()), sea cual sea la zona horaria del servidor MySQL.
+async def reconstruir_estadisticas() -> dict:
+    acumulado: dict[tuple[int, str], dict] = {}
+    apuestas = 0
+    async with SessionLocal() as db:
+        consultas = []
+        for tabla_apuestas, tabla_salas in ((ApuestaUsuario, Apuesta), (ApuestaUsuarioArchivo, ApuestaArchivo)):
+            consultas.append(
+                select(
+                    tabla_apuestas.id_usuario,
+                    tabla_apuestas.monto_apostado,
+                    tabla_apuestas.monto_ganado,
+                    tabla_apuestas.is_gano,
+                    _epoch(db, tabla_apuestas.created_at).label("creada_en"),
+                    tabla_salas.resultado,
+                    _epoch(db, tabla_salas.updated_at).label("liquidada_en"),
+                ).join(tabla_salas, tabla_salas.id == tabla_apuestas.id_apuesta)
+            )
+
+        resultado = await db.stream(union_all(*consultas).execution_options(yield_per=ESTADISTICAS_LOTE))
+        async for lote in resultado.partitions():
+            for fila in lote:
+                apuestas += 1
+                monto = Decimal(str(fila.monto_apostado))
+                creada_en = _fecha_utc(fila.creada_en)
+                for periodo in periodos(creada_en):
+                    estadistica = acumulado.setdefault((fila.id_usuario, periodo), dict.fromkeys(CONTADORES, 0))
+                    estadistica["apuestas"] += 1
+                    estadistica["total_apostado"] += monto
+
+                if fila.resultado is None:
+                    continue
+
+                ganado = Decimal(str(fila.monto_ganado or 0))
+                liquidada_en = _fecha_utc(fila.liquidada_en) if fila.liquidada_en is not None else creada_en
+                for periodo in periodos(liquidada_en):
+                    estadistica = acumulado.setdefault((fila.id_usuario, periodo), dict.fromkeys(CONTADORES, 0))
+                    estadistica["liquidadas"] += 1
+                    estadistica["ganadas"] += 1 if fila.is_gano else 0
+                    estadistica["total_ganado"] += ganado
+                    estadistica["ganancia_neta"] += ganado - monto
+
+    filas = [
+        {
+            "id_usuario": id_usuario,
+            "periodo": periodo,
+            **estadistica,
+            "tasa_victorias": round(Decimal(estadistica["ganadas"]) / estadistica["liquidadas"], 4) if estadistica["liquidadas"] else 0,
+        }
+        for (id_usuario, periodo), estadistica in acumulado.items()
+    ]
+
+    async with SessionLocal() as db:
+        await db.execute(delete(EstadisticaUsuario))
+        for inicio in range(0, len(filas), ESTADISTICAS_LOTE):
+            await db.execute(insert(EstadisticaUsuario), filas[inicio:inicio + ESTADISTICAS_LOTE])
+        await db.commit()
+
+    return {"apuestas": apuestas, "filas": len(filas)}
+
+
+async def _ejecutar():
+    try:
+        print(json.dumps(await reconstruir_estadisticas(), indent=2))
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(_ejecutar())
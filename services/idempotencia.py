@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Annotated, Awaitable, Callable, Optional
+from fastapi import Header, HTTPException, Response, status
+from config.metricas import registro
+
+
+# Segundos que se guarda la respuesta de una Idempotency-Key
+IDEMPOTENCIA_TTL = float(os.getenv("IDEMPOTENCIA_TTL", "600"))
+
+# Máximo de claves guardadas por proceso (al superarlo se descartan las más antiguas)
+IDEMPOTENCIA_MAXIMO = int(os.getenv("IDEMPOTENCIA_MAXIMO", "10000"))
+
+# Largo máximo aceptado para la cabecera Idempotency-Key
+IDEMPOTENCIA_LARGO_CLAVE = 255
+
+# Cabecera Idempotency-Key opcional de las rutas que la aceptan
+ClaveIdempotencia = Annotated[Optional[str], Header(alias="Idempotency-Key", max_length=IDEMPOTENCIA_LARGO_CLAVE)]
+
+# Cabecera que marca una respuesta repetida desde el almacén
+CABECERA_REPETIDA = "Idempotent-Replayed"
+
+
+@dataclass
+class EntradaIdempotencia:
+    huella: str
+    vence_en: float
+    # Se resuelve con (status_code, cuerpo, es_error), o con None si la petición original falló
+    # sin una respuesta que valga la pena repetir
+    resultado: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+
+def huella_peticion(cuerpo) -> str:
+    return hashlib.sha256(json.dumps(cuerpo, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# Respuestas recientes por (ruta, Idempotency-Key), en memoria y por proceso. Un reintento con
+# la misma clave recibe la respuesta guardada sin repetir validaciones ni escrituras, y uno que
+# llega mientras la original sigue en curso espera su resultado en lugar de competir con ella.
+# Las claves vencen a los IDEMPOTENCIA_TTL segundos; el diccionario está ordenado por
+# vencimiento, así que purgar solo mira el principio.
+class AlmacenIdempotencia:
+
+    def __init__(self):
+        self._entradas: OrderedDict[tuple[str, str], EntradaIdempotencia] = OrderedDict()
+
+    def _purgar(self):
+        ahora = time.monotonic()
+        while self._entradas:
+            entrada = next(iter(self._entradas.values()))
+            if entrada.vence_en > ahora and len(self._entradas) <= IDEMPOTENCIA_MAXIMO:
+                break
+            self._entradas.popitem(last=False)
+
+    async def ejecutar(
+        self,
+        ruta: str,
+        clave: Optional[str],
+        cuerpo,
+        respuesta: Response,
+        funcion: Callable[[], Awaitable],
+        status_code: int = status.HTTP_200_OK,
+    ):
+        if not clave:
+            return await funcion()
+
+        llave = (ruta, clave)
+        huella = huella_peticion(cuerpo)
+
+        while True:
+            self._purgar()
+            entrada = self._entradas.get(llave)
+            if entrada is None:
+                break
+
+            if entrada.huella != huella:
+                raise HTTPException(
+                    status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    detail="La Idempotency-Key ya se usó con una petición distinta"
+                )
+
+            en_curso = not entrada.resultado.done()
+            # shield: si el cliente que espera se desconecta no se cancela el resultado compartido
+            guardado = await asyncio.shield(entrada.resultado)
+            if guardado is None:
+                # La original falló sin respuesta guardada: este reintento la ejecuta de nuevo
+                continue
+
+            registro.incrementar("idempotencia_respuestas_total", 1, ruta, "esperada" if en_curso else "repetida")
+            codigo, contenido, es_error = guardado
+            if es_error:
+                raise HTTPException(status_code=codigo, detail=contenido, headers={CABECERA_REPETIDA: "true"})
+            respuesta.status_code = codigo
+            respuesta.headers[CABECERA_REPETIDA] = "true"
+            return contenido
+
+        entrada = self._entradas[llave] = EntradaIdempotencia(huella=huella, vence_en=time.monotonic() + IDEMPOTENCIA_TTL)
+        self._purgar()
+        registro.incrementar("idempotencia_respuestas_total", 1, ruta, "nueva")
+
+        try:
+            contenido = await funcion()
+        except HTTPException as error:
+            # Los rechazos (4xx) se repiten tal cual; los errores del servidor no se guardan para
+            # que el reintento vuelva a intentarlo
+            if error.status_code < 500:
+                entrada.resultado.set_result((error.status_code, error.detail, True))
+            else:
+                self._descartar(llave, entrada)
+            raise
+        except BaseException:
+            self._descartar(llave, entrada)
+            raise
+
+        entrada.resultado.set_result((status_code, contenido, False))
+        return contenido
+
+    def _descartar(self, llave: tuple[str, str], entrada: EntradaIdempotencia):
+        if self._entradas.get(llave) is entrada:
+            del self._entradas[llave]
+        entrada.resultado.set_result(None)
+
+
+almacen_idempotencia = AlmacenIdempotencia()
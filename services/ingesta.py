@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+from sqlalchemy.exc import SQLAlchemyError
+from config.db import SessionLocal
+from config.metricas import registro
+from schemas.usuario import ApuestaUsuarioBaseModel
+from services.apuestas import registrar_lote
+
+
+# Ingesta agrupada de POST /sala/apostar (1 = activada): las apuestas de peticiones concurrentes
+# se confirman juntas en una transacción en lugar de una transacción por apuesta
+APUESTAS_AGRUPADAS = os.getenv("APUESTAS_AGRUPADAS", "0") == "1"
+
+# Máximo de apuestas por transacción y milisegundos que se espera a que se sumen más apuestas
+# a la primera del lote
+INGESTA_LOTE = int(os.getenv("INGESTA_LOTE", "200"))
+INGESTA_ESPERA = float(os.getenv("INGESTA_ESPERA_MS", "5")) / 1000
+
+logger = logging.getLogger("gambling.ingesta")
+
+
+# Cola en memoria de apuestas individuales y una tarea escritora que las vuelca en micro-lotes
+# con registrar_lote (validaciones por lote, un INSERT de varias filas y un único UPDATE de
+# saldos). Cada petición espera el resultado de su propia apuesta.
+class IngestaApuestas:
+
+    def __init__(self):
+        self._cola: Optional[asyncio.Queue] = None
+        self._tarea: Optional[asyncio.Task] = None
+        self._lleno = asyncio.Event()
+
+    @property
+    def activa(self) -> bool:
+        return self._tarea is not None
+
+    def iniciar(self, activa: bool = APUESTAS_AGRUPADAS):
+        if activa:
+            self._cola = asyncio.Queue()
+            self._tarea = asyncio.create_task(self._ejecutar())
+
+    # Deja de aceptar apuestas y vuelca las que ya estaban en la cola antes de terminar
+    async def detener(self):
+        if self._tarea:
+            tarea, self._tarea = self._tarea, None
+            self._cola.put_nowait(None)
+            self._lleno.set()
+            await asyncio.gather(tarea, return_exceptions=True)
+
+    # Encola una apuesta y devuelve su resultado (mismo formato que cada elemento de registrar_lote)
+    async def registrar(self, apuesta: ApuestaUsuarioBaseModel) -> dict:
+        futuro = asyncio.get_running_loop().create_future()
+        self._cola.put_nowait((apuesta, futuro))
+        if self._cola.qsize() >= INGESTA_LOTE - 1:
+            self._lleno.set()
+        return await futuro
+
+    async def _ejecutar(self):
+        while True:
+            primera = await self._cola.get()
+            if primera is None:
+                return
+
+            # Espera hasta INGESTA_ESPERA a que se junten más apuestas, o menos si el lote se llena
+            if self._cola.qsize() < INGESTA_LOTE - 1:
+                self._lleno.clear()
+                try:
+                    await asyncio.wait_for(self._lleno.wait(), INGESTA_ESPERA)
+                except asyncio.TimeoutError:
+                    pass
+
+            lote = [primera]
+            terminar = False
+            while len(lote) < INGESTA_LOTE and not self._cola.empty():
+                elemento = self._cola.get_nowait()
+                if elemento is None:
+                    terminar = True
+                    break
+                lote.append(elemento)
+
+            await self._volcar(lote)
+            if terminar:
+                return
+
+    async def _volcar(self, lote: list[tuple[ApuestaUsuarioBaseModel, asyncio.Future]]):
+        registro.incrementar("ingesta_lotes_total")
+        registro.incrementar("ingesta_apuestas_total", len(lote))
+        try:
+            async with SessionLocal() as db:
+                resultados = await registrar_lote(db, [apuesta for apuesta, _ in lote])
+        except SQLAlchemyError as error:
+            logger.exception("Error al volcar un lote de %d apuestas", len(lote))
+            if len(lote) == 1:
+                self._fallar(lote, error)
+                return
+            resultados = None
+        except Exception as error:
+            logger.exception("Error al volcar un lote de %d apuestas", len(lote))
+            self._fallar(lote, error)
+            return
+
+        if resultados is None:
+            # La transacción del lote es una sola: para que el error de una apuesta no haga fallar a
+            # las demás peticiones, se reintentan de a una (cada una con su transacción)
+            for elemento in lote:
+                await self._volcar([elemento])
+            return
+
+        for (_, futuro), resultado in zip(lote, resultados):
+            # El futuro puede estar cancelado si el cliente se desconectó mientras esperaba
+            if not futuro.done():
+                futuro.set_result(resultado)
+
+    def _fallar(self, lote: list[tuple[ApuestaUsuarioBaseModel, asyncio.Future]], error: Exception):
+        for _, futuro in lote:
+            if not futuro.done():
+                futuro.set_exception(error)
+
+
+ingesta_apuestas = IngestaApuestas()
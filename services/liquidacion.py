@@ -0,0 +1,322 @@
+import os
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Optional
+from fastapi import status, HTTPException
+from sqlalchemy import select, insert, update, case, literal, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import func
+from config.metricas import registro
+from models.global_models import Apuesta, ApuestaUsuario, ApuestaArchivo, Usuario, TrabajoLiquidacion, MovimientoSaldo
+from prolog.evento_ruleta import tirar_ruleta, ganancia
+from services.catalogo import catalogo, OpcionCatalogo
+from services.pozos import tracker_salas
+from services.difusion import difusor_salas
+from services.salas import generar_codigos_libres
+from services.saldos import MOVIMIENTO_PREMIO
+from services.estadisticas import registrar_liquidacion
+
+
+# Segundos que un trabajador tiene reservado un trabajo; si no lo termina (p. ej. porque el
+# proceso murió), otro trabajador puede tomarlo al vencer
+LIQUIDACION_TURNO = float(os.getenv("LIQUIDACION_TURNO", "60"))
+
+# Intentos antes de dar un trabajo por fallido
+LIQUIDACION_MAX_INTENTOS = int(os.getenv("LIQUIDACION_MAX_INTENTOS", "5"))
+
+
+def ahora_utc() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+# Fase 1 del cierre: bloquea la sala para nuevas apuestas y encola su liquidación.
+# Es rápida y no depende del tamaño de la sala.
+async def cerrar_sala_y_encolar(db: AsyncSession, codigo_sala: str) -> TrabajoLiquidacion:
+
+    # Bloquear la fila de la sala: las apuestas toman un bloqueo compartido sobre ella,
+    # así que ninguna apuesta tardía puede entrar después del cierre
+    sala_db = (await db.execute(
+        select(Apuesta).filter(Apuesta.codigo_sala == codigo_sala).with_for_update()
+    )).scalars().first()
+
+    if not sala_db:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Sala no encontrada")
+
+    if not sala_db.is_abierta:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="La sala ya está cerrada")
+
+    sala_db.is_abierta = False
+    trabajo = TrabajoLiquidacion(id_apuesta=sala_db.id, estado="pendiente", intentos=0)
+    db.add(trabajo)
+    await db.commit()
+
+    # La sala ya no recibe apuestas: liberar sus agregados en memoria
+    tracker_salas.descartar(codigo_sala)
+
+    return trabajo
+
+
+# Abre en bloque la sala de la ronda siguiente de cada sala continua cuyo cierre cae antes de
+# `hasta` (hasta `limite` por llamada). La sala nueva hereda la continuidad y la anterior solo
+# queda pendiente de su cierre, así que cada ronda se abre una sola vez aunque la agenda se
+# reinicie. Devuelve las salas nuevas.
+async def abrir_rondas_siguientes(db: AsyncSession, hasta: datetime, limite: int) -> list[Apuesta]:
+    salas = (await db.execute(
+        select(Apuesta)
+        .filter(Apuesta.is_abierta == True, Apuesta.intervalo_segundos != None, Apuesta.cierra_en <= hasta)
+        .order_by(Apuesta.cierra_en)
+        .limit(limite)
+        .with_for_update(skip_locked=True)
+    )).scalars().all()
+
+    if not salas:
+        await db.rollback()
+        return []
+
+    codigos = await generar_codigos_libres(db, len(salas))
+    siguientes = []
+    for sala_db, codigo_sala in zip(salas, codigos):
+        # La ronda siguiente mantiene la cadencia; si la agenda estuvo detenida, se saltan
+        # las rondas que ya vencieron en lugar de abrir salas que habría que cerrar enseguida
+        intervalo = timedelta(seconds=sala_db.intervalo_segundos)
+        cierra_en = sala_db.cierra_en + intervalo
+        if cierra_en <= hasta:
+            cierra_en += intervalo * ((hasta - cierra_en) // intervalo + 1)
+
+        siguientes.append(Apuesta(
+            codigo_sala=codigo_sala,
+            id_juego=sala_db.id_juego,
+            cierra_en=cierra_en,
+            intervalo_segundos=sala_db.intervalo_segundos,
+        ))
+        sala_db.intervalo_segundos = None
+
+    db.add_all(siguientes)
+    await db.commit()
+    return siguientes
+
+
+# Cierra en bloque las salas cuyo cierre automático ya venció (hasta `limite` por llamada) y
+# encola sus liquidaciones. SKIP LOCKED evita que dos procesos con agenda cierren la misma
+# sala. Devuelve los códigos cerrados.
+async def cerrar_salas_vencidas(db: AsyncSession, ahora: datetime, limite: int) -> list[str]:
+    salas = (await db.execute(
+        select(Apuesta)
+        .filter(Apuesta.is_abierta == True, Apuesta.cierra_en <= ahora)
+        .order_by(Apuesta.cierra_en)
+        .limit(limite)
+        .with_for_update(skip_locked=True)
+    )).scalars().all()
+
+    if not salas:
+        await db.rollback()
+        return []
+
+    for sala_db in salas:
+        sala_db.is_abierta = False
+
+    await db.execute(insert(TrabajoLiquidacion), [
+        {"id_apuesta": sala_db.id, "estado": "pendiente", "intentos": 0} for sala_db in salas
+    ])
+    await db.commit()
+
+    codigos = [sala_db.codigo_sala for sala_db in salas]
+    for codigo_sala in codigos:
+        tracker_salas.descartar(codigo_sala)
+
+    return codigos
+
+
+# Reserva el siguiente trabajo disponible (pendiente, o en proceso con el turno vencido).
+# SKIP LOCKED permite que varios trabajadores consulten la cola a la vez sin esperarse.
+async def reservar_trabajo(db: AsyncSession, trabajador: str) -> Optional[int]:
+    ahora = ahora_utc()
+
+    # Los que vencieron en su último intento (p. ej. murió el proceso) ya no se reintentan: se dan
+    # por fallidos en vez de quedar en_proceso para siempre
+    vencidos = (await db.execute(
+        select(TrabajoLiquidacion.id)
+        .filter(
+            TrabajoLiquidacion.estado == "en_proceso",
+            TrabajoLiquidacion.bloqueado_hasta < ahora,
+            TrabajoLiquidacion.intentos >= LIQUIDACION_MAX_INTENTOS,
+        )
+        .with_for_update(skip_locked=True)
+    )).scalars().all()
+    if vencidos:
+        await db.execute(
+            update(TrabajoLiquidacion)
+            .where(TrabajoLiquidacion.id.in_(vencidos))
+            .values(estado="fallido", bloqueado_hasta=None, error="Turno vencido en el último intento")
+            .execution_options(synchronize_session=False)
+        )
+        registro.incrementar("liquidacion_trabajos_fallidos_total", len(vencidos), "turno_vencido")
+
+    trabajo = (await db.execute(
+        select(TrabajoLiquidacion)
+        .filter(
+            or_(
+                TrabajoLiquidacion.estado == "pendiente",
+                and_(TrabajoLiquidacion.estado == "en_proceso", TrabajoLiquidacion.bloqueado_hasta < ahora),
+            ),
+            TrabajoLiquidacion.intentos < LIQUIDACION_MAX_INTENTOS,
+        )
+        .order_by(TrabajoLiquidacion.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )).scalars().first()
+
+    if not trabajo:
+        await db.commit()
+        return None
+
+    trabajo.estado = "en_proceso"
+    trabajo.intentos += 1
+    trabajo.trabajador = trabajador
+    trabajo.bloqueado_hasta = ahora + timedelta(seconds=LIQUIDACION_TURNO)
+    await db.commit()
+    return trabajo.id
+
+
+# Fase 2 del cierre: tira la ruleta y reparte las ganancias de la sala de un trabajo.
+# El pago y la finalización del trabajo se confirman en la misma transacción, y una sala con
+# resultado ya no se vuelve a pagar, así que reintentar un trabajo es seguro.
+async def liquidar_trabajo(db: AsyncSession, id_trabajo: int) -> Optional[OpcionCatalogo]:
+    trabajo = (await db.execute(
+        select(TrabajoLiquidacion).filter(TrabajoLiquidacion.id == id_trabajo).with_for_update()
+    )).scalars().first()
+    if not trabajo or trabajo.estado == "completado":
+        await db.rollback()
+        return None
+
+    sala_db = (await db.execute(
+        select(Apuesta).filter(Apuesta.id == trabajo.id_apuesta).with_for_update()
+    )).scalars().first()
+
+    opcion_resultado = None
+    if sala_db.resultado is None:
+        opcion_resultado = await pagar_sala(db, sala_db)
+
+    trabajo.estado = "completado"
+    trabajo.bloqueado_hasta = None
+    trabajo.error = None
+    trabajo.completado_en = ahora_utc()
+    await db.commit()
+
+    # Los streams de otros procesos reciben el resultado con el refresco del difusor
+    if opcion_resultado:
+        difusor_salas.publicar_resultado(sala_db.codigo_sala, opcion_resultado.id, opcion_resultado.nombre_opcion)
+
+    return opcion_resultado
+
+
+# Registra el error de un intento; el trabajo vuelve a la cola hasta agotar los intentos
+async def registrar_fallo(db: AsyncSession, id_trabajo: int, error: Exception):
+    trabajo = await db.get(TrabajoLiquidacion, id_trabajo)
+    if not trabajo or trabajo.estado == "completado":
+        return
+
+    trabajo.estado = "fallido" if trabajo.intentos >= LIQUIDACION_MAX_INTENTOS else "pendiente"
+    trabajo.bloqueado_hasta = None
+    trabajo.error = str(error)[:500]
+    await db.commit()
+
+    if trabajo.estado == "fallido":
+        registro.incrementar("liquidacion_trabajos_fallidos_total", 1, "error")
+
+
+# Liquida una sala ya bloqueada con un número fijo de sentencias, sin importar cuántos
+# ganadores tenga. No confirma la transacción. Devuelve la opción ganadora.
+async def pagar_sala(db: AsyncSession, sala_db: Apuesta) -> OpcionCatalogo:
+
+    resultado_ruleta = tirar_ruleta()
+
+    # Opción ganadora resuelta desde el catálogo en memoria (sin recorrer la tabla con ilike)
+    opcion_resultado = await catalogo.opcion_por_nombre(db, sala_db.id_juego, resultado_ruleta)
+
+    if not opcion_resultado:
+        raise HTTPException(status_code=404, detail="No se encontró ninguna opción de apuesta con los criterios especificados.")
+
+    # Totales del pozo en una sola pasada: lo apostado por todos y lo apostado por los ganadores
+    suma_valores_totales, suma_valores_ganadores = (await db.execute(select(
+        func.sum(ApuestaUsuario.monto_apostado),
+        func.sum(case((ApuestaUsuario.opcion_apuesta == opcion_resultado.id, ApuestaUsuario.monto_apostado), else_=0)),
+    ).filter(ApuestaUsuario.id_apuesta == sala_db.id))).one()
+
+    if suma_valores_ganadores:
+        filtro_ganadores = (
+            ApuestaUsuario.id_apuesta == sala_db.id,
+            ApuestaUsuario.opcion_apuesta == opcion_resultado.id,
+        )
+
+        # ganancia(A_i, A_color, A_total) = A_i * (A_total / A_color); el factor se calcula
+        # una vez en Decimal para no perder precisión en la división del motor
+        factor = ganancia(Decimal(1), Decimal(suma_valores_ganadores), Decimal(suma_valores_totales))
+
+        # Marcar a todos los ganadores con su premio
+        await db.execute(
+            update(ApuestaUsuario)
+            .where(*filtro_ganadores)
+            .values(is_gano=True, monto_ganado=func.round(ApuestaUsuario.monto_apostado * factor, 2))
+            .execution_options(synchronize_session=False)
+        )
+
+        # Acreditar los premios con un único UPDATE ... JOIN sobre Usuario
+        await db.execute(
+            update(Usuario)
+            .where(Usuario.id == ApuestaUsuario.id_usuario, *filtro_ganadores)
+            .values(saldo_actual=Usuario.saldo_actual + ApuestaUsuario.monto_ganado)
+            .execution_options(synchronize_session=False)
+        )
+
+        # Un movimiento del libro de saldos por premio, con un único INSERT ... SELECT
+        await db.execute(insert(MovimientoSaldo).from_select(
+            ["id_usuario", "id_apuesta", "tipo", "monto"],
+            select(ApuestaUsuario.id_usuario, ApuestaUsuario.id_apuesta, literal(MOVIMIENTO_PREMIO), ApuestaUsuario.monto_ganado)
+            .filter(*filtro_ganadores)
+        ))
+
+    # Resultado de cada apuesta en las estadísticas de los jugadores
+    await registrar_liquidacion(db, sala_db.id, ahora_utc())
+
+    sala_db.is_abierta = False
+    sala_db.resultado = opcion_resultado.id
+
+    return opcion_resultado
+
+
+# Estado de la liquidación de una sala, para consultar el progreso del cierre
+async def estado_liquidacion(db: AsyncSession, codigo_sala: str) -> dict:
+    fila = (await db.execute(
+        select(Apuesta, TrabajoLiquidacion)
+        .outerjoin(TrabajoLiquidacion, TrabajoLiquidacion.id_apuesta == Apuesta.id)
+        .filter(Apuesta.codigo_sala == codigo_sala)
+    )).first()
+
+    if not fila:
+        # Las salas archivadas ya están liquidadas
+        sala_db = (await db.execute(
+            select(ApuestaArchivo).filter(ApuestaArchivo.codigo_sala == codigo_sala)
+        )).scalars().first()
+        if not sala_db:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Sala no encontrada")
+        fila = (sala_db, None)
+
+    sala_db, trabajo = fila
+    if not trabajo:
+        if sala_db.is_abierta:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="La sala no tiene una liquidación en curso")
+        # Sala archivada o liquidada antes de que existiera la cola
+        estado = {"codigo_sala": codigo_sala, "estado": "completado", "intentos": None, "error": None, "completado_en": None}
+    else:
+        estado = {
+            "codigo_sala": codigo_sala,
+            "estado": trabajo.estado,
+            "intentos": trabajo.intentos,
+            "error": trabajo.error,
+            "completado_en": trabajo.completado_en,
+        }
+
+    opcion = await catalogo.opcion(db, sala_db.resultado) if sala_db.resultado else None
+    estado["resultado"] = opcion.nombre_opcion if opcion else None
+    return estado
@@ -0,0 +1,36 @@
+import base64
+import json
+from datetime import datetime
+from fastapi import status, HTTPException
+
+
+# Tamaño de página por defecto y máximo para los listados paginados
+LIMITE_POR_DEFECTO = 50
+LIMITE_MAXIMO = 200
+
+
+# Codifica la última clave de orden de una página como un cursor opaco
+def codificar_cursor(*valores) -> str:
+    crudo = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in valores])
+    return base64.urlsafe_b64encode(crudo.encode()).decode()
+
+
+# Decodifica un cursor y comprueba que tenga un valor de cada tipo de `tipos`, en orden; los de
+# tipo datetime viajan como texto ISO y se convierten de vuelta. Un cursor con otra forma es un 400.
+def decodificar_cursor(cursor: str, tipos: tuple[type, ...]) -> list:
+    try:
+        valores = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(valores, list) or len(valores) != len(tipos):
+            raise ValueError("Cantidad de valores del cursor incorrecta")
+
+        for i, tipo in enumerate(tipos):
+            if tipo is datetime:
+                valores[i] = datetime.fromisoformat(valores[i])
+            elif not isinstance(valores[i], tipo) or isinstance(valores[i], bool):
+                raise TypeError("Tipo de valor del cursor incorrecto")
+        return valores
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cursor de paginación no válido"
+        )
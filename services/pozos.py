@@ -0,0 +1,155 @@
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import func
+from models.global_models import Apuesta, ApuestaUsuario
+from services.catalogo import catalogo
+
+
+# Segundos que una sala en memoria se considera vigente antes de reconstruirla desde la base de
+# datos. Con varios workers cada proceso tiene su propio tracker, así que el TTL acota cuánto
+# tiempo puede ignorar las apuestas registradas por otro proceso (0 = sin vencimiento).
+SALAS_CACHE_TTL = float(os.getenv("SALAS_CACHE_TTL", "5"))
+
+
+@dataclass
+class PozoSala:
+    id_apuesta: int
+    codigo_sala: str
+    id_juego: int
+    nombre_juego: str
+    opciones_apuesta: list[dict]
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+    cierra_en: Optional[datetime] = None
+    total_apostado: Decimal = Decimal(0)
+    por_opcion: dict[int, Decimal] = field(default_factory=dict)
+    jugadores: set[int] = field(default_factory=set)
+    cargado_en: float = field(default_factory=time.monotonic)
+
+    @property
+    def cantidad_jugadores(self) -> int:
+        return len(self.jugadores)
+
+    def como_dict(self) -> dict:
+        return {
+            "codigo_sala": self.codigo_sala,
+            "is_abierta": True,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "cierra_en": self.cierra_en,
+            "nombre_juego": self.nombre_juego,
+            "opciones_apuesta": self.opciones_apuesta,
+            "cantidad_jugadores": self.cantidad_jugadores,
+            "total_apostado": float(self.total_apostado),
+        }
+
+
+# Agregados por sala abierta (total apostado, total por opción y jugadores), mantenidos en
+# memoria para responder consultas y simulaciones sin recorrer Apuesta_Usuario
+class TrackerSalas:
+
+    def __init__(self):
+        self._salas: dict[str, PozoSala] = {}
+
+    def _vigente(self, pozo: PozoSala) -> bool:
+        return SALAS_CACHE_TTL <= 0 or time.monotonic() - pozo.cargado_en < SALAS_CACHE_TTL
+
+    # Devuelve el pozo de una sala abierta; None si no existe o está cerrada
+    async def obtener(self, db: AsyncSession, codigo_sala: str) -> Optional[PozoSala]:
+        pozo = self._salas.get(codigo_sala)
+        if pozo and self._vigente(pozo):
+            return pozo
+        return await self.reconstruir(db, codigo_sala)
+
+    async def reconstruir(self, db: AsyncSession, codigo_sala: str) -> Optional[PozoSala]:
+        sala = (await db.execute(
+            select(Apuesta).filter(Apuesta.codigo_sala == codigo_sala, Apuesta.is_abierta == True)
+        )).scalars().first()
+
+        if not sala:
+            self._salas.pop(codigo_sala, None)
+            return None
+
+        salas = await self._construir(db, [sala])
+        return salas[0]
+
+    # Carga todas las salas abiertas (al iniciar la aplicación) con un número fijo de consultas
+    async def cargar(self, db: AsyncSession):
+        registros = (await db.execute(
+            select(Apuesta).filter(Apuesta.is_abierta == True)
+        )).scalars().all()
+
+        self._salas.clear()
+        if registros:
+            await self._construir(db, registros)
+
+    async def _construir(self, db: AsyncSession, registros: list[Apuesta]) -> list[PozoSala]:
+        ids_apuesta = [sala.id for sala in registros]
+
+        # Nombre del juego y opciones desde el catálogo en memoria
+        salas = {}
+        for sala in registros:
+            opciones = await catalogo.opciones_juego(db, sala.id_juego)
+            salas[sala.id] = PozoSala(
+                id_apuesta=sala.id,
+                codigo_sala=sala.codigo_sala,
+                id_juego=sala.id_juego,
+                nombre_juego=await catalogo.nombre_juego(db, sala.id_juego),
+                opciones_apuesta=[{"id": o.id, "nombre_opcion": o.nombre_opcion} for o in opciones],
+                created_at=sala.created_at,
+                updated_at=sala.updated_at,
+                cierra_en=sala.cierra_en,
+            )
+
+        # Total apostado por sala y opción
+        totales = (await db.execute(
+            select(ApuestaUsuario.id_apuesta, ApuestaUsuario.opcion_apuesta, func.sum(ApuestaUsuario.monto_apostado))
+            .filter(ApuestaUsuario.id_apuesta.in_(ids_apuesta))
+            .group_by(ApuestaUsuario.id_apuesta, ApuestaUsuario.opcion_apuesta)
+        )).all()
+        for id_apuesta, opcion, total in totales:
+            pozo = salas[id_apuesta]
+            pozo.por_opcion[opcion] = Decimal(total)
+            pozo.total_apostado += Decimal(total)
+
+        # Jugadores de cada sala
+        jugadores = (await db.execute(
+            select(ApuestaUsuario.id_apuesta, ApuestaUsuario.id_usuario)
+            .filter(ApuestaUsuario.id_apuesta.in_(ids_apuesta))
+            .distinct()
+        )).all()
+        for id_apuesta, id_usuario in jugadores:
+            salas[id_apuesta].jugadores.add(id_usuario)
+
+        for pozo in salas.values():
+            self._salas[pozo.codigo_sala] = pozo
+
+        return list(salas.values())
+
+    # Devuelve el pozo que haya en memoria, sin consultar la base de datos
+    def en_memoria(self, codigo_sala: str) -> Optional[PozoSala]:
+        return self._salas.get(codigo_sala)
+
+    # Actualiza los agregados con una apuesta ya confirmada en la base de datos
+    def registrar_apuesta(self, codigo_sala: str, id_usuario: int, opcion_apuesta: int, monto):
+        pozo = self._salas.get(codigo_sala)
+        if not pozo:
+            # Sin entrada en memoria: se reconstruirá desde la base de datos en la próxima consulta
+            return
+
+        monto = Decimal(str(monto))
+        pozo.total_apostado += monto
+        pozo.por_opcion[opcion_apuesta] = pozo.por_opcion.get(opcion_apuesta, Decimal(0)) + monto
+        pozo.jugadores.add(id_usuario)
+
+    def descartar(self, codigo_sala: str):
+        self._salas.pop(codigo_sala, None)
+
+
+tracker_salas = TrackerSalas()
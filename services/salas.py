@@ -0,0 +1,74 @@
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import select, insert, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.global_models import Apuesta, ApuestaArchivo
+from prolog.evento_ruleta import generar_codigo_sala
+
+
+# Intentos para crear un lote de salas si otro proceso inserta el mismo código entre la
+# verificación y el INSERT
+SALAS_REINTENTOS = 3
+
+# Códigos por consulta IN al verificar y filas por INSERT al crear
+SALAS_LOTE = 1000
+
+
+# Genera `cantidad` códigos distintos que no existen en Apuesta ni en Apuesta_Archivo (un código
+# archivado se sigue buscando por código y no puede repetirse al archivar otra sala). Los
+# candidatos se verifican en bloque (una consulta por cada SALAS_LOTE códigos) y solo se
+# regeneran los que chocan.
+async def generar_codigos_libres(db: AsyncSession, cantidad: int) -> list[str]:
+    codigos: set[str] = set()
+    while len(codigos) < cantidad:
+        candidatos: set[str] = set()
+        while len(candidatos) < cantidad - len(codigos):
+            codigo = generar_codigo_sala()
+            if codigo not in codigos:
+                candidatos.add(codigo)
+
+        lista = list(candidatos)
+        for inicio in range(0, len(lista), SALAS_LOTE):
+            tramo = lista[inicio:inicio + SALAS_LOTE]
+            existentes = (await db.execute(union_all(
+                select(Apuesta.codigo_sala).filter(Apuesta.codigo_sala.in_(tramo)),
+                select(ApuestaArchivo.codigo_sala).filter(ApuestaArchivo.codigo_sala.in_(tramo)),
+            ))).scalars().all()
+            candidatos.difference_update(existentes)
+
+        codigos |= candidatos
+
+    return list(codigos)
+
+
+# Crea `cantidad` salas de un juego en una sola transacción y devuelve sus códigos. Si otro
+# proceso crea un código igual antes del commit, la restricción única lo detecta y el lote
+# se reintenta completo con códigos nuevos.
+async def crear_salas(
+    db: AsyncSession,
+    id_juego: int,
+    cantidad: int,
+    cierra_en: Optional[datetime] = None,
+    intervalo_segundos: Optional[int] = None,
+) -> list[str]:
+    for intento in range(SALAS_REINTENTOS):
+        codigos = await generar_codigos_libres(db, cantidad)
+        try:
+            for inicio in range(0, cantidad, SALAS_LOTE):
+                await db.execute(insert(Apuesta), [
+                    {
+                        "codigo_sala": codigo,
+                        "id_juego": id_juego,
+                        "is_abierta": True,
+                        "cierra_en": cierra_en,
+                        "intervalo_segundos": intervalo_segundos,
+                    }
+                    for codigo in codigos[inicio:inicio + SALAS_LOTE]
+                ])
+            await db.commit()
+            return codigos
+        except IntegrityError:
+            await db.rollback()
+            if intento == SALAS_REINTENTOS - 1:
+                raise
@@ -0,0 +1,258 @@
+"""Libro de saldos: movimientos, snapshots y conciliación.
+
+Cada cambio de Usuario.saldo_actual registra un movimiento en Movimiento_Saldo en la misma
+transacción. Los snapshots guardan el saldo de cada usuario hasta un movimiento, así que
+verificar un saldo solo repasa la cola del libro posterior al último snapshot.
+
+Tareas de mantenimiento (también disponibles en /admin/saldos):
+
+    python -m services.saldos abrir       # saldo inicial de los usuarios sin movimientos
+    python -m services.saldos snapshot
+    python -m services.saldos conciliar
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+from decimal import Decimal
+from typing import Optional
+from sqlalchemy import select, insert, and_, exists, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import func
+from config.db import SessionLocal, engine
+from models.global_models import Usuario, MovimientoSaldo, SnapshotSaldo
+
+
+# Tipos de movimiento del libro
+MOVIMIENTO_SALDO_INICIAL = "saldo_inicial"
+MOVIMIENTO_APUESTA = "apuesta"
+MOVIMIENTO_PREMIO = "premio"
+MOVIMIENTO_REEMBOLSO = "reembolso"
+
+# Segundos entre snapshots automáticos del libro (0 = solo bajo demanda)
+SALDOS_SNAPSHOT_INTERVALO = float(os.getenv("SALDOS_SNAPSHOT_INTERVALO", "3600"))
+
+# Usuarios por transacción de un snapshot (quedan bloqueados mientras se calcula el suyo)
+SALDOS_SNAPSHOT_LOTE = 1000
+
+# Filas por lote del cursor de la conciliación y máximo de diferencias que se reportan
+SALDOS_LOTE_CONCILIACION = 5000
+SALDOS_MAX_DIFERENCIAS = 100
+
+CENTAVO = Decimal("0.01")
+
+logger = logging.getLogger("gambling.saldos")
+
+
+def _decimal(valor) -> Decimal:
+    return Decimal(str(valor)) if valor is not None else Decimal(0)
+
+
+# Registra como saldo inicial el saldo actual de los usuarios que aún no tienen movimientos
+# (usuarios nuevos, o los que existían antes del libro) con un INSERT ... SELECT. No confirma
+# la transacción. Devuelve cuántos usuarios se registraron.
+async def registrar_saldo_inicial(db: AsyncSession, *filtros) -> int:
+    sin_movimientos = ~exists().where(MovimientoSaldo.id_usuario == Usuario.id)
+    resultado = await db.execute(insert(MovimientoSaldo).from_select(
+        ["id_usuario", "tipo", "monto"],
+        select(Usuario.id, literal(MOVIMIENTO_SALDO_INICIAL), Usuario.saldo_actual).filter(sin_movimientos, *filtros)
+    ))
+    return resultado.rowcount
+
+
+# Último snapshot de cada usuario (id_usuario, id_movimiento, saldo)
+def ultimos_snapshots():
+    ultimo = (
+        select(SnapshotSaldo.id_usuario, func.max(SnapshotSaldo.id_movimiento).label("id_movimiento"))
+        .group_by(SnapshotSaldo.id_usuario)
+        .subquery()
+    )
+    return (
+        select(SnapshotSaldo.id_usuario, SnapshotSaldo.id_movimiento, SnapshotSaldo.saldo)
+        .join(ultimo, and_(
+            SnapshotSaldo.id_usuario == ultimo.c.id_usuario,
+            SnapshotSaldo.id_movimiento == ultimo.c.id_movimiento,
+        ))
+        .subquery()
+    )
+
+
+# Saldo de un usuario según el libro: último snapshot más los movimientos posteriores
+async def verificar_saldo(db: AsyncSession, id_usuario: int, saldo_actual) -> dict:
+    snapshot = (await db.execute(
+        select(SnapshotSaldo)
+        .filter(SnapshotSaldo.id_usuario == id_usuario)
+        .order_by(SnapshotSaldo.id_movimiento.desc())
+        .limit(1)
+    )).scalars().first()
+
+    desde = snapshot.id_movimiento if snapshot else 0
+    monto_cola, movimientos = (await db.execute(
+        select(func.sum(MovimientoSaldo.monto), func.count())
+        .filter(MovimientoSaldo.id_usuario == id_usuario, MovimientoSaldo.id > desde)
+    )).one()
+
+    saldo_libro = (_decimal(snapshot.saldo if snapshot else None) + _decimal(monto_cola)).quantize(CENTAVO)
+    saldo_actual = _decimal(saldo_actual).quantize(CENTAVO)
+    return {
+        "saldo_actual": saldo_actual,
+        "saldo_libro": saldo_libro,
+        "diferencia": saldo_actual - saldo_libro,
+        "snapshot": {
+            "id_movimiento": snapshot.id_movimiento,
+            "saldo": snapshot.saldo,
+            "created_at": snapshot.created_at,
+        } if snapshot else None,
+        "movimientos_repasados": movimientos,
+    }
+
+
+# Movimientos posteriores al último snapshot de cada usuario
+def _movimientos_pendientes(snapshots):
+    return (
+        select(MovimientoSaldo.id_usuario)
+        .outerjoin(snapshots, snapshots.c.id_usuario == MovimientoSaldo.id_usuario)
+        .filter(MovimientoSaldo.id > func.coalesce(snapshots.c.id_movimiento, 0))
+    )
+
+
+# Guarda un snapshot de los usuarios con movimientos desde su snapshot anterior, hasta su último
+# movimiento. Los movimientos se insertan en la transacción que actualiza Usuario.saldo_actual y
+# después del UPDATE, así que con las filas de Usuario bloqueadas (FOR UPDATE) no quedan movimientos
+# suyos sin confirmar ni pueden llegar otros: el corte de cada usuario es su último movimiento
+# visible en esa transacción. Va por lotes de SALDOS_SNAPSHOT_LOTE usuarios, un INSERT ... SELECT
+# por lote, y devuelve el mayor corte.
+async def tomar_snapshots() -> dict:
+    snapshots = ultimos_snapshots()
+    async with SessionLocal() as db:
+        ids = (await db.execute(
+            _movimientos_pendientes(snapshots).group_by(MovimientoSaldo.id_usuario).order_by(MovimientoSaldo.id_usuario)
+        )).scalars().all()
+
+    corte = None
+    usuarios = 0
+    for inicio in range(0, len(ids), SALDOS_SNAPSHOT_LOTE):
+        lote = ids[inicio:inicio + SALDOS_SNAPSHOT_LOTE]
+        async with SessionLocal() as db:
+            await db.execute(select(Usuario.id).filter(Usuario.id.in_(lote)).order_by(Usuario.id).with_for_update())
+
+            snapshots = ultimos_snapshots()
+            nuevos = (
+                _movimientos_pendientes(snapshots)
+                .add_columns(
+                    func.max(MovimientoSaldo.id),
+                    func.coalesce(func.max(snapshots.c.saldo), 0) + func.sum(MovimientoSaldo.monto),
+                )
+                .filter(MovimientoSaldo.id_usuario.in_(lote))
+                .group_by(MovimientoSaldo.id_usuario)
+            )
+            resultado = await db.execute(
+                insert(SnapshotSaldo).from_select(["id_usuario", "id_movimiento", "saldo"], nuevos)
+            )
+            corte_lote = (await db.execute(
+                select(func.max(SnapshotSaldo.id_movimiento)).filter(SnapshotSaldo.id_usuario.in_(lote))
+            )).scalar()
+            await db.commit()
+
+        usuarios += resultado.rowcount
+        corte = max(corte or 0, corte_lote or 0) or None
+
+    return {"corte": corte, "usuarios": usuarios}
+
+
+# Compara saldo_actual con el saldo del libro de todos los usuarios en una sola consulta leída
+# por lotes del cursor del servidor (memoria constante). Devuelve totales y las primeras
+# SALDOS_MAX_DIFERENCIAS diferencias.
+async def conciliar(maximo_diferencias: int = SALDOS_MAX_DIFERENCIAS) -> dict:
+    snapshots = ultimos_snapshots()
+    colas = (
+        select(MovimientoSaldo.id_usuario, func.sum(MovimientoSaldo.monto).label("monto"))
+        .outerjoin(snapshots, snapshots.c.id_usuario == MovimientoSaldo.id_usuario)
+        .filter(MovimientoSaldo.id > func.coalesce(snapshots.c.id_movimiento, 0))
+        .group_by(MovimientoSaldo.id_usuario)
+        .subquery()
+    )
+    ultimos = ultimos_snapshots()
+    consulta = (
+        select(Usuario.uuid, Usuario.nickname, Usuario.saldo_actual, ultimos.c.saldo.label("saldo_snapshot"), colas.c.monto.label("monto_cola"))
+        .outerjoin(ultimos, ultimos.c.id_usuario == Usuario.id)
+        .outerjoin(colas, colas.c.id_usuario == Usuario.id)
+    )
+
+    usuarios = 0
+    total_diferencias = 0
+    diferencias = []
+    async with SessionLocal() as db:
+        resultado = await db.stream(consulta.execution_options(yield_per=SALDOS_LOTE_CONCILIACION))
+        async for lote in resultado.partitions():
+            for fila in lote:
+                usuarios += 1
+                saldo_libro = (_decimal(fila.saldo_snapshot) + _decimal(fila.monto_cola)).quantize(CENTAVO)
+                saldo_actual = _decimal(fila.saldo_actual).quantize(CENTAVO)
+                if saldo_actual == saldo_libro:
+                    continue
+
+                total_diferencias += 1
+                if len(diferencias) < maximo_diferencias:
+                    diferencias.append({
+                        "uuid": fila.uuid,
+                        "nickname": fila.nickname,
+                        "saldo_actual": saldo_actual,
+                        "saldo_libro": saldo_libro,
+                        "diferencia": saldo_actual - saldo_libro,
+                    })
+
+    return {"usuarios": usuarios, "total_diferencias": total_diferencias, "diferencias": diferencias}
+
+
+# Snapshots periódicos dentro de la API (cada SALDOS_SNAPSHOT_INTERVALO segundos)
+class SnapshotsSaldo:
+
+    def __init__(self):
+        self._tarea: Optional[asyncio.Task] = None
+
+    def iniciar(self):
+        if SALDOS_SNAPSHOT_INTERVALO > 0:
+            self._tarea = asyncio.create_task(self._ejecutar())
+
+    async def detener(self):
+        if self._tarea:
+            self._tarea.cancel()
+            await asyncio.gather(self._tarea, return_exceptions=True)
+            self._tarea = None
+
+    async def _ejecutar(self):
+        while True:
+            await asyncio.sleep(SALDOS_SNAPSHOT_INTERVALO)
+            try:
+                resumen = await tomar_snapshots()
+                logger.info("Snapshot de saldos hasta el movimiento %s: %d usuarios", resumen["corte"], resumen["usuarios"])
+            except Exception:
+                logger.exception("Error al tomar el snapshot de saldos")
+
+
+snapshots_saldo = SnapshotsSaldo()
+
+
+async def _ejecutar_tarea(tarea: str):
+    try:
+        if tarea == "abrir":
+            async with SessionLocal() as db:
+                usuarios = await registrar_saldo_inicial(db)
+                await db.commit()
+            resultado = {"usuarios": usuarios}
+        elif tarea == "snapshot":
+            resultado = await tomar_snapshots()
+        else:
+            resultado = await conciliar()
+        print(json.dumps(resultado, default=str, indent=2))
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mantenimiento del libro de saldos")
+    parser.add_argument("tarea", choices=("abrir", "snapshot", "conciliar"))
+    args = parser.parse_args()
+    asyncio.run(_ejecutar_tarea(args.tarea))
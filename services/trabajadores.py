@@ -0,0 +1,127 @@
+"""Trabajadores de liquidación: toman trabajos de la tabla Trabajo_Liquidacion y pagan las salas.
+
+Dentro de la API corren como tareas del event loop (LIQUIDACION_WORKERS). También pueden
+correr en procesos aparte, sin la API, coordinados por la misma tabla:
+
+    python -m services.trabajadores [--procesos 2] [--trabajadores 1]
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import socket
+from config.db import SessionLocal, engine
+from services.catalogo import catalogo
+from services.liquidacion import reservar_trabajo, liquidar_trabajo, registrar_fallo
+
+
+# Trabajadores de liquidación que arranca la API (0 = solo procesos externos)
+LIQUIDACION_WORKERS = int(os.getenv("LIQUIDACION_WORKERS", "1"))
+
+# Segundos entre consultas a la cola cuando no hay trabajos (los cierres hechos por esta misma
+# API despiertan a los trabajadores de inmediato)
+LIQUIDACION_INTERVALO = float(os.getenv("LIQUIDACION_INTERVALO", "2"))
+
+logger = logging.getLogger("gambling.liquidacion")
+
+
+class TrabajadoresLiquidacion:
+
+    def __init__(self):
+        self._tareas: list[asyncio.Task] = []
+        self._despertar = asyncio.Event()
+        self._detenido = False
+
+    def iniciar(self, cantidad: int = LIQUIDACION_WORKERS, prefijo: str = ""):
+        self._detenido = False
+        prefijo = prefijo or f"{socket.gethostname()}:{os.getpid()}"
+        for i in range(cantidad):
+            self._tareas.append(asyncio.create_task(self._trabajar(f"{prefijo}:{i}")))
+
+    async def esperar(self):
+        await asyncio.gather(*self._tareas)
+
+    async def detener(self):
+        self._detenido = True
+        self._despertar.set()
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas.clear()
+
+    # Avisa que hay un trabajo nuevo en la cola
+    def despertar(self):
+        self._despertar.set()
+
+    async def _trabajar(self, nombre: str):
+        while not self._detenido:
+            try:
+                procesado = await self.procesar_siguiente(nombre)
+            except Exception:
+                logger.exception("Error al consultar la cola de liquidación")
+                procesado = False
+
+            if not procesado:
+                try:
+                    await asyncio.wait_for(self._despertar.wait(), LIQUIDACION_INTERVALO)
+                except asyncio.TimeoutError:
+                    pass
+                self._despertar.clear()
+
+    # Reserva y liquida un trabajo; devuelve False si la cola está vacía
+    async def procesar_siguiente(self, nombre: str) -> bool:
+        async with SessionLocal() as db:
+            id_trabajo = await reservar_trabajo(db, nombre)
+        if id_trabajo is None:
+            return False
+
+        try:
+            async with SessionLocal() as db:
+                await liquidar_trabajo(db, id_trabajo)
+        except Exception as e:
+            logger.exception("Error al liquidar el trabajo %s", id_trabajo)
+            async with SessionLocal() as db:
+                await registrar_fallo(db, id_trabajo, e)
+        return True
+
+
+trabajadores_liquidacion = TrabajadoresLiquidacion()
+
+
+async def _ejecutar_proceso(cantidad: int):
+    async with SessionLocal() as db:
+        await catalogo.recargar(db)
+
+    trabajadores_liquidacion.iniciar(cantidad)
+    try:
+        await trabajadores_liquidacion.esperar()
+    finally:
+        await trabajadores_liquidacion.detener()
+        await engine.dispose()
+
+
+def _proceso(cantidad: int):
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_ejecutar_proceso(cantidad))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trabajadores de liquidación de salas")
+    parser.add_argument("--procesos", type=int, default=1, help="procesos de trabajadores")
+    parser.add_argument("--trabajadores", type=int, default=1, help="trabajadores (tareas) por proceso")
+    args = parser.parse_args()
+
+    if args.procesos == 1:
+        _proceso(args.trabajadores)
+    else:
+        # Cada proceso crea su propio engine al primer uso (spawn, sin heredar conexiones)
+        contexto = multiprocessing.get_context("spawn")
+        procesos = [contexto.Process(target=_proceso, args=(args.trabajadores,)) for _ in range(args.procesos)]
+        for proceso in procesos:
+            proceso.start()
+        for proceso in procesos:
+            proceso.join()